@@ -25,3 +25,4 @@
 # wrapper
 from disent.dataset._base import DisentDataset
 from disent.dataset._base import DisentIterDataset
+from disent.dataset._base import make_data_profiler
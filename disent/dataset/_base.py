@@ -24,14 +24,18 @@
 
 import warnings
 from functools import wraps
+from typing import Any
 from typing import Callable
+from typing import Dict
 from typing import Iterator
+from typing import List
 from typing import Optional
 from typing import Sequence
 from typing import TypeVar
 from typing import Union
 
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 from torch.utils.data import IterableDataset
 from torch.utils.data.dataloader import default_collate
@@ -39,10 +43,12 @@ from torch.utils.data.dataloader import default_collate
 from disent.dataset.sampling import BaseDisentSampler
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling import SingleSampler
+from disent.dataset.transform.functional import apply_transform_batch
 from disent.dataset.wrapper import WrappedDataset
 from disent.util.deprecate import deprecated
 from disent.util.iters import LengthIter
 from disent.util.math.random import random_choice_prng
+from disent.util.profiling import StageProfiler
 
 
 # ========================================================================= #
@@ -88,6 +94,22 @@ def wrapped_only(func):
 _REF_ = object()
 
 
+DATA_PROFILER_STAGES = ('getitem', 'sample', 'read', 'transform', 'augment', 'collate')
+
+
+def make_data_profiler(max_workers: int = 32) -> StageProfiler:
+    """
+    Make a profiler for the stages of the `DisentDataset` pipeline:
+    - getitem:   the entire call to `__getitem__` or `__getitems__`
+    - sample:    drawing the indices from the sampler
+    - read:      reading the raw observations from the data
+    - transform: applying the transform to get the targets
+    - augment:   applying the augment to get the inputs
+    - collate:   only if the collate function is wrapped with `profiler.wrap(collate_fn, 'collate')`
+    """
+    return StageProfiler(DATA_PROFILER_STAGES, max_workers=max_workers)
+
+
 class DisentDataset(Dataset, LengthIter):
 
     def __init__(
@@ -98,6 +120,7 @@ class DisentDataset(Dataset, LengthIter):
         augment: Optional[callable] = None,
         return_indices: bool = False,  # doesn't really hurt performance, might as well leave enabled by default?
         return_factors: bool = False,
+        profiler: Optional[StageProfiler] = None,
     ):
         super().__init__()
         # save attributes
@@ -107,6 +130,7 @@ class DisentDataset(Dataset, LengthIter):
         self._augment = augment
         self._return_indices = return_indices
         self._return_factors = return_factors
+        self._profiler = profiler
         # check sampler
         assert isinstance(self._sampler, BaseDisentSampler), f'{DisentDataset.__name__} got an invalid {BaseDisentSampler.__name__}: {type(self._sampler)}'
         # initialize sampler
@@ -128,6 +152,7 @@ class DisentDataset(Dataset, LengthIter):
         augment: Optional[callable] = _REF_,
         return_indices: bool = _REF_,
         return_factors: bool = _REF_,
+        profiler: Optional[StageProfiler] = _REF_,
     ) -> 'DisentDataset':
         # instantiate shallow dataset copy, overwriting elements if specified
         return DisentDataset(
@@ -137,6 +162,7 @@ class DisentDataset(Dataset, LengthIter):
             augment        = self._augment               if (augment is _REF_)        else augment,
             return_indices = self._return_indices        if (return_indices is _REF_) else return_indices,
             return_factors = self._return_factors        if (return_factors is _REF_) else return_factors,
+            profiler       = self._profiler              if (profiler is _REF_)       else profiler,
         )
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -159,6 +185,16 @@ class DisentDataset(Dataset, LengthIter):
     def augment(self) -> Optional[Callable[[object], object]]:
         return self._augment
 
+    @property
+    def profiler(self) -> Optional[StageProfiler]:
+        return self._profiler
+
+    def _profiled(self, stage: str, fn, *args):
+        # callers check `self._profiler is None` first, so
+        # that there is no overhead when profiling is disabled
+        with self._profiler.stage(stage):
+            return fn(*args)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Ground Truth Only                                                     #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -233,13 +269,43 @@ class DisentDataset(Dataset, LengthIter):
         return len(self._dataset)
 
     def __getitem__(self, idx):
+        if self._profiler is not None:
+            return self._profiled('getitem', self._getitem, idx)
+        return self._getitem(idx)
+
+    def _getitem(self, idx):
         if self._sampler is not None:
-            idxs = self._sampler(idx)
+            idxs = self._sampler(idx) if (self._profiler is None) else self._profiled('sample', self._sampler, idx)
         else:
             idxs = (idx,)
         # get the observations
         return self._dataset_get_observation(*idxs)
 
+    def __getitems__(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        """
+        Get the observations for an entire batch of indices, using the sampler
+        to draw all the index tuples for the batch in one vectorized call.
+        - The `torch.utils.data.DataLoader` (torch>=2.0) calls this with each batch of
+          indices produced by its batch sampler instead of calling `__getitem__` for every
+          index, the resulting list is then passed to the `collate_fn` as usual.
+        """
+        if self._profiler is not None:
+            return self._profiled('getitem', self._getitems, indices)
+        return self._getitems(indices)
+
+    def _getitems(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        if self._profiler is None:
+            batch_idxs = self._sampler.sample_batch(indices)
+        else:
+            batch_idxs = self._profiled('sample', self._sampler.sample_batch, indices)
+        # get the observations
+        if not (self.is_ground_truth and (batch_idxs.size > 0)):
+            return [self._dataset_get_observation(*idxs) for idxs in batch_idxs.tolist()]
+        # read all the observations for ground truth data at once
+        n = self._sampler.num_samples
+        xs, xs_targ = self._dataset_get_batch(batch_idxs.reshape(-1), mode='pair')
+        return [self._make_observation(tuple(idxs), tuple(xs[i*n:(i+1)*n]), tuple(xs_targ[i*n:(i+1)*n])) for i, idxs in enumerate(batch_idxs.tolist())]
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Single Datapoints                                                     #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -247,13 +313,13 @@ class DisentDataset(Dataset, LengthIter):
     def _datapoint_raw_to_target(self, dat):
         x_targ = dat
         if self._transform is not None:
-            x_targ = self._transform(x_targ)
+            x_targ = self._transform(x_targ) if (self._profiler is None) else self._profiled('transform', self._transform, x_targ)
         return x_targ
 
     def _datapoint_target_to_input(self, x_targ):
         x = x_targ
         if self._augment is not None:
-            x = self._augment(x)
+            x = self._augment(x) if (self._profiler is None) else self._profiled('augment', self._augment, x)
             # some augmentations may convert a (C, H, W) to (1, C, H, W), undo this change
             # TODO: this should not be here! this should be handled by the user instead!
             x = _batch_to_observation(batch=x, obs_shape=x_targ.shape)
@@ -281,7 +347,7 @@ class DisentDataset(Dataset, LengthIter):
         except:
             raise TypeError(f'Indices must be integer-like ({type(idx)}): {idx}')
         # we do not support indexing by lists
-        x_raw = self._dataset[idx]
+        x_raw = self._dataset[idx] if (self._profiler is None) else self._profiled('read', self._dataset.__getitem__, idx)
         # return correct data
         if mode == 'pair':
             x_targ = self._datapoint_raw_to_target(x_raw)  # applies self.transform
@@ -305,6 +371,9 @@ class DisentDataset(Dataset, LengthIter):
 
     def _dataset_get_observation(self, *idxs):
         xs, xs_targ = zip(*(self.dataset_get(idx, mode='pair') for idx in idxs))
+        return self._make_observation(idxs, xs, xs_targ)
+
+    def _make_observation(self, idxs, xs, xs_targ):
         # handle cases
         obs = {'x_targ': xs_targ}
         # 5-10% faster
@@ -329,8 +398,37 @@ class DisentDataset(Dataset, LengthIter):
     # TODO: default_collate should be replaced with a function
     #      that can handle tensors and nd.arrays, and return accordingly
 
+    def _dataset_get_batch(self, indices: Sequence[int], mode: str):
+        """
+        Batched version of `dataset_get` for ground truth data, reading all the
+        observations at once and applying the transform to the entire batch.
+        - augment is still applied to each observation individually, random
+          augmentations would otherwise be shared across the batch.
+        """
+        if mode not in ('raw', 'target', 'input', 'pair'):
+            raise ValueError(f'Invalid {mode=}')
+        # get the observations
+        x_raw = self._dataset.get_observations(indices) if (self._profiler is None) else self._profiled('read', self._dataset.get_observations, indices)
+        if mode == 'raw':
+            return x_raw
+        if self._profiler is None:
+            x_targ = apply_transform_batch(self._transform, x_raw)  # applies self.transform
+        else:
+            x_targ = self._profiled('transform', apply_transform_batch, self._transform, x_raw)
+        if mode == 'target':
+            return x_targ
+        x = x_targ if (self._augment is None) else apply_transform_batch(self._datapoint_target_to_input, x_targ)  # applies self.augment
+        if mode == 'input':
+            return x
+        return x, x_targ
+
     def dataset_batch_from_indices(self, indices: Sequence[int], mode: str, collate: bool = True):
         """Get a batch of observations X from a batch of factors Y."""
+        # ground truth data can efficiently read & transform entire batches at once
+        if collate and self.is_ground_truth and (len(indices) > 0):
+            batch = self._dataset_get_batch(indices, mode=mode)
+            return [_collate_batch(b) for b in batch] if (mode == 'pair') else _collate_batch(batch)
+        # fallback to getting each observation individually
         batch = [self.dataset_get(idx, mode=mode) for idx in indices]
         return default_collate(batch) if collate else batch
 
@@ -387,6 +485,15 @@ class DisentIterDataset(IterableDataset, DisentDataset):
 # ========================================================================= #
 
 
+def _collate_batch(batch):
+    """
+    Convert an already stacked batch to the same format as `default_collate`
+    """
+    if isinstance(batch, np.ndarray):
+        return torch.as_tensor(batch)
+    return batch
+
+
 def _batch_to_observation(batch, obs_shape):
     """
     Convert a batch of size 1, to a single observation.
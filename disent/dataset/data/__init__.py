@@ -30,10 +30,13 @@ from disent.dataset.data._episodes__custom import EpisodesDownloadZippedPickledD
 # raw -- groundtruth
 from disent.dataset.data._groundtruth import ArrayGroundTruthData
 from disent.dataset.data._groundtruth import SelfContainedHdf5GroundTruthData
+from disent.dataset.data._groundtruth import MemmapGroundTruthData
 
 # raw
 from disent.dataset.data._raw import ArrayDataset
 from disent.dataset.data._raw import Hdf5Dataset
+from disent.dataset.data._raw import MemmapDataset
+from disent.dataset.data._raw import SharedMemoryDataset
 
 # groundtruth -- base
 from disent.dataset.data._groundtruth import GroundTruthData
@@ -27,6 +27,7 @@ import os
 from abc import ABCMeta
 from typing import Any
 from typing import List
+from typing import Literal
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
@@ -38,7 +39,15 @@ from torch.utils.data import Dataset
 from disent.dataset.util.datafile import DataFile
 from disent.dataset.util.datafile import DataFileHashedDlH5
 from disent.dataset.data._raw import Hdf5Dataset
+from disent.dataset.data._raw import MemmapDataset
+from disent.dataset.data._raw import SharedMemoryDataset
+from disent.dataset.transform.functional import apply_transform_batch
+from disent.dataset.util.memmap import memmap_load_meta
+from disent.dataset.util.npz import npy_open_stream
+from disent.dataset.util.npz import npy_read_into
+from disent.dataset.util.shm import shm_key
 from disent.dataset.util.state_space import StateSpace
+from disent.util.inout.hashing import hash_file
 from disent.util.inout.paths import ensure_dir_exists
 
 
@@ -130,6 +139,23 @@ class GroundTruthData(Dataset, StateSpace):
     def _get_observation(self, idx):
         raise NotImplementedError
 
+    def get_observations(self, idxs: Sequence[int]):
+        """
+        Get a batch of observations, applying the transform once to the entire batch.
+        - The results should be the same as stacking the individual observations from `__getitem__`
+        """
+        obs = self._get_observations(np.asarray(idxs, dtype='int64'))
+        if self._transform is not None:
+            obs = apply_transform_batch(self._transform, obs)
+        return obs
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        """
+        you can override this method to fetch a batch of observations at once!
+        - the default implementation falls back to calling `_get_observation` for each index
+        """
+        return np.stack([self._get_observation(idx) for idx in idxs.tolist()], axis=0)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # EXTRAS                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -193,6 +219,9 @@ class ArrayGroundTruthData(GroundTruthData):
         #       hindering multi-threaded environments?
         return self._array[idx]
 
+    def _get_observations(self, idxs: np.ndarray):
+        return self._array[idxs]
+
     @classmethod
     def new_like(cls, array, gt_data: GroundTruthData, array_chn_is_last: bool = True):
         # TODO: should this not copy the x_shape and transform?
@@ -269,23 +298,50 @@ class NumpyFileGroundTruthData(DiskGroundTruthData, metaclass=ABCMeta):
     - if the dataset is contained in a key, set the `data_key` property
     """
 
-    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, transform=None):
+    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, transform=None, in_memory: Union[bool, Literal['shared']] = True):
+        """
+        :param in_memory: Numpy files are always loaded into memory. If `True`, the entire dataset
+               is loaded into the memory of this process. If "shared", the dataset is streamed from
+               the file into POSIX shared memory under a key derived from the contents of the file,
+               all other processes on the same host, including DataLoader workers, then attach without copying.
+        """
+        if in_memory not in (True, 'shared'):
+            raise KeyError(f'invalid in_memory mode: {repr(in_memory)}, must be one of: True, "shared", numpy files cannot be read from disk.')
         super().__init__(data_root=data_root, prepare=prepare, transform=transform)
+        self._in_memory = in_memory
         # load dataset
         load_path = os.path.join(self.data_dir, self.datafile.out_name)
-        if load_path.endswith('.gz'):
-            import gzip
-            with gzip.GzipFile(load_path, 'r') as load_file:
-                self._data = np.load(load_file)
+        if self._in_memory == 'shared':
+            # copy the dataset into shared memory if it does
+            # not exist yet, otherwise attach to it
+            with npy_open_stream(load_path, key=self.data_key) as (_, shape, _, dtype):
+                pass
+            def _fill(array: np.ndarray):
+                with npy_open_stream(load_path, key=self.data_key) as (fp, _, fortran_order, _):
+                    npy_read_into(fp, array, fortran_order=fortran_order)
+            self._data = SharedMemoryDataset(
+                name=shm_key(hash_file(load_path, hash_type='md5', hash_mode='fast'), self.data_key, shape, dtype),
+                shape=shape,
+                dtype=dtype,
+                fill_fn=_fill,
+            )
         else:
-            self._data = np.load(load_path)
-        # load from the key if specified
-        if self.data_key is not None:
-            self._data = self._data[self.data_key]
+            if load_path.endswith('.gz'):
+                import gzip
+                with gzip.GzipFile(load_path, 'r') as load_file:
+                    self._data = np.load(load_file)
+            else:
+                self._data = np.load(load_path)
+            # load from the key if specified
+            if self.data_key is not None:
+                self._data = self._data[self.data_key]
 
     def _get_observation(self, idx):
         return self._data[idx]
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._data[idxs]
+
     @property
     def datafiles(self) -> Sequence[DataFile]:
         return [self.datafile]
@@ -303,22 +359,45 @@ class NumpyFileGroundTruthData(DiskGroundTruthData, metaclass=ABCMeta):
 class _Hdf5DataMixin(object):
 
     # attrs this class defines in _mixin_hdf5_init
-    _in_memory: bool
+    _in_memory: Union[bool, Literal['shared']]
     _attrs: dict
-    _data: Union[Hdf5Dataset, np.ndarray]
+    _data: Union[Hdf5Dataset, SharedMemoryDataset, np.ndarray]
 
-    def _mixin_hdf5_init(self, h5_path: str, h5_dataset_name: str = 'data', in_memory: bool = False):
+    def _mixin_hdf5_init(self, h5_path: str, h5_dataset_name: str = 'data', in_memory: Union[bool, Literal['shared']] = False, cache_bytes: Optional[int] = None):
+        """
+        :param in_memory: If `True`, the entire dataset is loaded into the memory of
+               this process. If "shared", the dataset is loaded into POSIX shared memory
+               under a key derived from the contents of the file, all other processes on
+               the same host, including DataLoader workers, then attach without copying.
+        """
+        if in_memory not in (True, False, 'shared'):
+            raise KeyError(f'invalid in_memory mode: {repr(in_memory)}, must be one of: True, False, "shared"')
         # variables
         self._in_memory = in_memory
         # load the h5py dataset
         data = Hdf5Dataset(
             h5_path=h5_path,
             h5_dataset_name=h5_dataset_name,
+            cache_bytes=None if in_memory else cache_bytes,
         )
         # load attributes
         self._attrs = data.get_attrs()
         # handle different memory modes
-        if self._in_memory:
+        if self._in_memory == 'shared':
+            # copy the dataset into shared memory in batches if
+            # it does not exist yet, otherwise attach to it
+            def _fill(array: np.ndarray):
+                step = data.chunk_len * max(1, 1024 // data.chunk_len)
+                for i in range(0, len(array), step):
+                    array[i:i+step] = data[i:i+step]
+            self._data = SharedMemoryDataset(
+                name=shm_key(hash_file(h5_path, hash_type='md5', hash_mode='fast'), h5_dataset_name, data.shape, data.dtype),
+                shape=data.shape,
+                dtype=data.dtype,
+                fill_fn=_fill,
+            )
+            data.close()
+        elif self._in_memory:
             # Load the entire dataset into memory if required
             # indexing dataset objects returns numpy array
             # instantiating np.array from the dataset requires double memory.
@@ -342,6 +421,22 @@ class _Hdf5DataMixin(object):
     def _get_observation(self, idx):
         return self._data[idx]
 
+    # override from GroundTruthData
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        if self._in_memory:
+            return self._data[idxs]
+        # h5py only supports fancy indexing with sorted unique indices,
+        # which is also much faster than reading observations one by one
+        unique_idxs, inverse = np.unique(idxs, return_inverse=True)
+        return self._data[unique_idxs][inverse]
+
+    def cache_info(self) -> Optional[dict]:
+        """
+        Get the hits, misses and size of the block cache of the hdf5 dataset,
+        `None` is returned if the data is in memory or the cache is disabled.
+        """
+        return None if self._in_memory else self._data.cache_info()
+
 
 class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta):
     """
@@ -350,13 +445,14 @@ class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta
       that points to the hdf5 dataset in the file to load.
     """
 
-    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, in_memory=False, transform=None):
+    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, in_memory=False, transform=None, cache_bytes: Optional[int] = None):
         super().__init__(data_root=data_root, prepare=prepare, transform=transform)
         # initialize mixin
         self._mixin_hdf5_init(
             h5_path=os.path.join(self.data_dir, self.datafile.out_name),
             h5_dataset_name=self.datafile.dataset_name,
             in_memory=in_memory,
+            cache_bytes=cache_bytes,
         )
 
     @property
@@ -370,12 +466,13 @@ class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta
 
 class SelfContainedHdf5GroundTruthData(_Hdf5DataMixin, GroundTruthData):
 
-    def __init__(self, h5_path: str, in_memory=False, transform=None):
+    def __init__(self, h5_path: str, in_memory=False, transform=None, cache_bytes: Optional[int] = None):
         # initialize mixin
         self._mixin_hdf5_init(
             h5_path=h5_path,
             h5_dataset_name='data',
             in_memory=in_memory,
+            cache_bytes=cache_bytes,
         )
         # load attrs
         self._attr_name = self._attrs['dataset_name'].decode("utf-8")
@@ -404,6 +501,56 @@ class SelfContainedHdf5GroundTruthData(_Hdf5DataMixin, GroundTruthData):
         return self._img_shape
 
 
+class MemmapGroundTruthData(GroundTruthData):
+    """
+    Dataset that loads an uncompressed `.npy` or flat binary file using `np.memmap`,
+    with a json sidecar file containing the attributes of the dataset.
+    - Files can be converted from the hdf5 files used by `SelfContainedHdf5GroundTruthData`
+      using `disent.dataset.util.memmap.memmap_save_from_hdf5`
+    - Workers & processes that load the same file share the OS page cache,
+      without decompressing chunks or duplicating the data in memory.
+    """
+
+    def __init__(self, path: str, transform=None):
+        # load the data
+        self._data = MemmapDataset(path=path)
+        # load attrs
+        meta = memmap_load_meta(path)
+        self._attr_name = meta['dataset_name']
+        self._attr_factor_names = tuple(meta['factor_names'])
+        self._attr_factor_sizes = tuple(int(size) for size in meta['factor_sizes'])
+        # set size
+        (B, H, W, C) = self._data.shape
+        self._img_shape = (H, W, C)
+        # initialize!
+        super().__init__(transform=transform)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def name(self) -> str:
+        return self._attr_name
+
+    @property
+    def factor_names(self) -> Tuple[str, ...]:
+        return self._attr_factor_names
+
+    @property
+    def factor_sizes(self) -> Tuple[int, ...]:
+        return self._attr_factor_sizes
+
+    @property
+    def img_shape(self) -> Tuple[int, ...]:
+        return self._img_shape
+
+    def _get_observation(self, idx):
+        return self._data[idx]
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._data[idxs]
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -62,12 +62,14 @@ class Mpi3dData(NumpyFileGroundTruthData):
         assert subset in self.MPI3D_DATASETS, f'Invalid MPI3D subset: {repr(subset)} must be one of: {set(self.MPI3D_DATASETS.keys())}'
         self._subset = subset
         # handle different cases
-        if in_memory:
-            log.warning('[WARNING]: mpi3d files are extremely large (over 11GB), you are trying to load these into memory.')
+        if in_memory == 'shared':
+            log.info('mpi3d files are extremely large (over 11GB), these are loaded into shared memory once per host.')
+        elif in_memory:
+            log.warning('[WARNING]: mpi3d files are extremely large (over 11GB), you are trying to load these into memory, consider using `in_memory="shared"`.')
         else:
             raise NotImplementedError('TODO: add support for converting to h5py for fast disk access')  # TODO!
         # initialise
-        super().__init__(data_root=data_root, prepare=prepare, transform=transform)
+        super().__init__(data_root=data_root, prepare=prepare, transform=transform, in_memory=in_memory)
 
     @property
     def datafile(self) -> DataFileHashedDl:
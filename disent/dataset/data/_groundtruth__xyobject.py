@@ -49,6 +49,33 @@ def _shades(num: int, shades):
     return all_shades
 
 
+def _square_axis_masks(img_size: int, starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """
+    Precompute the 1D masks along an image axis for squares starting at `starts`
+    with the corresponding `sizes`. Squares are clipped to the image bounds,
+    just like slice assignment would do.
+    - the returned array has the shape: (*broadcast(starts, sizes).shape, img_size)
+    """
+    starts, sizes = np.broadcast_arrays(starts, sizes)
+    pixels = np.arange(img_size)
+    return (starts[..., None] <= pixels) & (pixels < (starts + sizes)[..., None])
+
+
+def _render_squares_batch(y_masks: np.ndarray, x_masks: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """
+    Render a batch of coloured squares from their precomputed axis masks.
+    - y_masks: (B, H) boolean masks, x_masks: (B, W) boolean masks, colors: (B, C) colours
+    - returns an image batch of shape (B, H, W, C) with the same dtype as the colours
+    """
+    (B, H), (_, W), (_, C) = y_masks.shape, x_masks.shape, colors.shape
+    # colour the rows first, shape: (B, W*C), then broadcast over the
+    # columns. Broadcasting over a small trailing channel dim is slow!
+    x_rows = (x_masks[:, :, None] * colors[:, None, :]).reshape(B, W*C)
+    obs = np.empty((B, H, W*C), dtype=colors.dtype)
+    np.multiply(y_masks.astype(colors.dtype)[:, :, None], x_rows[:, None, :], out=obs)
+    return obs.reshape(B, H, W, C)
+
+
 # ========================================================================= #
 # xy object data                                                            #
 # ========================================================================= #
@@ -137,6 +164,14 @@ class XYObjectData(GroundTruthData):
         # x, y
         self._spacing = grid_spacing
         self._placements = (self._width - max_square_size) // grid_spacing + 1
+        # precompute lookup tables for batched rendering
+        # - axis masks have shape: (placements, scales, width)
+        self._axis_masks = _square_axis_masks(
+            img_size=self._width,
+            starts=self._spacing * np.arange(self._placements)[:, None] + (self._max_square_size - self._square_scales[None, :]) // 2,
+            sizes=self._square_scales[None, :],
+        )
+        self._palette = self._colors.astype(np.uint8)
         super().__init__(transform=transform)
     
     def _get_observation(self, idx):
@@ -149,6 +184,10 @@ class XYObjectData(GroundTruthData):
         obs[y:y+s, x:x+s] = self._colors[c]
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        x, y, s, c = self.idx_to_pos(idxs).T
+        return _render_squares_batch(self._axis_masks[y, s], self._axis_masks[x, s], self._palette[c])
+
 
 class XYOldObjectData(XYObjectData):
 
@@ -227,6 +266,9 @@ class XYObjectShadedData(XYObjectData):
             palette=f'{palette}_1',
             transform=transform,
         )
+        # precompute the shaded palette for batched rendering, shape: (brightness_levels, colors, channels)
+        levels = np.arange(1, self._brightness_levels + 1)[:, None, None]
+        self._shaded_palette = (self._colors[None, :, :] * levels // self._brightness_levels).astype(np.uint8)
 
     def _get_observation(self, idx):
         x, y, s, b, c = self.idx_to_pos(idx)
@@ -238,6 +280,53 @@ class XYObjectShadedData(XYObjectData):
         obs[y:y+s, x:x+s] = self._colors[c] * (b + 1) // self._brightness_levels
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        x, y, s, b, c = self.idx_to_pos(idxs).T
+        return _render_squares_batch(self._axis_masks[y, s], self._axis_masks[x, s], self._shaded_palette[b, c])
+
+
+# ========================================================================= #
+# Benchmark                                                                 #
+# ========================================================================= #
+
+
+if __name__ == '__main__':
+
+    def main(num_obs: int = 10_000, batch_size: int = 256, repeats: int = 3):
+        import time
+        from disent.util.seeds import TempNumpySeed
+        from research.code.dataset.data import XYSquaresData         # pragma: delete-on-release
+        from research.code.dataset.data import XYSquaresMinimalData  # pragma: delete-on-release
+
+        def images_per_sec(get_batch, batches):
+            best = float('inf')
+            for _ in range(repeats):
+                t = time.perf_counter()
+                for idxs in batches:
+                    get_batch(idxs)
+                best = min(best, time.perf_counter() - t)
+            return num_obs / best
+
+        # compare rendering each observation individually against rendering entire batches
+        for data in [
+            XYObjectData(),
+            XYObjectData(rgb=False, palette='greys_4'),
+            XYObjectShadedData(),
+            XYSquaresMinimalData(),  # pragma: delete-on-release
+            XYSquaresData(),         # pragma: delete-on-release
+        ]:
+            with TempNumpySeed(777):
+                batches = np.array_split(np.random.randint(0, len(data), size=num_obs), num_obs // batch_size)
+            # check that the outputs are identical
+            for idxs in batches[:4]:
+                assert np.array_equal(data.get_observations(idxs), np.stack([data[i] for i in idxs]))
+            # benchmark
+            ips_item = images_per_sec(lambda idxs: np.stack([data[i] for i in idxs]), batches)
+            ips_batch = images_per_sec(data.get_observations, batches)
+            print(f'{data.name:20s} (img_shape={data.img_shape}): per-item={ips_item:10.1f} img/s, batched={ips_batch:10.1f} img/s, speedup={ips_batch/ips_item:5.1f}x')
+
+    main()
+
 
 # ========================================================================= #
 # END                                                                       #
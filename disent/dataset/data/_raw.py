@@ -23,8 +23,17 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 
+from collections import OrderedDict
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
 import h5py
+import numpy as np
 from torch.utils.data import Dataset
+from disent.dataset.util.memmap import memmap_open
+from disent.dataset.util.shm import shm_attach_or_create
+from disent.dataset.util.shm import shm_release
 from disent.util.iters import LengthIter
 
 
@@ -54,6 +63,51 @@ class ArrayDataset(Dataset, LengthIter):
         return self._array.shape
 
 
+# ========================================================================= #
+# block cache                                                               #
+# ========================================================================= #
+
+
+class _BlockCache(object):
+    """
+    Least-recently-used cache of decoded blocks,
+    bounded by the total number of bytes of the blocks.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: int, load_fn: Callable[[int], np.ndarray]) -> np.ndarray:
+        block = self._blocks.get(key, None)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            self._hits += 1
+            return block
+        # load the block & evict the oldest blocks
+        self._misses += 1
+        block = load_fn(key)
+        if block.nbytes <= self._max_bytes:
+            self._blocks[key] = block
+            self._nbytes += block.nbytes
+            while self._nbytes > self._max_bytes:
+                _, old = self._blocks.popitem(last=False)
+                self._nbytes -= old.nbytes
+        return block
+
+    def info(self) -> dict:
+        return dict(hits=self._hits, misses=self._misses, num_blocks=len(self._blocks), nbytes=self._nbytes, max_bytes=self._max_bytes)
+
+    def clear(self):
+        self._blocks.clear()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+
 # ========================================================================= #
 # hdf5 pickle dataset                                                       #
 # ========================================================================= #
@@ -64,13 +118,21 @@ class Hdf5Dataset(Dataset, LengthIter):
     This class supports pickling and unpickling of a read-only
     SWMR h5py file and corresponding dataset.
 
+    If `cache_bytes` is specified, entire chunks are read & decoded at once
+    along the first dimension, and are kept in a least-recently-used cache
+    bounded by the given number of bytes. Reading neighbouring entries from
+    files with large chunks then only decompresses each chunk once. The cache
+    is not pickled, so each DataLoader worker has its own cache & budget.
+
     WARNING: this should probably not be used across multiple hosts...
     """
 
-    def __init__(self, h5_path: str, h5_dataset_name: str = 'data', transform=None):
+    def __init__(self, h5_path: str, h5_dataset_name: str = 'data', transform=None, cache_bytes: Optional[int] = None):
         self._h5_path = h5_path
         self._h5_dataset_name = h5_dataset_name
+        self._cache_bytes = cache_bytes
         self._hdf5_file, self._hdf5_data = self._make_hdf5()
+        self._cache = self._make_cache()
         self._transform = transform
 
     def _make_hdf5(self):
@@ -83,7 +145,14 @@ class Hdf5Dataset(Dataset, LengthIter):
         return self._hdf5_data.shape[0]
 
     def __getitem__(self, item):
-        elem = self._hdf5_data[item]
+        if self._cache is None:
+            elem = self._hdf5_data[item]
+        elif isinstance(item, (int, np.integer)):
+            elem = np.array(self._get_cached(item))
+        elif isinstance(item, (list, np.ndarray)) and (len(item) > 0):
+            elem = np.stack([self._get_cached(i) for i in item], axis=0)
+        else:
+            elem = self._hdf5_data[item]
         if self._transform is not None:
             elem = self._transform(elem)
         return elem
@@ -92,6 +161,50 @@ class Hdf5Dataset(Dataset, LengthIter):
     def shape(self):
         return self._hdf5_data.shape
 
+    # BLOCK CACHE
+
+    def _make_cache(self) -> Optional[_BlockCache]:
+        if not self._cache_bytes:
+            return None
+        # contiguous datasets are not compressed
+        if self._hdf5_data.chunks is None:
+            return None
+        return _BlockCache(max_bytes=self._cache_bytes)
+
+    @property
+    def chunk_len(self) -> int:
+        """
+        The number of entries along the first dimension of each chunk, this
+        is also the size of the blocks that are cached & read from the file.
+        """
+        return self._hdf5_data.chunks[0] if (self._hdf5_data.chunks is not None) else 1
+
+    def _load_block(self, k: int) -> np.ndarray:
+        L = self.chunk_len
+        return self._hdf5_data[k*L:(k+1)*L]
+
+    def _get_cached(self, idx: int) -> np.ndarray:
+        idx, L = int(idx), self.chunk_len
+        if idx < 0:
+            idx += len(self)
+        block = self._cache.get(idx // L, self._load_block)
+        return block[idx % L]
+
+    def cache_info(self) -> Optional[dict]:
+        """
+        Get the hits, misses and the size of the block cache,
+        `None` is returned if the cache is disabled.
+        """
+        return None if (self._cache is None) else self._cache.info()
+
+    def cache_clear(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    @property
+    def dtype(self):
+        return self._hdf5_data.dtype
+
     def numpy_dataset(self) -> ArrayDataset:
         # TODO: make this function global
         return ArrayDataset(array=self._hdf5_data[:], transform=self._transform)
@@ -112,21 +225,170 @@ class Hdf5Dataset(Dataset, LengthIter):
         state = self.__dict__.copy()
         state.pop('_hdf5_file', None)
         state.pop('_hdf5_data', None)
+        state.pop('_cache', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self._hdf5_file, self._hdf5_data = self._make_hdf5()
+        self._cache = self._make_cache()
 
     def close(self):
         self._hdf5_file.close()
         del self._hdf5_file
         del self._hdf5_data
+        self._cache = None
 
     def get_attrs(self) -> dict:
         return dict(self._hdf5_data.attrs)
 
 
+# ========================================================================= #
+# memmap pickle dataset                                                     #
+# ========================================================================= #
+
+
+class MemmapDataset(Dataset, LengthIter):
+    """
+    This class supports pickling and unpickling of a read-only
+    memory-mapped array, see `disent.dataset.util.memmap`
+
+    Unlike `Hdf5Dataset`, reads are not serialised behind a global lock,
+    the data is not compressed, and all processes that open the same file
+    share the same pages in the OS page cache.
+    """
+
+    def __init__(self, path: str, transform=None):
+        self._path = path
+        self._array = self._make_memmap()
+        self._transform = transform
+
+    def _make_memmap(self):
+        return memmap_open(self._path, mode='r')
+
+    def __len__(self):
+        return self._array.shape[0]
+
+    def __getitem__(self, item):
+        # copy the data out of the memmap, otherwise the returned
+        # array is read-only and keeps a reference to the file
+        elem = np.array(self._array[item])
+        if self._transform is not None:
+            elem = self._transform(elem)
+        return elem
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    @property
+    def dtype(self):
+        return self._array.dtype
+
+    # CUSTOM PICKLE HANDLING -- memmaps are pickled by copying all their data!
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_array', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._array = self._make_memmap()
+
+
+# ========================================================================= #
+# shared memory pickle dataset                                              #
+# ========================================================================= #
+
+
+class SharedMemoryDataset(Dataset, LengthIter):
+    """
+    This class supports pickling and unpickling of a read-only
+    array in POSIX shared memory, see `disent.dataset.util.shm`
+
+    The first instance with a given name creates the shared memory segment
+    and fills it using `fill_fn(array)`, all other instances, including
+    unpickled copies in DataLoader workers and instances in other processes
+    on the same host, attach to the existing segment without copying.
+    Each instance holds a reference to the segment which is released when
+    the instance is closed or garbage collected, or when the process exits.
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype, fill_fn: Optional[Callable[[np.ndarray], None]] = None, transform=None):
+        self._name = name
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._transform = transform
+        self._shm, self._array, self._finalizer = self._make_shm(fill_fn=fill_fn)
+
+    def _make_shm(self, fill_fn=None):
+        from multiprocessing.util import Finalize
+        shm, array = shm_attach_or_create(name=self._name, shape=self._shape, dtype=self._dtype, fill_fn=fill_fn)
+        # multiprocessing finalizers also run when DataLoader workers exit
+        finalizer = Finalize(self, shm_release, args=(shm, self._name), exitpriority=0)
+        return shm, array, finalizer
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __getitem__(self, item):
+        # copy the data out of the segment, otherwise the returned array
+        # is read-only and keeps the segment mapped after `close()`
+        elem = np.array(self._array[item])
+        if self._transform is not None:
+            elem = self._transform(elem)
+        return elem
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        A read-only view of the segment, this must be deleted before calling `close()`
+        """
+        return self._array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+
+    # CUSTOM PICKLE HANDLING -- only the name of the segment is pickled!
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_shm', None)
+        state.pop('_array', None)
+        state.pop('_finalizer', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm, self._array, self._finalizer = self._make_shm()
+
+    def close(self):
+        if self._array is None:
+            return
+        self._finalizer()
+        self._array = None
+        # raises a `BufferError` instead of unmapping the segment if views
+        # returned by the `array` property are still alive, the memory is
+        # then only unmapped once these views are garbage collected.
+        self._shm.close()
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
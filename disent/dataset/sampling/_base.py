@@ -23,8 +23,11 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 from typing import final
+from typing import Sequence
 from typing import Tuple
 
+import numpy as np
+
 
 # ========================================================================= #
 # Base Sampler                                                              #
@@ -82,6 +85,38 @@ class BaseDisentSampler(object):
     def __call__(self, idx: int) -> Tuple[int, ...]:
         return self.sample(idx)
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Batches                                                               #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        """
+        you can override this method to sample a batch of index tuples at once!
+        - `idxs` is a 1D array of anchor indices with shape (B,)
+        - must return an integer array with shape (B, num_samples)
+        - the default implementation falls back to calling `_sample_idx` for each index
+        """
+        return np.array([self._sample_idx(int(idx)) for idx in idxs], dtype='int64').reshape(len(idxs), self.num_samples)
+
+    def sample_batch(self, idxs: Sequence[int]) -> np.ndarray:
+        """
+        Like `sample`, but samples index tuples for an entire batch of indices.
+        - returns an integer array with shape (B, num_samples)
+        """
+        # check that we have been initialized!
+        if not self.is_init:
+            raise RuntimeError(f'{self.__class__.__name__} has not been initialized! call `sampler.init(gt_data)`')
+        # sample values
+        idxs = np.asarray(idxs, dtype='int64')
+        if idxs.ndim != 1:
+            raise ValueError(f'{self.__class__.__name__} can only sample batches from 1D arrays of indices, got shape: {idxs.shape}')
+        batch = self._sample_batch_idxs(idxs)
+        # check values
+        if batch.shape != (len(idxs), self.num_samples):
+            raise RuntimeError(f'{self.__class__.__name__} returned an incorrect batch shape, required: {(len(idxs), self.num_samples)}, got: {batch.shape}')
+        # return values
+        return batch
+
 
 # ========================================================================= #
 # END                                                                       #
@@ -23,6 +23,7 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 from fractions import Fraction
+from functools import reduce
 from typing import List
 from typing import Optional
 from typing import Union
@@ -32,6 +33,7 @@ import numpy as np
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.util.state_space import StateSpace
+from disent.util.math.integer import lcm
 
 
 # ========================================================================= #
@@ -75,10 +77,13 @@ class GroundTruthDistSampler(BaseDisentSampler):
         self._swap_chance = triplet_swap_chance
         # dataset variable
         self._state_space: Optional[StateSpace] = None
+        self._scale_weights: Optional[np.ndarray] = None
 
     def _init(self, dataset):
         assert isinstance(dataset, GroundTruthData), f'dataset must be an instance of {repr(GroundTruthData.__class__.__name__)}, got: {repr(dataset)}'
         self._state_space = dataset.state_space_copy()
+        # precompute the integer weights for the exact scaled distances
+        self._scale_weights = factor_dist_weights(factor_dist_scale(self._state_space.factor_sizes)) if self._scaled else None
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Sampling                                                              #
@@ -98,41 +103,63 @@ class GroundTruthDistSampler(BaseDisentSampler):
         # get data
         return indices
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        # sample indices
+        indices = np.concatenate([idxs[:, None], np.random.randint(0, len(self._state_space), size=(len(idxs), self._num_samples-1))], axis=-1)
+        # sort based on mode
+        if self._num_samples == 3:
+            # swap based on the mode, then randomly swap positive and negative
+            swap = self._batch_swap_mask(indices)
+            swap ^= np.random.random(len(idxs)) < self._swap_chance
+            indices[swap, 1:] = indices[swap, :0:-1]
+        # get data
+        return indices
+
     def _swap_triple(self, indices):
         a_i, p_i, n_i = indices
         a_f, p_f, n_f = self._state_space.idx_to_pos(indices)
-        # get the scale for everything
-        # - range of positions is [0, f_size - 1], to scale between 0 and 1 we need to
-        #   divide by (f_size - 1), but if the factor size is 1, we can't divide by zero
-        #   so we make the minimum 1
-        scale = np.maximum(1, self._state_space.factor_sizes - 1) if (self._scaled) else None
+        # swap if the positive is further away than the negative
+        if self._swap_mask(a_f, p_f, n_f):
+            return a_i, n_i, p_i
+        # done!
+        return indices
+
+    def _batch_swap_mask(self, indices: np.ndarray) -> np.ndarray:
+        # vectorized version of `_swap_triple`, returns a boolean mask with shape (B,) of the triplets that should be swapped
+        factors = self._state_space.idx_to_pos(indices)
+        return np.asarray(self._swap_mask(factors[:, 0], factors[:, 1], factors[:, 2]), dtype='bool')
+
+    def _swap_mask(self, a_f: np.ndarray, p_f: np.ndarray, n_f: np.ndarray) -> Union[bool, np.ndarray]:
+        # factors can be a single triplet with shape (num_factors,) or a batch with shape (B, num_factors)
         # SWAP: manhattan
         if self._sample_mode == 'manhattan':
-            if factor_dist(a_f, p_f, scale=scale) > factor_dist(a_f, n_f, scale=scale):
-                return a_i, n_i, p_i
+            return self._factor_dist(a_f, p_f) > self._factor_dist(a_f, n_f)
         # SWAP: factors
         elif self._sample_mode == 'factors':
-            if factor_diff(a_f, p_f) > factor_diff(a_f, n_f):
-                return a_i, n_i, p_i
+            return factor_diff(a_f, p_f) > factor_diff(a_f, n_f)
         # SWAP: combined
         elif self._sample_mode == 'combined':
-            if factor_diff(a_f, p_f) > factor_diff(a_f, n_f):
-                return a_i, n_i, p_i
-            elif factor_diff(a_f, p_f) == factor_diff(a_f, n_f):
-                if factor_dist(a_f, p_f, scale=scale) > factor_dist(a_f, n_f, scale=scale):
-                    return a_i, n_i, p_i
+            p_diff, n_diff = factor_diff(a_f, p_f), factor_diff(a_f, n_f)
+            return (p_diff > n_diff) | ((p_diff == n_diff) & (self._factor_dist(a_f, p_f) > self._factor_dist(a_f, n_f)))
         # SWAP: random
-        elif self._sample_mode != 'random':
+        elif self._sample_mode == 'random':
+            return np.zeros(a_f.shape[:-1], dtype='bool')
+        else:
             raise KeyError('invalid mode')
-        # done!
-        return indices
+
+    def _factor_dist(self, f0: np.ndarray, f1: np.ndarray) -> Union[int, np.ndarray]:
+        # the scaled distances are multiplied by the LCM of the scale, which
+        # does not change the ordering and allows us to use exact integer maths
+        if self._scaled:
+            return factor_dist_scaled(f0, f1, weights=self._scale_weights)
+        return factor_dist(f0, f1)
 
 
 def factor_diff(f0: np.ndarray, f1: np.ndarray) -> int:
     # input types should be np.int64
     assert f0.dtype == f1.dtype == 'int64'
-    # compute distances!
-    return np.sum(f0 != f1)
+    # compute distances! factors can have any number of leading batch dimensions
+    return np.sum(f0 != f1, axis=-1)
 
 
 # NOTE: scaling here should always be the same as `disentangle_loss`
@@ -142,7 +169,7 @@ def factor_dist(f0: np.ndarray, f1: np.ndarray, scale: np.ndarray = None) -> Uni
         # input types should all be np.int64
         assert f0.dtype == f1.dtype == 'int64', f'invalid dtypes, f0: {f0.dtype}, f1: {f1.dtype}'
         # we can simply sum if everything is already an integer
-        return np.sum(np.abs(f0 - f1))
+        return np.sum(np.abs(f0 - f1), axis=-1)
     else:
         # input types should all be np.int64
         assert f0.dtype == f1.dtype == scale.dtype == 'int64'
@@ -151,6 +178,8 @@ def factor_dist(f0: np.ndarray, f1: np.ndarray, scale: np.ndarray = None) -> Uni
         # we do not lose precision while summing, and avoid comparison errors!
         #    - https://shlegeris.com/2018/10/23/sqrt.html
         #    - https://cstheory.stackexchange.com/a/4010
+        # NOTE: this is very slow, `factor_dist_scaled` computes the same values
+        #       multiplied by the LCM of the scale using exact integer maths.
         # 1. first we need to convert numbers to python arbitrary precision values:
         f0: List[int]    = f0.tolist()
         f1: List[int]    = f1.tolist()
@@ -162,6 +191,45 @@ def factor_dist(f0: np.ndarray, f1: np.ndarray, scale: np.ndarray = None) -> Uni
         return total
 
 
+def factor_dist_scale(factor_sizes: np.ndarray) -> np.ndarray:
+    # get the scale for everything
+    # - range of positions is [0, f_size - 1], to scale between 0 and 1 we need to
+    #   divide by (f_size - 1), but if the factor size is 1, we can't divide by zero
+    #   so we make the minimum 1
+    return np.maximum(1, np.asarray(factor_sizes, dtype='int64') - 1)
+
+
+def factor_dist_weights(scale: np.ndarray) -> np.ndarray:
+    """
+    Compute the integer weights `LCM(scale) // scale` used by `factor_dist_scaled`.
+    - The sum of the weighted distances is exactly `LCM(scale)` times the sum
+      of the fractional distances computed by `factor_dist`, so comparisons
+      between distances give exactly the same results.
+    - If the weighted distances could overflow int64, the weights are returned
+      as an object array of python integers which have arbitrary precision.
+    """
+    scale = np.asarray(scale, dtype='int64')
+    assert scale.ndim == 1 and np.all(scale > 0), f'scale must be a 1D array of positive integers, got: {scale}'
+    # compute the lcm using python arbitrary precision integers
+    multiple = reduce(lcm, scale.tolist(), 1)
+    weights = [multiple // s for s in scale.tolist()]
+    # the maximum distance is `len(scale) * multiple`, check that this fits into an int64
+    if len(scale) * multiple < np.iinfo('int64').max:
+        return np.array(weights, dtype='int64')
+    return np.array(weights, dtype=object)
+
+
+def factor_dist_scaled(f0: np.ndarray, f1: np.ndarray, weights: np.ndarray) -> Union[int, np.ndarray]:
+    """
+    Exact scaled manhattan distance between factors multiplied by `LCM(scale)`,
+    see `factor_dist_weights`. Factors can have any number of leading batch dimensions.
+    """
+    # input types should all be np.int64
+    assert f0.dtype == f1.dtype == 'int64', f'invalid dtypes, f0: {f0.dtype}, f1: {f1.dtype}'
+    # compute distances!
+    return np.sum(np.abs(f0 - f1) * weights, axis=-1)
+
+
 # ========================================================================= #
 # Investigation:                                                            #
 # ========================================================================= #
@@ -170,71 +238,50 @@ def factor_dist(f0: np.ndarray, f1: np.ndarray, scale: np.ndarray = None) -> Uni
 if __name__ == '__main__':
 
     def main():
-        from disent.dataset import DisentDataset
+        import time
         from disent.dataset.data import XYObjectData
         from disent.dataset.data import XYObjectShadedData
         from disent.dataset.data import Cars3d64Data
         from disent.dataset.data import Shapes3dData
         from disent.dataset.data import DSpritesData
         from disent.dataset.data import SmallNorb64Data
+        from disent.dataset.data import Mpi3dData
         from disent.util.seeds import TempNumpySeed
         from research.code.dataset.data import XYSquaresMinimalData  # pragma: delete-on-release
-        from tqdm import tqdm
-
-        repeats = 1000
-        samples = 100
-
-        # RESULTS - manhattan:
-        #   cars3d:             orig_vs_divs=30.066%, orig_vs_frac=30.066%, divs_vs_frac=0.000%
-        #   3dshapes:           orig_vs_divs=12.902%, orig_vs_frac=12.878%, divs_vs_frac=0.096%
-        #   dsprites:           orig_vs_divs=24.035%, orig_vs_frac=24.032%, divs_vs_frac=0.003%
-        #   smallnorb:          orig_vs_divs=18.601%, orig_vs_frac=18.598%, divs_vs_frac=0.005%
-        #   xy_squares_minimal: orig_vs_divs= 1.389%, orig_vs_frac= 0.000%, divs_vs_frac=1.389%
-        #   xy_object:          orig_vs_divs=15.520%, orig_vs_frac=15.511%, divs_vs_frac=0.029%
-        #   xy_object:          orig_vs_divs=23.973%, orig_vs_frac=23.957%, divs_vs_frac=0.082%
-        # RESULTS - combined:
-        #   cars3d:             orig_vs_divs=15.428%, orig_vs_frac=15.428%, divs_vs_frac=0.000%
-        #   3dshapes:           orig_vs_divs=4.982%,  orig_vs_frac= 4.968%, divs_vs_frac=0.050%
-        #   dsprites:           orig_vs_divs=8.366%,  orig_vs_frac= 8.363%, divs_vs_frac=0.003%
-        #   smallnorb:          orig_vs_divs=7.359%,  orig_vs_frac= 7.359%, divs_vs_frac=0.000%
-        #   xy_squares_minimal: orig_vs_divs=0.610%,  orig_vs_frac= 0.000%, divs_vs_frac=0.610%
-        #   xy_object:          orig_vs_divs=7.622%,  orig_vs_frac= 7.614%, divs_vs_frac=0.020%
-        #   xy_object:          orig_vs_divs=8.741%,  orig_vs_frac= 8.733%, divs_vs_frac=0.046%
-        for mode in ['manhattan', 'combined']:
-            for data_cls in [
-                Cars3d64Data,
-                Shapes3dData,
-                DSpritesData,
-                SmallNorb64Data,
-                XYSquaresMinimalData,  # pragma: delete-on-release
-                XYObjectData,
-                XYObjectShadedData,
-            ]:
-                data = data_cls()
-                dataset_orig = DisentDataset(data, sampler=GroundTruthDistSampler(3, f'{mode}'))
-                dataset_frac = DisentDataset(data, sampler=GroundTruthDistSampler(3, f'{mode}_scaled'))
-                dataset_divs = DisentDataset(data, sampler=GroundTruthDistSampler(3, f'{mode}_scaled_INVALID'))
-                # calculate the average number of mismatches between sampling methods!
-                all_wrong_frac = []  # frac vs orig
-                all_wrong_divs = []  # divs vs orig
-                all_wrong_diff = []  # frac vs divs
-                with TempNumpySeed(777):
-                    progress = tqdm(range(repeats), desc=f'{mode} {data.name}')
-                    for i in progress:
-                        batch_seed = np.random.randint(0, 2**32)
-                        with TempNumpySeed(batch_seed): idxs_orig = np.array([dataset_orig.sampler.sample(np.random.randint(0, len(dataset_orig))) for _ in range(samples)])
-                        with TempNumpySeed(batch_seed): idxs_frac = np.array([dataset_frac.sampler.sample(np.random.randint(0, len(dataset_frac))) for _ in range(samples)])
-                        with TempNumpySeed(batch_seed): idxs_divs = np.array([dataset_divs.sampler.sample(np.random.randint(0, len(dataset_divs))) for _ in range(samples)])
-                        # check number of miss_matches
-                        all_wrong_frac.append(np.sum(np.any(idxs_orig != idxs_frac, axis=-1)) / samples * 100)
-                        all_wrong_divs.append(np.sum(np.any(idxs_orig != idxs_divs, axis=-1)) / samples * 100)
-                        all_wrong_diff.append(np.sum(np.any(idxs_frac != idxs_divs, axis=-1)) / samples * 100)
-                        # update progress bar
-                        progress.set_postfix({
-                            'orig_vs_divs': f'{np.mean(all_wrong_divs):5.3f}%',
-                            'orig_vs_frac': f'{np.mean(all_wrong_frac):5.3f}%',
-                            'divs_vs_frac': f'{np.mean(all_wrong_diff):5.3f}%',
-                        })
+
+        num_triplets = 100_000
+
+        # compare the old fraction based swap decisions against the new integer based swap decisions
+        # - the swap decisions must be identical, otherwise this is a bug
+        for data_cls in [
+            Cars3d64Data,
+            Shapes3dData,
+            DSpritesData,
+            SmallNorb64Data,
+            Mpi3dData,
+            XYSquaresMinimalData,  # pragma: delete-on-release
+            XYObjectData,
+            XYObjectShadedData,
+        ]:
+            data = data_cls()
+            # sample the triplets
+            with TempNumpySeed(777):
+                a_f, p_f, n_f = np.moveaxis(data.idx_to_pos(np.random.randint(0, len(data), size=(num_triplets, 3))), 1, 0)
+            # compute the decisions using fractions
+            t = time.perf_counter()
+            scale = factor_dist_scale(data.factor_sizes)
+            swap_frac = np.array([factor_dist(a, p, scale=scale) > factor_dist(a, n, scale=scale) for a, p, n in zip(a_f, p_f, n_f)])
+            t_frac = time.perf_counter() - t
+            # compute the decisions using integers
+            t = time.perf_counter()
+            weights = factor_dist_weights(factor_dist_scale(data.factor_sizes))
+            swap_ints = factor_dist_scaled(a_f, p_f, weights=weights) > factor_dist_scaled(a_f, n_f, weights=weights)
+            t_ints = time.perf_counter() - t
+            # check the results
+            mismatches = np.sum(swap_frac != swap_ints)
+            print(f'{data.name:20s}: fraction={num_triplets/t_frac:12.1f} triplets/s, integer={num_triplets/t_ints:12.1f} triplets/s, speedup={t_frac/t_ints:7.1f}x, mismatches={mismatches}, weights={weights.tolist()}')
+            assert mismatches == 0
+
     main()
 
 
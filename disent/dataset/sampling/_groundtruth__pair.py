@@ -28,6 +28,7 @@ import numpy as np
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.sampling._groundtruth__triplet import normalise_range_pair, FactorSizeError
+from disent.dataset.sampling._groundtruth__triplet import _random_ranks
 from disent.dataset.util.state_space import StateSpace
 from disent.util.math.random import sample_radius
 
@@ -110,6 +111,28 @@ class GroundTruthPairSampler(BaseDisentSampler):
         positive_factors[p_shared_indices] = anchor_factors[p_shared_indices]
         return anchor_factors, positive_factors
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        f0, f1 = self.batch_sample_factors_pair(idxs)
+        return np.stack([
+            self._state_space.pos_to_idx(f0),
+            self._state_space.pos_to_idx(f1),
+        ], axis=-1)
+
+    def batch_sample_factors_pair(self, idxs: np.ndarray):
+        """
+        Vectorized version of `datapoint_sample_factors_pair`, sampling
+        the factors for an entire batch of anchor indices at once.
+        - returns two arrays of factors, each with shape (B, num_factors)
+        """
+        # SAMPLE FACTOR INDICES
+        p_k = self._sample_num_factors(size=len(idxs))
+        p_shared_mask = _random_ranks(len(idxs), self._state_space.num_factors) < (self._state_space.num_factors - p_k)[:, None]
+        # SAMPLE FACTORS - sample, resample and replace shared factors with originals
+        anchor_factors = self._state_space.idx_to_pos(idxs)
+        positive_factors = self._resample_factors(anchor_factors)
+        positive_factors = np.where(p_shared_mask, anchor_factors, positive_factors)
+        return anchor_factors, positive_factors
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # HELPER                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -123,8 +146,8 @@ class GroundTruthPairSampler(BaseDisentSampler):
                                   f'\n\tUnsatisfied: {p_max} <= {np.array(max_values)}')
         return p_min, p_max
 
-    def _sample_num_factors(self):
-        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1)
+    def _sample_num_factors(self, size=None):
+        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1, size=size)
         return p_k
 
     def _sample_shared_indices(self, p_k):
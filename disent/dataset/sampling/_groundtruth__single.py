@@ -25,6 +25,8 @@
 import logging
 from typing import Optional
 
+import numpy as np
+
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.util.state_space import StateSpace
@@ -54,6 +56,9 @@ class GroundTruthSingleSampler(BaseDisentSampler):
     def _sample_idx(self, idx):
         return (idx,)
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        return idxs[:, None]
+
 
 # ========================================================================= #
 # END                                                                       #
@@ -145,6 +145,38 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         # return factors!
         return anchor_factors, positive_factors, negative_factors
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        f0, f1, f2 = self.batch_sample_factors_triplet(idxs)
+        return np.stack([
+            self._state_space.pos_to_idx(f0),
+            self._state_space.pos_to_idx(f1),
+            self._state_space.pos_to_idx(f2),
+        ], axis=-1)
+
+    def batch_sample_factors_triplet(self, idxs: np.ndarray):
+        """
+        Vectorized version of `datapoint_sample_factors_triplet`, sampling
+        the factors for an entire batch of anchor indices at once.
+        - returns three arrays of factors, each with shape (B, num_factors)
+        """
+        # SAMPLE FACTOR INDICES
+        p_k, n_k = self._sample_num_factors(size=len(idxs))
+        p_shared_mask, n_shared_mask = self._batch_sample_shared_masks(p_k, n_k)
+        # SAMPLE FACTORS - sample, resample and replace shared factors with originals
+        anchor_factors = self._state_space.idx_to_pos(idxs)
+        positive_factors, negative_factors = self._resample_factors(anchor_factors)
+        positive_factors = np.where(p_shared_mask, anchor_factors, positive_factors)
+        negative_factors = np.where(n_shared_mask, anchor_factors, negative_factors)
+        # SWAP IF +VE FURTHER THAN -VE
+        if self._swap_metric is not None:
+            positive_factors, negative_factors = self._swap_factors(anchor_factors, positive_factors, negative_factors)
+        # RANDOMLY SWAP +ve AND -ve IF CHANCE:
+        if self._swap_chance is not None:
+            swap = np.random.random(len(idxs)) < self._swap_chance
+            positive_factors, negative_factors = _swap_where(swap, positive_factors, negative_factors)
+        # return factors!
+        return anchor_factors, positive_factors, negative_factors
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # HELPER                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -187,15 +219,15 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         # we're done!
         return p_min, p_max, n_min, n_max
 
-    def _sample_num_factors(self):
-        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1)
+    def _sample_num_factors(self, size=None):
+        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1, size=size)
         # sample for negative
         if self.n_k_sample_mode == 'offset':
-            n_k = np.random.randint(p_k + self.n_k_min, min(p_k + self.n_k_max, self._state_space.num_factors) + 1)
+            n_k = np.random.randint(p_k + self.n_k_min, np.minimum(p_k + self.n_k_max, self._state_space.num_factors) + 1, size=size)
         elif self.n_k_sample_mode == 'bounded_below':
-            n_k = np.random.randint(max(p_k, self.n_k_min), self.n_k_max + 1)
+            n_k = np.random.randint(np.maximum(p_k, self.n_k_min), self.n_k_max + 1, size=size)
         elif self.n_k_sample_mode == 'random':
-            n_k = np.random.randint(self.n_k_min, self.n_k_max + 1)
+            n_k = np.random.randint(self.n_k_min, self.n_k_max + 1, size=size)
         else:
             raise KeyError(f'Unknown mode: {self.n_k_sample_mode=}')
         # we're done!
@@ -211,6 +243,21 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         # we're done!
         return p_shared_indices, n_shared_indices
 
+    def _batch_sample_shared_masks(self, p_k: np.ndarray, n_k: np.ndarray):
+        # vectorized version of `_sample_shared_indices`, returning boolean masks with shape (B, num_factors)
+        # - random ranks are a random permutation of the factors for each row, the first
+        #   `num_factors - k` factors in the permutation are the ones that are shared
+        num_factors = self._state_space.num_factors
+        p_ranks = _random_ranks(len(p_k), num_factors)
+        p_shared_mask = p_ranks < (num_factors - p_k)[:, None]
+        # sample for negative
+        if self.n_k_is_shared:
+            n_shared_mask = p_ranks < (num_factors - n_k)[:, None]
+        else:
+            n_shared_mask = _random_ranks(len(n_k), num_factors) < (num_factors - n_k)[:, None]
+        # we're done!
+        return p_shared_mask, n_shared_mask
+
     def _resample_factors(self, anchor_factors):
         # sample positive
         positive_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=self.p_radius_min, r_high=self.p_radius_max + 1)
@@ -234,29 +281,27 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         return positive_factors, negative_factors
 
     def _swap_factors(self, anchor_factors, positive_factors, negative_factors):
+        # factors can be a single datapoint with shape (num_factors,) or a batch with shape (B, num_factors)
         if self._swap_metric == 'k':
-            p_dist = np.sum(anchor_factors == positive_factors)
-            n_dist = np.sum(anchor_factors == negative_factors)
+            p_dist = np.sum(anchor_factors == positive_factors, axis=-1)
+            n_dist = np.sum(anchor_factors == negative_factors, axis=-1)
         elif self._swap_metric == 'manhattan':
-            p_dist = np.sum(np.abs(anchor_factors - positive_factors))
-            n_dist = np.sum(np.abs(anchor_factors - negative_factors))
+            p_dist = np.sum(np.abs(anchor_factors - positive_factors), axis=-1)
+            n_dist = np.sum(np.abs(anchor_factors - negative_factors), axis=-1)
         elif self._swap_metric == 'manhattan_norm':
-            p_dist = np.sum(np.abs((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1)))
-            n_dist = np.sum(np.abs((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1)))
+            p_dist = np.sum(np.abs((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1)), axis=-1)
+            n_dist = np.sum(np.abs((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1)), axis=-1)
         elif self._swap_metric == 'euclidean':
-            p_dist = np.linalg.norm(anchor_factors - positive_factors)
-            n_dist = np.linalg.norm(anchor_factors - negative_factors)
+            p_dist = np.linalg.norm(anchor_factors - positive_factors, axis=-1)
+            n_dist = np.linalg.norm(anchor_factors - negative_factors, axis=-1)
         elif self._swap_metric == 'euclidean_norm':
-            p_dist = np.linalg.norm((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1))
-            n_dist = np.linalg.norm((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1))
+            p_dist = np.linalg.norm((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1), axis=-1)
+            n_dist = np.linalg.norm((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1), axis=-1)
         else:
             raise KeyError
         # perform swap
-        if n_dist < p_dist:
-            positive_factors, negative_factors = negative_factors, positive_factors
-            # log.warning(f'Swapped factors based on metric: {self._swap_metric}')
-        # return factors
-        return positive_factors, negative_factors
+        # log.warning(f'Swapped factors based on metric: {self._swap_metric}')
+        return _swap_where(n_dist < p_dist, positive_factors, negative_factors)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # END CLASS                                                             #
@@ -272,6 +317,19 @@ class FactorSizeError(Exception):
     pass
 
 
+def _random_ranks(num: int, size: int) -> np.ndarray:
+    # each row is a random permutation of the values [0, size)
+    # - equivalent to `np.random.choice(size, size=size, replace=False)` for each row
+    return np.argsort(np.random.random((num, size)), axis=-1)
+
+
+def _swap_where(swap, positive_factors: np.ndarray, negative_factors: np.ndarray):
+    # swap the positive and negative factors where `swap` is True
+    # - `swap` can be a single boolean, or have shape (B,) for factors with shape (B, num_factors)
+    swap = np.asarray(swap)[..., None]
+    return np.where(swap, negative_factors, positive_factors), np.where(swap, positive_factors, negative_factors)
+
+
 def normalise_range(mins, maxs, sizes):
     sizes = np.array(sizes)
     # compute the bounds for each factor
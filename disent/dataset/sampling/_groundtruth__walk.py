@@ -89,6 +89,22 @@ class GroundTruthRandomWalkSampler(BaseDisentSampler):
         else:
             raise RuntimeError
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        if self._num_samples == 1:
+            return idxs[:, None]
+        elif self._num_samples == 2:
+            p_dist = np.random.randint(1, self._p_dist_max + 1, size=len(idxs))
+            pos = _random_walk_batch(idxs, p_dist, self._state_space.factor_sizes)
+            return np.stack([idxs, pos], axis=-1)
+        elif self._num_samples == 3:
+            p_dist = np.random.randint(1, self._p_dist_max + 1, size=len(idxs))
+            n_dist = np.random.randint(1, self._n_dist_max + 1, size=len(idxs))
+            pos = _random_walk_batch(idxs, p_dist, self._state_space.factor_sizes)
+            neg = _random_walk_batch(pos, n_dist, self._state_space.factor_sizes)
+            return np.stack([idxs, pos, neg], axis=-1)
+        else:
+            raise RuntimeError
+
 
 # ========================================================================= #
 # Helper                                                                    #
@@ -105,6 +121,28 @@ def _random_walk(idx: int, dist: int, factor_sizes: np.ndarray) -> int:
     return int(idx)
 
 
+def _random_walk_batch(idxs: np.ndarray, dists: np.ndarray, factor_sizes: np.ndarray) -> np.ndarray:
+    # vectorized version of `_random_walk`, each index has its own walk distance
+    pos = np.stack(np.unravel_index(idxs, factor_sizes), axis=-1)
+    for step in range(int(np.max(dists, initial=0))):
+        _walk_nearby_batch_inplace(pos, np.nonzero(step < dists)[0], factor_sizes)
+    return np.ravel_multi_index(pos.T, factor_sizes)
+
+
+def _walk_nearby_batch_inplace(pos: np.ndarray, rows: np.ndarray, factor_sizes: np.ndarray) -> NoReturn:
+    # vectorized version of `_walk_nearby_inplace` over the given rows of `pos`,
+    # rows that did not change are resampled until every row has been updated
+    while len(rows) > 0:
+        f_idxs = np.random.randint(0, len(factor_sizes), size=len(rows))
+        cur = pos[rows, f_idxs]
+        # walk random factor value
+        nxt = np.where(np.random.random(len(rows)) < 0.5, np.maximum(cur - 1, 0), np.minimum(cur + 1, factor_sizes[f_idxs] - 1))
+        # update the positions that are different, retry the rest
+        changed = (cur != nxt)
+        pos[rows[changed], f_idxs[changed]] = nxt[changed]
+        rows = rows[~changed]
+
+
 @try_njit()
 def _walk_nearby_inplace(pos: np.ndarray, factor_sizes: Sequence[int]) -> NoReturn:
     # try to shift any single factor by 1 or -1
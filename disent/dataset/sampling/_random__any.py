@@ -48,6 +48,10 @@ class RandomSampler(BaseDisentSampler):
         # sample indices
         return (idx, *np.random.randint(0, self._len, size=self._num_samples-1))
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        others = np.random.randint(0, self._len, size=(len(idxs), self._num_samples-1))
+        return np.concatenate([idxs[:, None], others], axis=-1)
+
 
 # ========================================================================= #
 # End                                                                       #
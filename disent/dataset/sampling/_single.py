@@ -47,6 +47,9 @@ class SingleSampler(BaseDisentSampler):
     def _sample_idx(self, idx: int) -> Tuple[int, ...]:
         return (idx,)
 
+    def _sample_batch_idxs(self, idxs: np.ndarray) -> np.ndarray:
+        return idxs[:, None]
+
 
 # ========================================================================= #
 # End                                                                       #
@@ -27,6 +27,7 @@ from disent.dataset.transform._transforms import CheckTensor
 from disent.dataset.transform._transforms import Noop
 from disent.dataset.transform._transforms import ToImgTensorF32
 from disent.dataset.transform._transforms import ToImgTensorU8
+from disent.dataset.transform._transforms import ImgTensorU8ToF32
 from disent.dataset.transform._transforms import ToStandardisedTensor  # deprecated
 from disent.dataset.transform._transforms import ToUint8Tensor         # deprecated
 
@@ -36,17 +36,29 @@ class DisentDatasetTransform(object):
     """
     Applies transforms to batches generated from dataloaders of
     datasets from: disent.dataset.groundtruth
+
+    If `transform_obs` is given, it is first applied to all the observations
+    in the batch, both inputs and targets, eg. to convert collated uint8 batches
+    to float32, see: `ToImgTensorF32.split_u8`. The remaining transforms are then
+    applied to these converted observations.
     """
 
     def __init__(
         self,
         transform:      Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
         transform_targ: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        transform_obs:  Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
     ):
         self.transform = transform
         self.transform_targ = transform_targ
+        self.transform_obs = transform_obs
 
     def __call__(self, batch):
+        # transform all observations
+        if self.transform_obs is not None:
+            for k in ('x_targ', 'x'):
+                if k in batch:
+                    batch[k] = _apply_transform_to_batch_dict(batch[k], self.transform_obs)
         # transform inputs
         if self.transform is not None:
             if 'x' not in batch:
@@ -59,7 +71,7 @@ class DisentDatasetTransform(object):
         return batch
 
     def __repr__(self):
-        return f'{self.__class__.__name__}(transform={repr(self.transform)}, transform_targ={repr(self.transform_targ)})'
+        return f'{self.__class__.__name__}(transform={repr(self.transform)}, transform_targ={repr(self.transform_targ)}, transform_obs={repr(self.transform_obs)})'
 
 
 def _apply_transform_to_batch_dict(batch, transform):
@@ -24,6 +24,7 @@
 
 from typing import Optional
 from typing import Sequence
+from typing import Tuple
 
 import torch
 import disent.dataset.transform.functional as F_d
@@ -45,6 +46,9 @@ class Noop(object):
     def __call__(self, obs):
         return obs
 
+    def transform_batch(self, obs):
+        return obs
+
     def __repr__(self):
         return f'{self.__class__.__name__}()'
 
@@ -69,6 +73,9 @@ class CheckTensor(object):
     def __call__(self, obs):
         return F_d.check_tensor(obs, low=self._low, high=self._high, dtype=self._dtype)
 
+    def transform_batch(self, obs):
+        return F_d.check_tensor(obs, low=self._low, high=self._high, dtype=self._dtype)
+
     def __repr__(self):
         kwargs = dict(low=self._low, high=self._high, dtype=self._dtype)
         kwargs = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items() if (v is not None))
@@ -103,12 +110,57 @@ class ToImgTensorF32(object):
     def __call__(self, obs) -> torch.Tensor:
         return F_d.to_img_tensor_f32(obs, size=self._size, mean=self._mean, std=self._std)
 
+    def transform_batch(self, obs) -> torch.Tensor:
+        return F_d.to_img_tensor_f32_batch(obs, size=self._size, mean=self._mean, std=self._std)
+
+    def split_u8(self) -> Tuple['ToImgTensorU8', 'ImgTensorU8ToF32']:
+        """
+        Split this transform into two parts that give exactly the same results when
+        composed. The first part should be applied to each observation in the workers
+        of a dataloader, producing uint8 tensors that are 4x smaller. The second part
+        should be applied to the collated batch in the main process, or on the GPU.
+        """
+        return ToImgTensorU8(size=self._size), ImgTensorU8ToF32(mean=self._mean, std=self._std)
+
     def __repr__(self):
         kwargs = dict(size=self._size, mean=self._mean, std=self._std)
         kwargs = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items() if (v is not None))
         return f'{self.__class__.__name__}({kwargs})'
 
 
+class ImgTensorU8ToF32(object):
+    """
+    Convert uint8 image tensors with their channels first, either single
+    observations (C, H, W) or batches (B, C, H, W), to normalised float32.
+    Applying this after `ToImgTensorU8` is the same as `ToImgTensorF32`.
+
+    Steps:
+        1. if we have integer inputs, divide by 255
+        2. normalize using mean and std, values might thus be outside of the range [0, 1]
+
+    See: disent.transform.functional.img_tensor_u8_to_f32
+    """
+
+    def __init__(
+        self,
+        mean: Optional[Sequence[float]] = None,
+        std: Optional[Sequence[float]] = None,
+    ):
+        self._mean = tuple(mean) if (mean is not None) else None
+        self._std = tuple(std) if (std is not None) else None
+
+    def __call__(self, obs) -> torch.Tensor:
+        return F_d.img_tensor_u8_to_f32(obs, mean=self._mean, std=self._std)
+
+    def transform_batch(self, obs) -> torch.Tensor:
+        return F_d.img_tensor_u8_to_f32(obs, mean=self._mean, std=self._std)
+
+    def __repr__(self):
+        kwargs = dict(mean=self._mean, std=self._std)
+        kwargs = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items() if (v is not None))
+        return f'{self.__class__.__name__}({kwargs})'
+
+
 class ToImgTensorU8(object):
     """
     Basic transform that makes sure the image tensor is uint8 and a specified size.
@@ -130,6 +182,9 @@ class ToImgTensorU8(object):
     def __call__(self, obs) -> torch.Tensor:
         return F_d.to_img_tensor_u8(obs, size=self._size)
 
+    def transform_batch(self, obs) -> torch.Tensor:
+        return F_d.to_img_tensor_u8_batch(obs, size=self._size)
+
     def __repr__(self):
         kwargs = f'size={repr(self._size)}' if (self._size is not None) else ''
         return f'{self.__class__.__name__}({kwargs})'
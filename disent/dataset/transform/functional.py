@@ -23,6 +23,7 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 from typing import Any
+from typing import Callable
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
@@ -178,6 +179,122 @@ def to_img_tensor_f32(
     return obs
 
 
+# ========================================================================= #
+# Batched Normalized Image Tensors                                          #
+# ========================================================================= #
+
+
+def _stack_obs(obs: Sequence[Any]) -> Union[torch.Tensor, np.ndarray]:
+    if isinstance(obs[0], torch.Tensor):
+        return torch.stack(list(obs), dim=0)
+    return np.stack([np.asarray(o) for o in obs], axis=0)
+
+
+def apply_transform_batch(transform: Optional[Callable[[Any], Any]], obs: Union[np.ndarray, torch.Tensor]) -> Union[np.ndarray, torch.Tensor]:
+    """
+    Apply a transform to a batch of observations, with the first dimension the batch dimension.
+    - If the transform defines a `transform_batch` method, this is called once on the entire batch.
+    - Otherwise the transform is applied to each observation and the results are stacked.
+
+    The results should always be the same as stacking the individually transformed observations.
+    """
+    if transform is None:
+        return obs
+    if hasattr(transform, 'transform_batch'):
+        return transform.transform_batch(obs)
+    return _stack_obs([transform(o) for o in obs])
+
+
+def _batch_to_tensor_chw(obs: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+    # convert a batch of images from (B, H, W, C) or (B, H, W) to (B, C, H, W)
+    if not isinstance(obs, torch.Tensor):
+        obs = torch.from_numpy(np.ascontiguousarray(obs))
+    # add missing axis
+    if obs.ndim == 3:
+        obs = obs[:, :, :, None]
+    assert obs.ndim == 4, f'batch of obs does not have 4 dimensions, got: {obs.ndim} for shape: {tuple(obs.shape)}'
+    # move axis
+    return torch.moveaxis(obs, -1, -3)
+
+
+def to_img_tensor_u8_batch(
+    obs: Union[np.ndarray, torch.Tensor],
+    size: Optional[SizeType] = None,
+) -> torch.Tensor:
+    """
+    Batched version of `to_img_tensor_u8`, converting (B, H, W, C) to (B, C, H, W)
+    - resizing falls back to transforming each observation individually
+    """
+    # resize images
+    if (size is not None) and _is_size_different(obs[0], size):
+        return _stack_obs([to_img_tensor_u8(np.asarray(o), size=size) for o in obs])
+    # to tensor & move axis
+    obs = _batch_to_tensor_chw(obs)
+    # checks
+    assert obs.dtype == torch.uint8
+    # done!
+    return obs
+
+
+def to_img_tensor_f32_batch(
+    obs: Union[np.ndarray, torch.Tensor],
+    size: Optional[SizeType] = None,
+    mean: Optional[Sequence[float]] = None,
+    std: Optional[Sequence[float]] = None,
+) -> torch.Tensor:
+    """
+    Batched version of `to_img_tensor_f32`, converting (B, H, W, C) to (B, C, H, W)
+    - the results are exactly the same as stacking the results of `to_img_tensor_f32`
+    - resizing falls back to transforming each observation individually
+    """
+    # resize images
+    if (size is not None) and _is_size_different(obs[0], size):
+        return _stack_obs([to_img_tensor_f32(np.asarray(o), size=size, mean=mean, std=std) for o in obs])
+    # transform to tensor, add missing dims & move channel dim to front
+    # - this is the same as `F_tv.to_tensor`, which only divides uint8 inputs by 255
+    obs = _batch_to_tensor_chw(obs).contiguous()
+    if obs.dtype == torch.uint8:
+        obs = obs.to(dtype=torch.float32).div(255)
+    # checks
+    assert obs.dtype == torch.float32, f'obs is not dtype torch.float32, got: {obs.dtype}'
+    # apply mean and std, we obs is of the shape (B, C, H, W)
+    if (mean is not None) or (std is not None):
+        obs = F_tv.normalize(obs, mean=0. if (mean is None) else mean, std=1. if (std is None) else std, inplace=True)
+        assert obs.dtype == torch.float32, f'after normalization, tensor should remain as dtype torch.float32, got: {obs.dtype}'
+    # done!
+    return obs
+
+
+def img_tensor_u8_to_f32(
+    obs: torch.Tensor,
+    mean: Optional[Sequence[float]] = None,
+    std: Optional[Sequence[float]] = None,
+) -> torch.Tensor:
+    """
+    Convert uint8 image tensors that already have their channels first, eg. the output of
+    `to_img_tensor_u8` or a collated batch of these (..., C, H, W), to normalised float32.
+    - `img_tensor_u8_to_f32(to_img_tensor_u8(obs, size), mean, std)` is exactly the same as
+      `to_img_tensor_f32(obs, size, mean, std)`, so this can be deferred until after
+      observations are collated, reducing the number of bytes sent from workers by 4x.
+
+    Steps:
+        1. if we have integer inputs, divide by 255
+        2. normalize using mean and std, values might thus be outside of the range [0, 1]
+    """
+    # this is the same as `F_tv.to_tensor`, which only divides uint8 inputs by 255
+    if obs.dtype == torch.uint8:
+        obs = obs.to(dtype=torch.float32).div_(255)
+    # checks
+    assert obs.dtype == torch.float32, f'obs is not dtype torch.float32, got: {obs.dtype}'
+    assert obs.ndim >= 3, f'obs must have at least 3 dimensions (..., C, H, W), got: {obs.ndim} for shape: {tuple(obs.shape)}'
+    # apply mean and std, broadcasting over the leading dimensions
+    if (mean is not None) or (std is not None):
+        obs = F_tv.normalize(obs, mean=0. if (mean is None) else mean, std=1. if (std is None) else std, inplace=True)
+        assert obs.dtype == torch.float32, f'after normalization, tensor should remain as dtype torch.float32, got: {obs.dtype}'
+    # done!
+    return obs
+
+
 # ========================================================================= #
 # Custom Normalized Image - Faster Than Above                               #
 # ========================================================================= #
@@ -0,0 +1,445 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Benchmark the read throughput of a dataset saved with different storage layouts.
+
+A layout is a dictionary describing how the data is stored on disk:
+    - `dict(backend='hdf5', chunks=(1, 64, 64, 3), compression='gzip', compression_lvl=4)`
+    - `dict(backend='memmap')`: an uncompressed `.npy` file that is memory-mapped
+    - `dict(backend='npz')`:    a compressed `.npz` file that is loaded into memory
+
+Each layout is measured with different access patterns:
+    - "single":        random single entries, eg. `data[i]`
+    - "sorted_batch":  random batches of sorted indices read at once, eg. `data[sorted(idxs)]`
+    - "random_batch":  random batches read one entry at a time, like the default pytorch collate
+    - "dataloader_wN": random batches read through a `DataLoader` with `N` workers
+
+Usage from the command line:
+    $ python3 -m disent.dataset.util.benchmark data.h5 --dataset-name data --max-entries 2000
+"""
+
+import logging
+import os
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+
+from disent.util.profiling import Timer
+from disent.util.strings.fmt import bytes_to_human
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Layouts                                                                   #
+# ========================================================================= #
+
+
+BACKENDS = ('hdf5', 'memmap', 'npz')
+ACCESS_PATTERNS = ('single', 'sorted_batch', 'random_batch', 'dataloader')
+
+
+def storage_layout_name(layout: Dict[str, Any]) -> str:
+    if layout['backend'] != 'hdf5':
+        return layout['backend']
+    chunks = 'x'.join(str(c) for c in layout['chunks'])
+    compression = layout.get('compression', None)
+    if (compression is None) or (layout.get('compression_lvl', None) is None):
+        return f'hdf5[{chunks}]'
+    return f'hdf5[{chunks},{compression}:{layout["compression_lvl"]}]'
+
+
+def make_storage_layouts(
+    obs_shape: Sequence[int],
+    chunk_lens: Sequence[int] = (1, 8, 32),
+    codecs: Sequence[Optional[str]] = (None, 'gzip', 'lzf'),
+    compression_lvl: int = 4,
+    backends: Sequence[str] = BACKENDS,
+) -> List[Dict[str, Any]]:
+    """
+    Get the default candidate layouts, hdf5 chunks always span entire observations
+    so that reading a single entry never needs to decompress more than one chunk.
+    """
+    layouts = []
+    for backend in backends:
+        if backend == 'hdf5':
+            for chunk_len in chunk_lens:
+                for codec in codecs:
+                    layouts.append(dict(backend='hdf5', chunks=(chunk_len, *obs_shape), compression=codec, compression_lvl=compression_lvl if codec else None))
+        elif backend in BACKENDS:
+            layouts.append(dict(backend=backend))
+        else:
+            raise KeyError(f'invalid storage backend: {repr(backend)}, must be one of: {BACKENDS}')
+    return layouts
+
+
+def _layout_path(temp_dir: str, layout: Dict[str, Any], i: int) -> str:
+    ext = {'hdf5': 'h5', 'memmap': 'npy', 'npz': 'npz'}[layout['backend']]
+    return os.path.join(temp_dir, f'layout_{i}.{ext}')
+
+
+def save_storage_layout(array: np.ndarray, path: str, layout: Dict[str, Any]):
+    """
+    Save the array to the path using the given layout.
+    """
+    from disent.dataset.util.hdf5 import H5Builder
+    from disent.dataset.util.memmap import memmap_open
+    backend = layout['backend']
+    if backend == 'hdf5':
+        with H5Builder(path, mode='w') as builder:
+            builder.add_dataset_from_array(
+                name='data',
+                array=array,
+                chunk_shape=tuple(layout['chunks']),
+                compression=layout.get('compression', None),
+                compression_lvl=layout.get('compression_lvl', None),
+                compression_workers=layout.get('compression_workers', 0),
+            )
+    elif backend == 'memmap':
+        out = memmap_open(path, mode='w+', shape=array.shape, dtype=array.dtype)
+        out[...] = array
+        out.flush()
+        del out
+    elif backend == 'npz':
+        np.savez_compressed(path, data=array)
+    else:
+        raise KeyError(f'invalid storage backend: {repr(backend)}, must be one of: {BACKENDS}')
+
+
+def load_storage_layout(path: str, layout: Dict[str, Any]) -> Dataset:
+    """
+    Open the data saved with `save_storage_layout` as a picklable dataset.
+    """
+    from disent.dataset.data import ArrayDataset
+    from disent.dataset.data import Hdf5Dataset
+    from disent.dataset.data import MemmapDataset
+    backend = layout['backend']
+    if backend == 'hdf5':
+        return Hdf5Dataset(path, h5_dataset_name='data')
+    elif backend == 'memmap':
+        return MemmapDataset(path)
+    elif backend == 'npz':
+        with np.load(path) as npz:
+            return ArrayDataset(npz['data'])
+    else:
+        raise KeyError(f'invalid storage backend: {repr(backend)}, must be one of: {BACKENDS}')
+
+
+# ========================================================================= #
+# Access Patterns                                                           #
+# ========================================================================= #
+
+
+def _get_raw_array(data: Dataset):
+    # the underlying array supports batched indexing
+    for attr in ('_hdf5_data', '_array'):
+        if hasattr(data, attr):
+            return getattr(data, attr)
+    raise TypeError(f'the sorted_batch access pattern is not supported for datasets of type: {type(data)}')
+
+
+def _collate(batch: List[np.ndarray]) -> np.ndarray:
+    return np.stack(batch, axis=0)
+
+
+def benchmark_access_pattern(
+    data: Dataset,
+    access_pattern: str = 'random_batch',
+    batch_size: int = 64,
+    num_workers: int = 0,
+    max_entries: int = 5_000,
+    timeout: float = 10,
+    seed: int = 7777,
+) -> float:
+    """
+    Get the number of entries read per second from the dataset using the given access pattern.
+    """
+    n = min(len(data), max_entries)
+    indices = np.random.RandomState(seed).permutation(len(data))[:n].tolist()
+    batches = [indices[i:i+batch_size] for i in range(0, n, batch_size)]
+    # get the read function
+    if access_pattern == 'single':
+        batches = [[idx] for idx in indices]
+        def _read(idxs): return data[idxs[0]]
+    elif access_pattern == 'sorted_batch':
+        array = _get_raw_array(data)
+        def _read(idxs): return array[np.sort(idxs)]
+    elif access_pattern == 'random_batch':
+        def _read(idxs): return _collate([data[i] for i in idxs])
+    elif access_pattern == 'dataloader':
+        # workers are started before the timer
+        iterator = iter(DataLoader(data, batch_sampler=batches, num_workers=num_workers, collate_fn=_collate))
+        with Timer() as t:
+            count = 0
+            for batch in iterator:
+                count += len(batch)
+                if t.elapsed > timeout:
+                    break
+        return count / t.elapsed
+    else:
+        raise KeyError(f'invalid access pattern: {repr(access_pattern)}, must be one of: {ACCESS_PATTERNS}')
+    # read the batches
+    count = 0
+    with Timer() as t:
+        for idxs in batches:
+            _read(idxs)
+            count += len(idxs)
+            if t.elapsed > timeout:
+                break
+    return count / t.elapsed
+
+
+# ========================================================================= #
+# Benchmark                                                                 #
+# ========================================================================= #
+
+
+def _pattern_keys(access_patterns: Sequence[str], num_workers: Sequence[int]) -> List[Tuple[str, str, int]]:
+    keys = []
+    for pattern in access_patterns:
+        if pattern == 'dataloader':
+            keys.extend((f'dataloader_w{w}', pattern, w) for w in num_workers)
+        else:
+            keys.append((pattern, pattern, 0))
+    return keys
+
+
+def get_pattern_key(access_pattern: str, num_workers: Sequence[int] = (0,)) -> str:
+    """
+    Get the key of the benchmark results that correspond to the access pattern,
+    "dataloader" results are keyed by the number of workers, the most workers is chosen.
+    """
+    if access_pattern not in ACCESS_PATTERNS:
+        raise KeyError(f'invalid access pattern: {repr(access_pattern)}, must be one of: {ACCESS_PATTERNS}')
+    if access_pattern == 'dataloader':
+        return f'dataloader_w{max(num_workers)}'
+    return access_pattern
+
+
+def benchmark_storage_layouts(
+    array: np.ndarray,
+    layouts: Optional[Sequence[Dict[str, Any]]] = None,
+    access_patterns: Sequence[str] = ACCESS_PATTERNS,
+    num_workers: Sequence[int] = (0,),
+    batch_size: int = 64,
+    max_entries: int = 5_000,
+    timeout: float = 10,
+    temp_dir: Optional[str] = None,
+    seed: int = 7777,
+) -> List[Dict[str, Any]]:
+    """
+    Save the array with every layout to temporary files, and then measure the write
+    time, the file size, and the entries per second of every access pattern.
+    - Codecs that are not available are skipped, eg. blosc & zstd without `hdf5plugin`
+    - The operating system page cache is not cleared between runs, so results
+      reflect the warm-cache throughput that is typical during training.
+    """
+    import tempfile
+    array = np.asarray(array)
+    if layouts is None:
+        layouts = make_storage_layouts(obs_shape=array.shape[1:])
+    keys = _pattern_keys(access_patterns, num_workers)
+    # run the benchmark
+    results = []
+    with tempfile.TemporaryDirectory(prefix='disent_layout_bench_', dir=temp_dir) as tmp_dir:
+        for i, layout in enumerate(layouts):
+            path = _layout_path(tmp_dir, layout, i)
+            try:
+                with Timer() as t_write:
+                    save_storage_layout(array, path, layout)
+            except ImportError as e:
+                log.warning(f'skipping layout: {storage_layout_name(layout)}, {e}')
+                continue
+            # measure the reads
+            with Timer() as t_load:
+                data = load_storage_layout(path, layout)
+            result = dict(name=storage_layout_name(layout), layout=dict(layout), write_time=t_write.elapsed, load_time=t_load.elapsed, file_size=os.path.getsize(path))
+            for key, pattern, workers in keys:
+                result[key] = benchmark_access_pattern(data, access_pattern=pattern, batch_size=batch_size, num_workers=workers, max_entries=max_entries, timeout=timeout, seed=seed)
+            results.append(result)
+            # cleanup
+            if hasattr(data, 'close'):
+                data.close()
+            del data
+            os.remove(path)
+    # print the results
+    log_storage_benchmark(results, keys=[k for k, _, _ in keys])
+    return results
+
+
+def log_storage_benchmark(results: Sequence[Dict[str, Any]], keys: Optional[Sequence[str]] = None):
+    if not results:
+        return
+    if keys is None:
+        keys = [k for k in results[0] if k not in ('name', 'layout', 'write_time', 'load_time', 'file_size')]
+    width = max(len(r['name']) for r in results)
+    log.info(f'{"layout":{width}s} | {"write":>8s} {"size":>12s} | ' + ' '.join(f'{k:>14s}' for k in keys))
+    for r in results:
+        log.info(f'{r["name"]:{width}s} | {r["write_time"]:7.3f}s {bytes_to_human(r["file_size"]):>12s} | ' + ' '.join(f'{r[k]:12.1f}/s' for k in keys))
+
+
+def recommend_storage_layout(
+    results: Sequence[Dict[str, Any]],
+    access_pattern: str = 'random_batch',
+    backends: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Get the benchmark result with the highest throughput for the access pattern,
+    ties are broken by choosing the smallest file.
+    """
+    candidates = [r for r in results if (backends is None) or (r['layout']['backend'] in backends)]
+    if not candidates:
+        raise ValueError(f'no benchmark results are available for the backends: {backends}')
+    if access_pattern not in candidates[0]:
+        raise KeyError(f'access pattern: {repr(access_pattern)} was not benchmarked, available keys are: {sorted(candidates[0].keys())}')
+    return max(candidates, key=lambda r: (r[access_pattern], -r['file_size']))
+
+
+# ========================================================================= #
+# Auto-Tune                                                                 #
+# ========================================================================= #
+
+
+def hdf5_autotune_layout(
+    h5_path: str,
+    dataset_name: str,
+    chunk_size: Optional[Tuple[int, ...]] = None,
+    compression: Optional[str] = 'gzip',
+    compression_lvl: Optional[int] = 4,
+    mutator=None,
+    num_samples: int = 4096,
+    access_pattern: str = 'random_batch',
+    layouts: Optional[Sequence[Dict[str, Any]]] = None,
+    **benchmark_kwargs,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Benchmark the candidate hdf5 layouts on an evenly spaced sample of the
+    input dataset, after applying the mutator, and return the best layout
+    and all the results. The current layout is always one of the candidates.
+    - The "dataloader" access pattern ranks the layouts using the most `num_workers`.
+    - The memmap backend is also benchmarked for reference, a note is
+      logged if it would be faster than the best hdf5 layout.
+    """
+    import h5py
+    # check the access pattern before running the benchmark
+    access_patterns = benchmark_kwargs.pop('access_patterns', [access_pattern])
+    num_workers = tuple(benchmark_kwargs.pop('num_workers', (0,)))
+    key = get_pattern_key(access_pattern, num_workers=num_workers)
+    if key not in [k for k, _, _ in _pattern_keys(access_patterns, num_workers)]:
+        raise KeyError(f'access pattern: {repr(access_pattern)} is not one of the benchmarked access patterns: {list(access_patterns)}')
+    # load the sample
+    with h5py.File(h5_path, 'r') as h5_file:
+        inp = h5_file[dataset_name]
+        step = max(len(inp) // num_samples, 1)
+        sample = inp[::step][:num_samples]
+    if mutator is not None:
+        sample = np.asarray(mutator(sample))
+    obs_shape = sample.shape[1:]
+    # get the candidates
+    if layouts is None:
+        layouts = make_storage_layouts(obs_shape=obs_shape, codecs=(None, 'gzip', 'lzf'), compression_lvl=4 if (compression_lvl is None) else compression_lvl)
+        if (chunk_size is not None) and (len(chunk_size) == sample.ndim) and all(c <= s for c, s in zip(chunk_size, sample.shape)):
+            current = dict(backend='hdf5', chunks=tuple(chunk_size), compression=compression, compression_lvl=compression_lvl if compression else None)
+            if current not in layouts:
+                layouts.insert(0, current)
+    # benchmark
+    results = benchmark_storage_layouts(sample, layouts=layouts, access_patterns=access_patterns, num_workers=num_workers, **benchmark_kwargs)
+    best = recommend_storage_layout(results, access_pattern=key, backends=['hdf5'])
+    # check other backends
+    best_any = recommend_storage_layout(results, access_pattern=key)
+    if best_any['layout']['backend'] != 'hdf5':
+        log.info(f'storage layout: {best_any["name"]} is faster than the best hdf5 layout: {best["name"]} ({best_any[key]:.1f}/s vs {best[key]:.1f}/s), consider converting the dataset, eg. with `disent.dataset.util.memmap.memmap_save_from_hdf5`')
+    return best['layout'], results
+
+
+# ========================================================================= #
+# Entrypoint                                                                #
+# ========================================================================= #
+
+
+def _parse_args(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='benchmark the read throughput of different dataset storage layouts')
+    parser.add_argument('path', type=str, help='input `.h5`, `.npz` or `.npy` file')
+    parser.add_argument('--dataset-name', type=str, default='data', help='the hdf5 dataset name or the npz key')
+    parser.add_argument('--num-samples', type=int, default=10_000, help='number of entries to benchmark with')
+    parser.add_argument('--max-entries', type=int, default=5_000, help='maximum entries to read for each access pattern')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, nargs='+', default=[0])
+    parser.add_argument('--chunk-lens', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--codecs', type=str, nargs='+', default=['none', 'gzip', 'lzf'])
+    parser.add_argument('--compression-lvl', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=10)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = _parse_args(args)
+    # load the data
+    if args.path.endswith('.npz'):
+        with np.load(args.path) as npz:
+            array = npz[args.dataset_name][:args.num_samples]
+    elif args.path.endswith('.npy'):
+        array = np.load(args.path, mmap_mode='r')[:args.num_samples]
+    else:
+        import h5py
+        with h5py.File(args.path, 'r') as h5_file:
+            array = h5_file[args.dataset_name][:args.num_samples]
+    # benchmark everything
+    results = benchmark_storage_layouts(
+        array=array,
+        layouts=make_storage_layouts(
+            obs_shape=array.shape[1:],
+            chunk_lens=args.chunk_lens,
+            codecs=[None if (c == 'none') else c for c in args.codecs],
+            compression_lvl=args.compression_lvl,
+        ),
+        num_workers=args.num_workers,
+        batch_size=args.batch_size,
+        max_entries=args.max_entries,
+        timeout=args.timeout,
+    )
+    # show the best layouts
+    for key in results[0]:
+        if key not in ('name', 'layout', 'write_time', 'load_time', 'file_size'):
+            log.info(f'best layout for {key}: {recommend_storage_layout(results, access_pattern=key)["name"]}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
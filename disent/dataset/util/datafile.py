@@ -22,8 +22,11 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import json
+import logging
 import os
 from abc import ABCMeta
+from typing import Any
 from typing import Callable
 from typing import Dict
 from typing import final
@@ -38,11 +41,17 @@ import numpy as np
 from disent.dataset.util.hdf5 import hdf5_resave_file
 from disent.util.inout.cache import stalefile
 from disent.util.function import wrapped_partial
+from disent.util.inout.files import AtomicSaveFile
 from disent.util.inout.files import retrieve_file
+from disent.util.inout.hashing import hash_file
+from disent.util.inout.hashing import is_valid_file_hash
 from disent.util.inout.paths import filename_from_url
 from disent.util.inout.paths import modify_file_name
 
 
+log = logging.getLogger(__name__)
+
+
 # ========================================================================= #
 # data objects                                                              #
 # ========================================================================= #
@@ -178,6 +187,14 @@ class DataFileHashedDlGen(DataFileHashed, metaclass=ABCMeta):
 class DataFileHashedDlH5(DataFileHashedDlGen):
     """
     Downloads an hdf5 file and pre-processes it into the specified chunk_size.
+
+    The storage layout can also be tuned automatically by benchmarking candidate
+    chunk shapes and codecs on a sample of the data, see `disent.dataset.util.benchmark`
+    - hdf5_autotune="recommend": log the fastest layout, but save the file using the specified layout.
+    - hdf5_autotune="apply":     save the file using the fastest layout. The generated file can no longer
+                                 be checked against `file_hash`, instead its hash and layout are recorded in
+                                 the sidecar file `<out_file>.layout.json`, and the file is only re-generated
+                                 if it no longer matches the recorded hash.
     """
 
     def __init__(
@@ -194,6 +211,11 @@ class DataFileHashedDlH5(DataFileHashedDlGen):
         hdf5_dtype: Optional[Union[np.dtype, str]] = None,
         hdf5_mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,
         hdf5_obs_shape: Optional[Sequence[int]] = None,
+        # h5 layout tuning
+        hdf5_autotune: Optional[str] = None,
+        hdf5_autotune_samples: int = 4096,
+        hdf5_autotune_pattern: str = 'random_batch',
+        hdf5_autotune_kwargs: Optional[Dict[str, Any]] = None,
         # save paths
         uri_name: Optional[str] = None,
         file_name: Optional[str] = None,
@@ -222,13 +244,70 @@ class DataFileHashedDlH5(DataFileHashedDlGen):
         )
         # save the dataset name
         self._dataset_name = hdf5_dataset_name
+        # layout tuning
+        if hdf5_autotune not in (None, 'recommend', 'apply'):
+            raise KeyError(f'invalid hdf5_autotune mode: {repr(hdf5_autotune)}, must be one of: None, "recommend", "apply"')
+        if hdf5_autotune is not None:
+            from disent.dataset.util.benchmark import get_pattern_key
+            get_pattern_key(hdf5_autotune_pattern, num_workers=(hdf5_autotune_kwargs or {}).get('num_workers', (0,)))
+        self._hdf5_autotune = hdf5_autotune
+        self._hdf5_autotune_kwargs = dict(
+            chunk_size=hdf5_chunk_size,
+            compression=hdf5_compression,
+            compression_lvl=hdf5_compression_lvl,
+            mutator=hdf5_mutator,
+            num_samples=hdf5_autotune_samples,
+            access_pattern=hdf5_autotune_pattern,
+            **({} if (hdf5_autotune_kwargs is None) else hdf5_autotune_kwargs),
+        )
 
     @property
     def dataset_name(self) -> str:
         return self._dataset_name
 
+    def prepare(self, out_dir: str) -> str:
+        if self._hdf5_autotune != 'apply':
+            return super().prepare(out_dir=out_dir)
+        # the tuned file is checked against the recorded hash instead
+        out_file = os.path.join(out_dir, self._file_name)
+        layout_file = f'{out_file}.layout.json'
+        if os.path.exists(layout_file):
+            with open(layout_file, 'r') as fp:
+                file_hash = json.load(fp)['file_hash']
+            if is_valid_file_hash(out_file, hash=file_hash, hash_type=self._hash_type, hash_mode=self._hash_mode):
+                return out_file
+            log.warning(f'file is stale because it does not match the hash recorded in: {repr(layout_file)}')
+        self._prepare(out_dir=out_dir, out_file=out_file)
+        return out_file
+
     def _generate(self, inp_file: str, out_file: str):
-        self._hdf5_resave_file(inp_path=inp_file, out_path=out_file)
+        if self._hdf5_autotune is None:
+            self._hdf5_resave_file(inp_path=inp_file, out_path=out_file)
+            return
+        # benchmark the layouts
+        from disent.dataset.util.benchmark import hdf5_autotune_layout
+        from disent.dataset.util.benchmark import storage_layout_name
+        layout, _ = hdf5_autotune_layout(h5_path=inp_file, dataset_name=self._dataset_name, **self._hdf5_autotune_kwargs)
+        log.info(f'fastest hdf5 layout for: {repr(self.out_name)} is: {storage_layout_name(layout)}')
+        if self._hdf5_autotune == 'recommend':
+            self._hdf5_resave_file(inp_path=inp_file, out_path=out_file)
+            return
+        # save the file with the tuned layout
+        self._hdf5_resave_file(
+            inp_path=inp_file,
+            out_path=out_file,
+            chunk_size=tuple(layout['chunks']),
+            compression=layout['compression'],
+            compression_lvl=layout['compression_lvl'],
+        )
+        # record the layout & hash
+        with AtomicSaveFile(f'{out_file}.layout.json', open_mode='w', overwrite=True) as (_, fp):
+            json.dump(dict(
+                chunks=[int(c) for c in layout['chunks']],
+                compression=layout['compression'],
+                compression_lvl=layout['compression_lvl'],
+                file_hash=hash_file(out_file, hash_type=self._hash_type, hash_mode=self._hash_mode),
+            ), fp)
 
 
 # ========================================================================= #
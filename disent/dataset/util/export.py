@@ -0,0 +1,486 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Export the encodings of an entire ground-truth dataset, eg. for downstream RL tasks.
+
+The observations are streamed through a DataLoader in large batches, encoded,
+and the indices, factors, codes (and optionally the raw observations) are
+written incrementally to disk, so memory usage is bounded by the batch size.
+Progress is committed after every batch, so interrupted exports are resumed.
+
+Supported output formats:
+    - "hdf5":   a single `.h5` file with the datasets `indices`, `factors`, `codes` & `obs`
+    - "memmap": a directory of `.npy` files, one for each array, alongside an `export.json` file
+    - "npz":    a single `.npz` file, the export is first written as a memmap
+                directory `<path>.parts` which is packed once the export is complete.
+
+Usage from the command line, the framework should be saved with `torch.save(framework, path)`:
+    $ python3 -m disent.dataset.util.export --data disent.dataset.data.XYObjectData --framework model.pt --out encodings.h5
+"""
+
+import inspect
+import json
+import logging
+import os
+import shutil
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler
+from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from disent.dataset.data import GroundTruthData
+from disent.dataset.transform.functional import apply_transform_batch
+from disent.util.inout.files import AtomicSaveFile
+from disent.util.profiling import Timer
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Helper                                                                    #
+# ========================================================================= #
+
+
+EXPORT_FORMATS = ('hdf5', 'memmap', 'npz')
+
+
+def _infer_export_format(path: str) -> str:
+    if path.endswith('.h5') or path.endswith('.hdf5'):
+        return 'hdf5'
+    elif path.endswith('.npz'):
+        return 'npz'
+    return 'memmap'
+
+
+def framework_encode_fn(framework) -> Callable[[torch.Tensor], torch.Tensor]:
+    """
+    Get the encode function of a framework, moving each batch to the device of the framework.
+    """
+    return lambda x: framework.encode(x.to(framework.device))
+
+
+class _BatchedExportDataset(Dataset):
+    """
+    Map a list of indices to a batch of data,
+    used with a `BatchSampler` so that workers fetch entire batches at once.
+    """
+
+    def __init__(self, data: GroundTruthData, transform=None, save_obs: bool = False):
+        self._data = data
+        self._transform = transform
+        self._save_obs = save_obs
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, idxs):
+        idxs = np.asarray(idxs, dtype='int64')
+        obs = self._data.get_observations(idxs)
+        batch = dict(
+            indices=idxs,
+            factors=self._data.idx_to_pos(idxs),
+            inputs=apply_transform_batch(self._transform, obs),
+        )
+        if self._save_obs:
+            batch['obs'] = obs
+        return batch
+
+
+def _to_numpy(x) -> np.ndarray:
+    return x.detach().cpu().numpy() if torch.is_tensor(x) else np.asarray(x)
+
+
+def _check_export_attrs(path: str, existing: Dict[str, Any], attrs: Dict[str, Any]):
+    # a resumed export must be of the same data & model, otherwise mismatched data is appended
+    for k, v in attrs.items():
+        if _normalize_attr(existing.get(k)) != _normalize_attr(v):
+            raise ValueError(f'cannot resume the export: {repr(path)}, the existing attribute {repr(k)}: {repr(existing.get(k))} does not match: {repr(v)}, enable `overwrite` to start a new export.')
+
+
+def _normalize_attr(value):
+    # attributes loaded from hdf5 or json files do not preserve tuples or numpy types
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.tolist()
+    if isinstance(value, (tuple, list)):
+        return [_normalize_attr(v) for v in value]
+    return value
+
+
+# ========================================================================= #
+# Writers                                                                   #
+# ========================================================================= #
+
+
+class _ExportWriter(object):
+    """
+    Incrementally write arrays of length `num_obs`. The arrays are created when the
+    first batch is written, and `num_done` is committed after writing each batch.
+    """
+
+    def __init__(self, path: str, num_obs: int, attrs: Dict[str, Any]):
+        self._path = path
+        self._num_obs = num_obs
+        self._attrs = attrs
+
+    @property
+    def num_done(self) -> int:
+        raise NotImplementedError
+
+    def write(self, i: int, j: int, batch: Dict[str, np.ndarray]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _check_attrs(self, existing: Dict[str, Any]):
+        _check_export_attrs(self._path, existing, self._attrs)
+
+    def _check_array(self, name: str, array, values: np.ndarray):
+        if (tuple(array.shape[1:]) != tuple(values.shape[1:])) or (array.dtype != values.dtype):
+            raise ValueError(f'cannot resume the export: {repr(self._path)}, the existing array {repr(name)} with shape: {tuple(array.shape)} and dtype: {array.dtype} does not match the batch with shape: {tuple(values.shape)} and dtype: {values.dtype}, enable `overwrite` to start a new export.')
+
+
+class _Hdf5ExportWriter(_ExportWriter):
+
+    def __init__(self, path: str, num_obs: int, attrs: Dict[str, Any]):
+        import h5py
+        super().__init__(path, num_obs, attrs)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = h5py.File(path, 'a')
+        if 'num_done' not in self._file.attrs:
+            for k, v in attrs.items():
+                self._file.attrs[k] = v
+            self._file.attrs['num_done'] = 0
+        else:
+            try:
+                self._check_attrs(dict(self._file.attrs))
+            except ValueError:
+                self._file.close()
+                raise
+
+    @property
+    def num_done(self) -> int:
+        return int(self._file.attrs['num_done'])
+
+    def write(self, i: int, j: int, batch: Dict[str, np.ndarray]):
+        for name, values in batch.items():
+            if name in self._file:
+                self._check_array(name, self._file[name], values)
+        for name, values in batch.items():
+            if name not in self._file:
+                self._file.create_dataset(name, shape=(self._num_obs, *values.shape[1:]), dtype=values.dtype, chunks=(min(j - i, self._num_obs), *values.shape[1:]), track_times=False)
+            self._file[name][i:j] = values
+        # commit the progress
+        self._file.attrs['num_done'] = j
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _MemmapExportWriter(_ExportWriter):
+
+    def __init__(self, path: str, num_obs: int, attrs: Dict[str, Any]):
+        super().__init__(path, num_obs, attrs)
+        os.makedirs(path, exist_ok=True)
+        self._arrays: Dict[str, np.ndarray] = {}
+        # load the progress
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as fp:
+                self._meta = json.load(fp)
+            self._check_attrs(self._meta)
+            for name in self._meta['arrays']:
+                self._arrays[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r+')
+        else:
+            self._meta = dict(attrs, num_done=0, arrays=[])
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self._path, 'export.json')
+
+    @property
+    def num_done(self) -> int:
+        return int(self._meta['num_done'])
+
+    def write(self, i: int, j: int, batch: Dict[str, np.ndarray]):
+        for name, values in batch.items():
+            if name in self._arrays:
+                self._check_array(name, self._arrays[name], values)
+        for name, values in batch.items():
+            if name not in self._arrays:
+                self._arrays[name] = np.lib.format.open_memmap(os.path.join(self._path, f'{name}.npy'), mode='w+', dtype=values.dtype, shape=(self._num_obs, *values.shape[1:]))
+                self._meta['arrays'].append(name)
+            self._arrays[name][i:j] = values
+        # commit the progress, the data must be written first
+        for array in self._arrays.values():
+            array.flush()
+        self._meta['num_done'] = j
+        with AtomicSaveFile(self._meta_path, open_mode='w', overwrite=True) as (_, fp):
+            json.dump(self._meta, fp, indent=2)
+
+    def close(self):
+        self._arrays.clear()
+
+
+def _export_is_complete(path: str, out_format: str) -> bool:
+    if out_format == 'npz':
+        return os.path.exists(path)
+    elif out_format == 'memmap':
+        meta_path = os.path.join(path, 'export.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r') as fp:
+            meta = json.load(fp)
+        return meta['num_done'] == meta['num_obs']
+    elif out_format == 'hdf5':
+        import h5py
+        if not os.path.exists(path):
+            return False
+        with h5py.File(path, 'r') as f:
+            return int(f.attrs.get('num_done', -1)) == int(f.attrs.get('num_obs', -2))
+    raise KeyError(f'invalid export format: {repr(out_format)}, must be one of: {EXPORT_FORMATS}')
+
+
+def _load_export_attrs(path: str, out_format: str, keys) -> Dict[str, Any]:
+    if out_format == 'npz':
+        with np.load(path) as dat:
+            return {k: dat[k] for k in keys if k in dat.files}
+    elif out_format == 'memmap':
+        with open(os.path.join(path, 'export.json'), 'r') as fp:
+            return json.load(fp)
+    elif out_format == 'hdf5':
+        import h5py
+        with h5py.File(path, 'r') as f:
+            return dict(f.attrs)
+    raise KeyError(f'invalid export format: {repr(out_format)}, must be one of: {EXPORT_FORMATS}')
+
+
+def _export_remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# ========================================================================= #
+# Export                                                                    #
+# ========================================================================= #
+
+
+def export_encodings(
+    data: GroundTruthData,
+    encode_fn: Callable[[torch.Tensor], torch.Tensor],
+    out_path: str,
+    transform: Optional[Callable[[Any], Any]] = None,
+    out_format: Optional[str] = None,
+    batch_size: int = 256,
+    num_workers: int = 0,
+    save_obs: bool = False,
+    resume: bool = True,
+    overwrite: bool = False,
+    show_progress: bool = False,
+    attrs: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Encode every observation in the ground-truth data, writing the `indices`, `factors` and `codes`
+    (and the raw observations `obs` if `save_obs=True`) incrementally to disk.
+
+    :param data: The ground-truth data to export. If `save_obs` is enabled, this should not have a transform.
+    :param encode_fn: Function that encodes a batch of inputs, see `framework_encode_fn`.
+    :param transform: Transform applied to each batch of observations to obtain the inputs to `encode_fn`.
+    :param out_format: One of "hdf5", "memmap" or "npz", inferred from the extension of the path if not given.
+    :param resume: Continue an interrupted export from the last batch that was written. The attributes
+                   and arrays of the existing export must match this export, otherwise an error is raised.
+    :param overwrite: Remove any existing export before starting. Otherwise an error
+                      is raised if an export already exists and `resume=False`.
+    :param attrs: Extra attributes to save with the export, eg. the identity of the model.
+    :return: The path to the export.
+    """
+    out_format = _infer_export_format(out_path) if (out_format is None) else out_format
+    if out_format not in EXPORT_FORMATS:
+        raise KeyError(f'invalid export format: {repr(out_format)}, must be one of: {EXPORT_FORMATS}')
+    # npz files are packed from a memmap directory once complete
+    write_path = f'{out_path}.parts' if (out_format == 'npz') else out_path
+    # the attributes of the export, these must match those of an existing export
+    num_obs = len(data)
+    meta = dict(
+        num_obs=num_obs,
+        dataset_name=data.name,
+        factor_names=list(data.factor_names),
+        factor_sizes=[int(s) for s in data.factor_sizes],
+        **(attrs if attrs else {}),
+    )
+    # handle existing exports
+    if overwrite:
+        _export_remove(out_path)
+        _export_remove(write_path)
+    elif _export_is_complete(out_path, out_format):
+        if not resume:
+            raise FileExistsError(f'export already exists, either enable `resume` or `overwrite`: {repr(out_path)}')
+        _check_export_attrs(out_path, _load_export_attrs(out_path, out_format, meta.keys()), meta)
+        log.info(f'export is already complete: {repr(out_path)}')
+        return out_path
+    elif os.path.exists(write_path) and not resume:
+        raise FileExistsError(f'partial export already exists, either enable `resume` or `overwrite`: {repr(write_path)}')
+    # get the writer
+    writer = _Hdf5ExportWriter(write_path, num_obs, meta) if (out_format == 'hdf5') else _MemmapExportWriter(write_path, num_obs, meta)
+    # export the remaining observations
+    try:
+        start = writer.num_done
+        if start > 0:
+            log.info(f'resuming export from observation {start} of {num_obs}: {repr(write_path)}')
+        dataloader = DataLoader(
+            _BatchedExportDataset(data, transform=transform, save_obs=save_obs),
+            sampler=BatchSampler(range(start, num_obs), batch_size=batch_size, drop_last=False),
+            batch_size=None,
+            num_workers=num_workers,
+            pin_memory=torch.cuda.is_available(),
+        )
+        with Timer() as timer, tqdm(total=num_obs, initial=start, disable=not show_progress, desc='exporting') as progress:
+            i = start
+            for batch in dataloader:
+                inputs = batch.pop('inputs')
+                with torch.no_grad():
+                    batch['codes'] = encode_fn(inputs)
+                batch = {k: _to_numpy(v) for k, v in batch.items()}
+                j = i + len(batch['indices'])
+                writer.write(i, j, batch)
+                progress.update(j - i)
+                i = j
+        log.debug(f'exported {num_obs - start} observations in {timer.pretty} with batch_size={batch_size}, num_workers={num_workers}')
+    finally:
+        writer.close()
+    # pack the npz file
+    if out_format == 'npz':
+        arrays = load_export(write_path)
+        with AtomicSaveFile(out_path, overwrite=overwrite) as temp_file:
+            with open(temp_file, 'wb') as fp:
+                np.savez_compressed(fp, **arrays)
+        _export_remove(write_path)
+    return out_path
+
+
+def load_export(path: str, out_format: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Load an export created by `export_encodings`, returning the attributes along with the arrays.
+    - memmap arrays are memory-mapped, not loaded into memory.
+    - hdf5 arrays are loaded into memory, and the file is closed.
+    """
+    out_format = _infer_export_format(path) if (out_format is None) else out_format
+    if out_format == 'memmap':
+        with open(os.path.join(path, 'export.json'), 'r') as fp:
+            meta = json.load(fp)
+        return {
+            **{k: v for k, v in meta.items() if k != 'arrays'},
+            **{name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in meta['arrays']},
+        }
+    elif out_format == 'npz':
+        with np.load(path) as dat:
+            return {k: (dat[k].item() if dat[k].ndim == 0 else dat[k]) for k in dat.files}
+    elif out_format == 'hdf5':
+        import h5py
+        with h5py.File(path, 'r') as f:
+            return {
+                **{k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in f.attrs.items()},
+                **{name: f[name][()] for name in f.keys()},
+            }
+    raise KeyError(f'invalid export format: {repr(out_format)}, must be one of: {EXPORT_FORMATS}')
+
+
+# ========================================================================= #
+# Entrypoint                                                                #
+# ========================================================================= #
+
+
+def _torch_load_full_kwargs() -> Dict[str, Any]:
+    # the entire framework is pickled, not just the weights, `weights_only` was
+    # added in torch 1.13 and defaults to `True` from torch 2.6 which breaks this
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        return dict(weights_only=False)
+    return {}
+
+
+def _parse_args(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Export the encodings of an entire ground-truth dataset.')
+    parser.add_argument('--data', type=str, required=True, help='import path of the ground-truth data class, eg. "disent.dataset.data.XYObjectData"')
+    parser.add_argument('--data-root', type=str, default=None, help='data root of disk based datasets')
+    parser.add_argument('--framework', type=str, required=True, help='path to a framework saved with `torch.save`')
+    parser.add_argument('--transform', type=str, default='disent.dataset.transform.ToImgTensorF32', help='import path of the transform applied to the observations')
+    parser.add_argument('--out', type=str, required=True, help='output path, the format is inferred from the extension: .h5, .npz or a directory')
+    parser.add_argument('--format', type=str, default=None, choices=EXPORT_FORMATS)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--save-obs', action='store_true')
+    parser.add_argument('--no-resume', action='store_true')
+    parser.add_argument('--overwrite', action='store_true')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    from disent.metrics.cache import hash_model_weights
+    from disent.util.imports import import_obj
+    args = _parse_args(args)
+    # load the data & framework
+    data_cls = import_obj(args.data)
+    data = data_cls() if (args.data_root is None) else data_cls(data_root=args.data_root, prepare=True)
+    framework = torch.load(args.framework, map_location='cuda' if torch.cuda.is_available() else 'cpu', **_torch_load_full_kwargs())
+    framework.eval()
+    # export everything
+    export_encodings(
+        data=data,
+        encode_fn=framework_encode_fn(framework),
+        out_path=args.out,
+        transform=import_obj(args.transform)(),
+        out_format=args.format,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        save_obs=args.save_obs,
+        resume=not args.no_resume,
+        overwrite=args.overwrite,
+        show_progress=True,
+        attrs=dict(
+            framework_cls_name=f'{framework.__class__.__module__}.{framework.__class__.__qualname__}',
+            framework_hash=hash_model_weights(framework),
+        ),
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
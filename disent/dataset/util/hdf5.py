@@ -27,12 +27,17 @@ Utilities for converting and testing different chunk sizes of hdf5 files
 """
 
 import contextlib
+import json
 import logging
 import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
 from typing import Callable
 from typing import Dict
+from typing import List
 from typing import Literal
 from typing import Optional
 from typing import Sequence
@@ -43,6 +48,7 @@ import h5py
 import numpy as np
 import torch
 from torch.utils.data import DataLoader
+from torch.utils.data import Subset
 from tqdm import tqdm
 
 from disent.util.deprecate import deprecated
@@ -98,14 +104,35 @@ def _normalize_chunks(chunks: ChunksType, shape: Tuple[int, ...]):
         raise ValueError(f'invalid chunks value: {repr(chunks)}')
 
 
-def _normalize_compression(compression_lvl: Optional[int]):
-    if compression_lvl is None:
-        return None, None  # compression, compression_lvl
+COMPRESSIONS = ('gzip', 'lzf', 'blosc', 'zstd')
+
+
+def _normalize_compression(compression_lvl: Optional[int], compression: Optional[str] = 'gzip') -> Dict[str, Any]:
+    """
+    Get the compression arguments for `h5py.Group.create_dataset`
+    - compression is disabled if either `compression` or `compression_lvl` is `None`
+    - "lzf" is built into h5py and does not use the compression level, it is much faster than gzip
+    - "blosc" & "zstd" require the optional `hdf5plugin` package, which must also be imported to read the files
+    """
+    if (compression is None) or (compression_lvl is None):
+        return dict(compression=None, compression_opts=None)
     # check compression level
     if compression_lvl not in (0, 1, 2, 3, 4, 5, 6, 7, 8, 9):
         raise ValueError('compression_lvl must be an interger in the range [0, 9]')
     # get values
-    return 'gzip', compression_lvl  # compression, compression_lvl
+    if compression == 'gzip':
+        return dict(compression='gzip', compression_opts=compression_lvl)
+    elif compression == 'lzf':
+        return dict(compression='lzf', compression_opts=None)
+    elif compression in ('blosc', 'zstd'):
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError(f'compression: {repr(compression)} requires the optional `hdf5plugin` package, install it with: $ pip install hdf5plugin')
+        if compression == 'blosc':
+            return dict(hdf5plugin.Blosc(cname='lz4', clevel=compression_lvl, shuffle=hdf5plugin.Blosc.SHUFFLE))
+        return dict(hdf5plugin.Zstd(clevel=max(compression_lvl, 1)))
+    raise KeyError(f'invalid compression: {repr(compression)}, must be one of: {COMPRESSIONS}')
 
 
 # ========================================================================= #
@@ -124,6 +151,82 @@ def h5_assert_deterministic(h5_file: h5py.File) -> h5py.File:
     return h5_file
 
 
+# ========================================================================= #
+# hdf5 - parallel compression                                               #
+# ========================================================================= #
+
+
+def _h5_supports_direct_chunk_writes(dataset: h5py.Dataset) -> bool:
+    # chunks need to span all but the first dimension, and
+    # the filter pipeline can only contain gzip, which is the same as zlib
+    return (
+        (dataset.chunks is not None)
+        and (tuple(dataset.chunks[1:]) == tuple(dataset.shape[1:]))
+        and (dataset.compression in (None, 'gzip'))
+        and (not dataset.shuffle)
+        and (not dataset.fletcher32)
+        and (dataset.scaleoffset is None)
+    )
+
+
+def _compress_batch_chunks(batch: np.ndarray, chunk_len: int, dtype: np.dtype, compression_lvl: Optional[int]) -> List[bytes]:
+    """
+    Split the batch into chunks along the first dimension and compress each
+    chunk, the last chunk is padded with zeros to the full chunk size.
+    - zlib releases the GIL, so chunks can be compressed in parallel by threads.
+    """
+    batch = np.ascontiguousarray(batch, dtype=dtype)
+    chunks = []
+    for i in range(0, len(batch), chunk_len):
+        chunk = batch[i:i+chunk_len]
+        if len(chunk) < chunk_len:
+            chunk = np.concatenate([chunk, np.zeros((chunk_len - len(chunk), *chunk.shape[1:]), dtype=dtype)], axis=0)
+        data = chunk.tobytes()
+        chunks.append(data if (compression_lvl is None) else zlib.compress(data, compression_lvl))
+    return chunks
+
+
+def _h5_fill_parallel(
+    dataset: h5py.Dataset,
+    get_batch_fn: Callable[[int, int], np.ndarray],
+    start: int,
+    batch_size: int,
+    num_workers: int,
+    commit_fn: Callable[[int, int], None],
+):
+    """
+    Batches are produced in order in the main thread, compressed in a pool of
+    threads, and then written in order with direct chunk writes. A bounded
+    number of batches are in flight at any time to limit memory usage.
+    """
+    chunk_len, n = dataset.chunks[0], len(dataset)
+    compression_lvl = dataset.compression_opts if (dataset.compression == 'gzip') else None
+    zeros = (0,) * (dataset.ndim - 1)
+    # write the oldest batch
+    def _write_next():
+        i, j, future = pending.popleft()
+        for k, data in enumerate(future.result()):
+            dataset.id.write_direct_chunk((i + k*chunk_len, *zeros), data)
+        commit_fn(i, j)
+    # compress & write everything
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        try:
+            for i in range(start, n, batch_size):
+                j = min(i + batch_size, n)
+                pending.append((i, j, executor.submit(_compress_batch_chunks, get_batch_fn(i, j), chunk_len, dataset.dtype, compression_lvl)))
+                while len(pending) > 2 * num_workers:
+                    _write_next()
+        except BaseException:
+            # write the batches that are already in flight so that
+            # an interrupted fill can be resumed after the last one
+            while pending and (pending[0][2].exception() is None):
+                _write_next()
+            raise
+        while pending:
+            _write_next()
+
+
 # ========================================================================= #
 # hdf5 - resave                                                             #
 # ========================================================================= #
@@ -192,18 +295,25 @@ class H5Builder(object):
         dtype: AnyDType,
         chunk_shape: ChunksType = 'batch',
         compression_lvl: Optional[int] = 9,
-        attrs: Optional[Dict[str, Any]] = None
+        attrs: Optional[Dict[str, Any]] = None,
+        compression: Optional[str] = 'gzip',
+        exist_ok: bool = False,
     ) -> 'H5Builder':
-        # normalize chunk_shape
-        compression, compression_lvl = _normalize_compression(compression_lvl=compression_lvl)
+        # resume adding an existing dataset
+        if exist_ok and (name in self._h5_file):
+            dataset = self._h5_file[name]
+            if (dataset.shape != tuple(shape)) or (dataset.dtype != _normalize_dtype(dtype)):
+                raise H5IncompatibleError(f'existing dataset: {repr(name)} with shape: {dataset.shape} and dtype: {dataset.dtype} does not match the required shape: {tuple(shape)} and dtype: {_normalize_dtype(dtype)}')
+            return self
+        # remove the watermark of a previous file, otherwise a resumed fill of the new dataset is skipped
+        self._set_fill_progress(name, None)
         # create new dataset
         dataset = self._h5_file.create_dataset(
             name=name,
             shape=shape,
             dtype=_normalize_dtype(dtype),
             chunks=_normalize_chunks(chunk_shape, shape=shape),
-            compression=compression,
-            compression_opts=compression_lvl,
+            **_normalize_compression(compression_lvl=compression_lvl, compression=compression),
             # non-deterministic time stamps are added to the file if this is not
             # disabled, resulting in different hash sums when the file is re-generated!
             # - https://github.com/h5py/h5py/issues/225
@@ -226,13 +336,61 @@ class H5Builder(object):
         # done!
         return self
 
+    @property
+    def _progress_path(self) -> str:
+        return f'{self._h5_path}.progress.json'
+
+    def get_fill_progress(self, name: str) -> int:
+        """
+        Get the number of entries of the dataset that have been filled by a previous
+        call to `fill_dataset(..., resumable=True)`, this is the length of the dataset
+        if the fill completed, in which case resuming the fill does nothing.
+        """
+        if not os.path.exists(self._progress_path):
+            return 0
+        with open(self._progress_path, 'r') as fp:
+            return int(json.load(fp).get(name, 0))
+
+    def _set_fill_progress(self, name: str, num_done: Optional[int]):
+        # the progress is stored in a sidecar file so that the contents
+        # of the hdf5 file remain deterministic once the fill is complete
+        progress = {}
+        if os.path.exists(self._progress_path):
+            with open(self._progress_path, 'r') as fp:
+                progress = json.load(fp)
+        # update the progress
+        if num_done is None:
+            progress.pop(name, None)
+        else:
+            self._h5_file.flush()
+            progress[name] = int(num_done)
+        # save the progress
+        if progress:
+            with AtomicSaveFile(self._progress_path, open_mode='w', overwrite=True) as (_, fp):
+                json.dump(progress, fp)
+        elif os.path.exists(self._progress_path):
+            os.remove(self._progress_path)
+
     def fill_dataset(
         self,
         name: str,
         get_batch_fn: Callable[[int, int], np.ndarray],  # i_start, i_end
         batch_size: Union[int, Literal['auto']] = 'auto',
         show_progress: bool = False,
+        compression_workers: int = 0,
+        resumable: bool = False,
     ) -> 'H5Builder':
+        """
+        Fill the dataset in order, batch by batch.
+        :param compression_workers: If greater than zero, batches are split into chunks that are compressed
+               in a pool of threads and then written in order using direct chunk writes. This is only supported
+               for gzip or uncompressed datasets whose chunks span all but the first dimension, and when both the
+               batch size and the resumed start entry are multiples of the first chunk dimension, otherwise
+               the batches are written normally and compressed by hdf5 in the main thread.
+        :param resumable: Record a progress watermark after each batch is written, so that an interrupted
+               fill continues from where it stopped, and a completed fill is not repeated. The file must be
+               opened with mode "a" or "r+" to resume.
+        """
         dataset: h5py.Dataset = self._h5_file[name]
         # determine batch size for copying data
         # get smallest multiple less than 32, otherwise original number
@@ -248,21 +406,49 @@ class H5Builder(object):
                     log.warning(f'batch_size={batch_size} is not divisible by the first dimension of the dataset chunk size: {dataset.chunks[0]} {tuple(dataset.chunks)}')
         # check batch size!
         assert isinstance(batch_size, int) and (batch_size >= 1), f'invalid batch_size: {repr(batch_size)}, expected: "auto" or an integer `>= 1`'
+        # check the parallel writer
+        parallel = (compression_workers > 0) and _h5_supports_direct_chunk_writes(dataset)
+        if (compression_workers > 0) and not parallel:
+            log.warning(f'dataset: {repr(name)} with compression: {repr(dataset.compression)} and chunks: {dataset.chunks} does not support parallel compression, writing batches normally.')
+        # check resuming
+        if resumable and str(self._h5_mode).startswith('atomic'):
+            raise ValueError(f'resumable fills are not supported for atomic file modes, got: {repr(self._h5_mode)}')
+        start = self.get_fill_progress(name) if resumable else 0
+        if start >= len(dataset) > 0:
+            log.info(f'skipping fill of dataset: {repr(name)} that was already completed')
+            return self
+        elif start > 0:
+            log.info(f'resuming fill of dataset: {repr(name)} from entry: {start}')
+        # direct chunk writes need every batch to start on a chunk boundary, the batch size is never
+        # changed because `get_batch_fn` may be backed by an iterator that yields fixed size batches
+        if parallel and ((batch_size % dataset.chunks[0] != 0) or (start % dataset.chunks[0] != 0)):
+            parallel = False
+            log.warning(f'dataset: {repr(name)} with batch_size={batch_size} and start={start} is not aligned to the first dimension of the dataset chunk size: {dataset.chunks[0]} {tuple(dataset.chunks)}, writing batches normally.')
         # loop variables
         n = len(dataset)
+        # load and check the batch
+        def _get_batch(i: int, j: int):
+            assert j > i, f'this is a bug! {repr(j)} > {repr(i)}, len(dataset)={repr(n)}, batch_size={repr(batch_size)}'
+            batch = get_batch_fn(i, j)  # i_start, i_end
+            assert isinstance(batch, np.ndarray), f'returned batch is not an `np.ndarray`, got: {repr(type(batch))}'
+            assert batch.shape == (j-i, *dataset.shape[1:]), f'returned batch has incorrect shape: {tuple(batch.shape)}, expected: {(j-i, *dataset.shape[1:])}'
+            return batch
         # save data
-        with tqdm(total=n, disable=not show_progress, desc=f'saving {name}') as progress:
-            for i in range(0, n, batch_size):
-                j = min(i + batch_size, n)
-                assert j > i, f'this is a bug! {repr(j)} > {repr(i)}, len(dataset)={repr(n)}, batch_size={repr(batch_size)}'
-                # load and modify the batch
-                batch = get_batch_fn(i, j)  # i_start, i_end
-                assert isinstance(batch, np.ndarray), f'returned batch is not an `np.ndarray`, got: {repr(type(batch))}'
-                assert batch.shape == (j-i, *dataset.shape[1:]), f'returned batch has incorrect shape: {tuple(batch.shape)}, expected: {(j-i, *dataset.shape[1:])}'
-                # save the batch & update progress
-                dataset[i:j] = batch
+        with tqdm(total=n, initial=start, disable=not show_progress, desc=f'saving {name}') as progress:
+            # commit the batch & update progress
+            def _commit(i: int, j: int):
+                if resumable:
+                    self._set_fill_progress(name, j)
                 progress.update(j-i)
-        # done!
+            # write the batches
+            if parallel:
+                _h5_fill_parallel(dataset, _get_batch, start=start, batch_size=batch_size, num_workers=compression_workers, commit_fn=_commit)
+            else:
+                for i in range(start, n, batch_size):
+                    j = min(i + batch_size, n)
+                    dataset[i:j] = _get_batch(i, j)
+                    _commit(i, j)
+        # done! the watermark is kept to mark the fill as completed
         return self
 
     def fill_dataset_from_array(
@@ -272,6 +458,8 @@ class H5Builder(object):
         batch_size: Union[int, Literal['auto']] = 'auto',
         show_progress: bool = False,
         mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+        compression_workers: int = 0,
+        resumable: bool = False,
     ) -> 'H5Builder':
         # get the array extractor
         if isinstance(array, torch.Tensor):
@@ -309,6 +497,8 @@ class H5Builder(object):
             get_batch_fn=get_batch_fn,
             batch_size=batch_size,
             show_progress=show_progress,
+            compression_workers=compression_workers,
+            resumable=resumable,
         )
         return self
 
@@ -319,7 +509,14 @@ class H5Builder(object):
         batch_size: Union[int, Literal['auto']] = 'auto',
         show_progress: bool = False,
         mutator: Optional[Callable[[Any], np.ndarray]] = None,
+        compression_workers: int = 0,
+        resumable: bool = False,
     ) -> 'H5Builder':
+        """
+        Fill the dataset from an iterator of batches.
+        - If `resumable` is enabled, the iterator must start at the
+          entry given by `get_fill_progress(name)`
+        """
         try:
             batches = iter(batch_iter)
         except:
@@ -337,6 +534,8 @@ class H5Builder(object):
             get_batch_fn=get_batch_fn,
             batch_size=batch_size,
             show_progress=show_progress,
+            compression_workers=compression_workers,
+            resumable=resumable,
         )
         return self
 
@@ -353,6 +552,10 @@ class H5Builder(object):
         mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,
         dtype: Optional[np.dtype] = None,
         shape: Optional[Tuple[int, ...]] = None,
+        # compression & resuming
+        compression: Optional[str] = 'gzip',
+        compression_workers: int = 0,
+        resumable: bool = False,
     ):
         self.add_dataset(
             name=name,
@@ -361,6 +564,8 @@ class H5Builder(object):
             chunk_shape=chunk_shape,
             compression_lvl=compression_lvl,
             attrs=attrs,
+            compression=compression,
+            exist_ok=resumable,
         )
         self.fill_dataset_from_array(
             name=name,
@@ -368,6 +573,8 @@ class H5Builder(object):
             batch_size=batch_size,
             show_progress=show_progress,
             mutator=mutator,
+            compression_workers=compression_workers,
+            resumable=resumable,
         )
 
     def add_dataset_from_gt_data(
@@ -380,7 +587,10 @@ class H5Builder(object):
         num_workers: int = min(os.cpu_count(), 16),
         show_progress: bool = True,
         dtype: str = 'uint8',
-        attrs: Optional[dict] = None
+        attrs: Optional[dict] = None,
+        compression: Optional[str] = 'gzip',
+        compression_workers: int = 0,
+        resumable: bool = False,
     ):
         from disent.dataset import DisentDataset
         from disent.dataset.data import GroundTruthData
@@ -403,6 +613,8 @@ class H5Builder(object):
             dtype=dtype,
             chunk_shape='batch',
             compression_lvl=compression_lvl,
+            compression=compression,
+            exist_ok=resumable,
             # THESE ATTRIBUTES SHOULD MATCH: SelfContainedHdf5GroundTruthData
             attrs=dict(
                 dataset_name=gt_data.name,
@@ -414,12 +626,15 @@ class H5Builder(object):
             )
         )
         # fill the dataset!
+        start = self.get_fill_progress(name) if resumable else 0
         self.fill_dataset_from_batches(
             name=name,
-            batch_iter=DataLoader(gt_data, batch_size=batch_size, shuffle=False, num_workers=num_workers, drop_last=False),
+            batch_iter=DataLoader(Subset(gt_data, range(start, len(gt_data))), batch_size=batch_size, shuffle=False, num_workers=num_workers, drop_last=False),
             batch_size=batch_size,
             show_progress=show_progress,
             mutator=mutator,
+            compression_workers=compression_workers,
+            resumable=resumable,
         )
 
 #     def resave_dataset(self,
@@ -655,6 +870,71 @@ def hdf5_test_speed(h5_path: str, dataset_name: str, access_method: str = 'rando
         log.info(f'Random Accesses Per Second: {hdf5_test_entries_per_second(out_h5[dataset_name], access_method=access_method, max_entries=5_000):.3f}')
 
 
+def hdf5_benchmark_chunks_and_codecs(
+    array: Union[np.ndarray, torch.Tensor],
+    chunk_shapes: Sequence[ChunksType] = ('batch',),
+    codecs: Sequence[Optional[str]] = (None, 'gzip', 'lzf', 'blosc', 'zstd'),
+    compression_lvl: int = 4,
+    compression_workers: int = 0,
+    batch_size: Union[int, Literal['auto']] = 'auto',
+    max_entries: int = 5_000,
+    timeout: float = 10,
+    temp_dir: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Save the array to temporary hdf5 files with every combination of chunk
+    shape and compression codec, then measure the write time, the file size,
+    and the number of random and sequential reads per second.
+    - codecs that are not available (eg. blosc & zstd without `hdf5plugin`) are skipped
+    """
+    import tempfile
+    results = []
+    with tempfile.TemporaryDirectory(prefix='disent_h5_bench_', dir=temp_dir) as tmp_dir:
+        for chunk_shape in chunk_shapes:
+            for codec in codecs:
+                try:
+                    _normalize_compression(compression_lvl=compression_lvl, compression=codec)
+                except ImportError as e:
+                    log.warning(f'skipping codec: {repr(codec)}, {e}')
+                    continue
+                # write the file
+                path = os.path.join(tmp_dir, f'bench_{len(results)}.h5')
+                with Timer() as t:
+                    with H5Builder(path, mode='w') as builder:
+                        builder.add_dataset_from_array(
+                            name='data',
+                            array=array,
+                            chunk_shape=chunk_shape,
+                            compression_lvl=compression_lvl if codec else None,
+                            compression=codec,
+                            compression_workers=compression_workers,
+                            batch_size=batch_size,
+                        )
+                # read the file
+                with h5py.File(path, 'r') as h5_file:
+                    chunks = h5_file['data'].chunks
+                    reads_random = hdf5_test_entries_per_second(h5_file['data'], access_method='random', max_entries=max_entries, timeout=timeout)
+                    reads_sequential = hdf5_test_entries_per_second(h5_file['data'], access_method='sequential', max_entries=max_entries, timeout=timeout)
+                # save the results
+                results.append(dict(
+                    chunks=chunks,
+                    codec=codec,
+                    write_time=t.elapsed,
+                    file_size=os.path.getsize(path),
+                    reads_random=reads_random,
+                    reads_sequential=reads_sequential,
+                ))
+                os.remove(path)
+    # print the results
+    for r in results:
+        log.info(
+            f'chunks: {str(r["chunks"]):18s} codec: {str(r["codec"]):5s} | '
+            f'write: {r["write_time"]:7.3f}s size: {bytes_to_human(r["file_size"]):>12s} | '
+            f'random: {r["reads_random"]:10.1f}/s sequential: {r["reads_sequential"]:10.1f}/s'
+        )
+    return results
+
+
 # ========================================================================= #
 # hdf5 - stats                                                              #
 # ========================================================================= #
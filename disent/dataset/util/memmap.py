@@ -0,0 +1,223 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2022 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Utilities for saving and loading uncompressed datasets that can be memory-mapped.
+
+The data is stored as a raw `.npy` file, or as a flat binary file, alongside a
+json sidecar file `<path>.json` containing the shape, dtype and the attributes
+of the ground truth dataset. Memory-mapping the data allows multiple DataLoader
+workers and processes to share the OS page cache, without any decompression
+and without duplicating the dataset in the memory of each process.
+"""
+
+import json
+import logging
+import os
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from tqdm import tqdm
+
+from disent.util.inout.files import AtomicSaveFile
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Meta Files                                                                #
+# ========================================================================= #
+
+
+def memmap_meta_path(path: str) -> str:
+    """
+    Get the path to the json sidecar file for the given memmap data file.
+    """
+    return f'{path}.json'
+
+
+def memmap_save_meta(
+    path: str,
+    shape: Tuple[int, ...],
+    dtype: Union[np.dtype, str],
+    factor_sizes: Sequence[int],
+    factor_names: Sequence[str],
+    dataset_name: str,
+    dataset_cls_name: Optional[str] = None,
+    overwrite: bool = False,
+    attrs: Optional[Dict[str, Any]] = None,
+):
+    # THESE ATTRIBUTES SHOULD MATCH: MemmapGroundTruthData
+    meta = dict(
+        shape=[int(s) for s in shape],
+        dtype=np.dtype(dtype).str,
+        dataset_name=str(dataset_name),
+        dataset_cls_name=None if (dataset_cls_name is None) else str(dataset_cls_name),
+        factor_sizes=[int(s) for s in factor_sizes],
+        factor_names=[str(n) for n in factor_names],
+        # extra attrs -- we can't overwrite the above
+        **(attrs if (attrs is not None) else {}),
+    )
+    # checks
+    if int(np.prod(meta['factor_sizes'])) != meta['shape'][0]:
+        raise ValueError(f'the product of the factor_sizes: {meta["factor_sizes"]} does not match the length of the data: {meta["shape"][0]}')
+    if len(meta['factor_sizes']) != len(meta['factor_names']):
+        raise ValueError(f'the number of factor_sizes: {meta["factor_sizes"]} does not match the number of factor_names: {meta["factor_names"]}')
+    # save the meta file
+    with AtomicSaveFile(memmap_meta_path(path), open_mode='w', overwrite=overwrite) as (_, fp):
+        json.dump(meta, fp, indent=2)
+
+
+def memmap_load_meta(path: str) -> Dict[str, Any]:
+    with open(memmap_meta_path(path), 'r') as fp:
+        return json.load(fp)
+
+
+# ========================================================================= #
+# Memmap Files                                                              #
+# ========================================================================= #
+
+
+def _is_npy_path(path: str) -> bool:
+    return str(path).endswith('.npy')
+
+
+def memmap_open(path: str, mode: str = 'r', shape: Optional[Tuple[int, ...]] = None, dtype: Optional[Union[np.dtype, str]] = None) -> np.memmap:
+    """
+    Open a memory-mapped array, either a `.npy` file, or a flat binary
+    file in which case the shape and dtype are read from the sidecar file
+    if they are not given.
+    - `mode='r'` opens an existing file as read-only, while `mode='w+'` creates
+      a new file, in which case the shape and dtype must be given.
+    """
+    if mode == 'w+':
+        assert (shape is not None) and (dtype is not None), 'shape and dtype must be given when creating a new memmap file'
+        if _is_npy_path(path):
+            return np.lib.format.open_memmap(path, mode='w+', dtype=np.dtype(dtype), shape=tuple(shape))
+        return np.memmap(path, mode='w+', dtype=np.dtype(dtype), shape=tuple(shape))
+    elif mode == 'r':
+        if _is_npy_path(path):
+            array = np.load(path, mmap_mode='r')
+        else:
+            if (shape is None) or (dtype is None):
+                meta = memmap_load_meta(path)
+                shape = meta['shape'] if (shape is None) else shape
+                dtype = meta['dtype'] if (dtype is None) else dtype
+            array = np.memmap(path, mode='r', dtype=np.dtype(dtype), shape=tuple(shape))
+        # check the shapes
+        if (shape is not None) and (array.shape != tuple(shape)):
+            raise ValueError(f'memmap file has incorrect shape: {array.shape}, expected: {tuple(shape)}')
+        if (dtype is not None) and (array.dtype != np.dtype(dtype)):
+            raise ValueError(f'memmap file has incorrect dtype: {array.dtype}, expected: {np.dtype(dtype)}')
+        return array
+    else:
+        raise KeyError(f'invalid memmap mode: {repr(mode)}, must be one of: "r", "w+"')
+
+
+def memmap_save_array(
+    array,
+    out_path: str,
+    factor_sizes: Sequence[int],
+    factor_names: Sequence[str],
+    dataset_name: str,
+    dataset_cls_name: Optional[str] = None,
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = False,
+    attrs: Optional[Dict[str, Any]] = None,
+):
+    """
+    Save any sliceable array, eg. an `np.ndarray` or `h5py.Dataset` to an
+    uncompressed memmap file, copying the array in batches so that large
+    datasets never need to be loaded into memory at once.
+    """
+    shape, dtype = tuple(array.shape), np.dtype(array.dtype)
+    # save the data
+    with AtomicSaveFile(out_path, overwrite=overwrite) as temp_file:
+        out = memmap_open(temp_file, mode='w+', shape=shape, dtype=dtype)
+        with tqdm(total=len(out), disable=not show_progress, desc=f'saving {os.path.basename(out_path)}') as progress:
+            for i in range(0, len(out), batch_size):
+                j = min(i + batch_size, len(out))
+                out[i:j] = array[i:j]
+                progress.update(j - i)
+        # write everything to disk
+        out.flush()
+        del out
+    # save the meta file, the data must exist first
+    memmap_save_meta(
+        path=out_path,
+        shape=shape,
+        dtype=dtype,
+        factor_sizes=factor_sizes,
+        factor_names=factor_names,
+        dataset_name=dataset_name,
+        dataset_cls_name=dataset_cls_name,
+        overwrite=overwrite,
+        attrs=attrs,
+    )
+
+
+def memmap_save_from_hdf5(
+    h5_path: str,
+    out_path: str,
+    h5_dataset_name: str = 'data',
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = True,
+):
+    """
+    Convert the hdf5 file of a `SelfContainedHdf5GroundTruthData` into an
+    uncompressed memmap file that can be loaded with `MemmapGroundTruthData`
+    """
+    from disent.dataset.data import Hdf5Dataset
+    # load the hdf5 file
+    with Hdf5Dataset(h5_path=h5_path, h5_dataset_name=h5_dataset_name) as data:
+        # THESE ATTRIBUTES SHOULD MATCH: SelfContainedHdf5GroundTruthData
+        h5_attrs = data.get_attrs()
+        attrs = dict(
+            dataset_name=h5_attrs['dataset_name'].decode('utf-8'),
+            dataset_cls_name=h5_attrs['dataset_cls_name'].decode('utf-8') if ('dataset_cls_name' in h5_attrs) else None,
+            factor_sizes=[int(size) for size in h5_attrs['factor_sizes']],
+            factor_names=[name.decode('utf-8') for name in h5_attrs['factor_names']],
+        )
+        # copy the data
+        memmap_save_array(
+            array=data,
+            out_path=out_path,
+            batch_size=batch_size,
+            overwrite=overwrite,
+            show_progress=show_progress,
+            **attrs,
+        )
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
@@ -22,6 +22,11 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import contextlib
+import gzip
+import zipfile
+from typing import Optional
+
 import numpy as np
 from tqdm import tqdm
 from disent.util.inout.files import AtomicSaveFile
@@ -72,6 +77,53 @@ def save_resized_dataset_array(array: np.ndarray, out_file: str, size: int = 64,
         np.savez_compressed(temp_file, **{save_key: converted})
 
 
+# ========================================================================= #
+# Stream Numpy Files                                                        #
+# ========================================================================= #
+
+
+@contextlib.contextmanager
+def npy_open_stream(path: str, key: Optional[str] = None):
+    """
+    Open the array in a `.npy`, `.npy.gz` or `.npz` file without loading it, yielding
+    the stream positioned at the start of the raw data along with the header.
+    - arrays in `.npz` files are selected with `key`, and are decompressed on the fly
+    """
+    with contextlib.ExitStack() as stack:
+        if path.endswith('.npz'):
+            if key is None:
+                raise KeyError(f'a key is required to stream an array from the npz file: {repr(path)}')
+            fp = stack.enter_context(stack.enter_context(zipfile.ZipFile(path, 'r')).open(f'{key}.npy', 'r'))
+        elif path.endswith('.gz'):
+            fp = stack.enter_context(gzip.GzipFile(path, 'r'))
+        else:
+            fp = stack.enter_context(open(path, 'rb'))
+        # read the header
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+        yield fp, shape, fortran_order, dtype
+
+
+def npy_read_into(fp, array: np.ndarray, fortran_order: bool = False, block_bytes: int = 64 * 1024 ** 2):
+    """
+    Read the raw data of a stream opened with `npy_open_stream`
+    into the existing array in blocks, without any intermediate copy.
+    """
+    if fortran_order or array.dtype.hasobject or not array.flags.c_contiguous:
+        raise ValueError('only C-ordered arrays without objects can be read in-place')
+    buf = memoryview(array.reshape(-1).view(np.uint8))
+    for i in range(0, len(buf), block_bytes):
+        block = buf[i:i+block_bytes]
+        while len(block) > 0:
+            n = fp.readinto(block)
+            if not n:
+                raise EOFError(f'numpy file ended before the array of shape: {array.shape} was read')
+            block = block[n:]
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -0,0 +1,83 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+from typing import Iterator
+from typing import Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+# ========================================================================= #
+# Block Shuffle Sampler                                                     #
+# ========================================================================= #
+
+
+class BlockShuffleSampler(Sampler):
+    """
+    Approximate shuffling for a `DataLoader` that favours locality.
+
+    The indices are split into contiguous blocks of `block_size`, eg. the
+    `chunk_len` of an `Hdf5Dataset`. The order of the blocks is shuffled,
+    and then the indices within each window of `window_blocks` consecutive
+    blocks are shuffled together. Each window only touches `window_blocks`
+    chunks of the file, so with a block cache of at least this many chunks,
+    each chunk only needs to be decoded once per epoch.
+    - Larger windows give better shuffling, `window_blocks=num_blocks` is a full shuffle.
+    - Each epoch samples a new seed from the torch RNG, unless a seed is given.
+    """
+
+    def __init__(self, data_source, block_size: int, window_blocks: int = 16, seed: Optional[int] = None):
+        assert block_size >= 1, f'block_size must be >= 1, got: {repr(block_size)}'
+        assert window_blocks >= 1, f'window_blocks must be >= 1, got: {repr(window_blocks)}'
+        self._num_samples = data_source if isinstance(data_source, int) else len(data_source)
+        self._block_size = block_size
+        self._window_blocks = window_blocks
+        self._seed = seed
+        self._epoch = 0
+
+    def __len__(self) -> int:
+        return self._num_samples
+
+    def __iter__(self) -> Iterator[int]:
+        # get the random number generator for this epoch
+        if self._seed is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        else:
+            seed = self._seed + self._epoch
+        self._epoch += 1
+        rng = np.random.default_rng(seed)
+        # shuffle the blocks & then the entries in each window
+        n, B = self._num_samples, self._block_size
+        order = rng.permutation((n + B - 1) // B)
+        for w in range(0, len(order), self._window_blocks):
+            idxs = np.concatenate([np.arange(b*B, min((b+1)*B, n)) for b in order[w:w+self._window_blocks]])
+            rng.shuffle(idxs)
+            yield from idxs.tolist()
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
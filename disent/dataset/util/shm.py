@@ -0,0 +1,230 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Utilities for sharing read-only arrays between processes on the same host using
+POSIX shared memory, eg. between DataLoader workers, or between concurrent runs.
+
+Each segment is named after a key, usually derived from the contents of the data,
+and starts with a small header containing a ready flag and a reference count.
+The header is only modified while holding an exclusive lock on the lock file
+`<tempdir>/<name>.lock`. The first process to acquire the lock creates & fills
+the segment, later processes attach to the existing segment without copying.
+The segment is unlinked when the last reference is released. Lock files are
+never removed, otherwise processes waiting on the old lock would race new ones.
+
+If a process is killed without releasing its references, the segment is not
+unlinked, use `shm_unlink(name)` to remove it manually.
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+from multiprocessing import shared_memory
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Helper                                                                    #
+# ========================================================================= #
+
+
+# header: [ready: int64, refcount: int64, ...padding...]
+_SHM_HEADER_BYTES = 64
+_SHM_READY = 0x64697365_6e740001  # 'disent' & version
+
+
+def shm_key(*parts: str, prefix: str = 'disent_') -> str:
+    """
+    Get the name of a shared memory segment from the given parts, eg. the hash of a
+    file and the name of the dataset. Names are kept short for portability.
+    """
+    return prefix + hashlib.md5('|'.join(str(p) for p in parts).encode()).hexdigest()[:20]
+
+
+def _shm_lock_path(name: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f'{name}.lock')
+
+
+@contextlib.contextmanager
+def _shm_lock(name: str):
+    import fcntl
+    with open(_shm_lock_path(name), 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _shm_open(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    # we manage the lifetime of the segment ourselves, otherwise the resource
+    # tracker of the first process unlinks the segment when that process exits.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:  # pragma: no cover
+        pass
+    return shm
+
+
+def _shm_array(shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: np.dtype, offset: int = 0) -> np.ndarray:
+    # the array must export the buffer of the underlying mmap rather than that of `shm.buf`,
+    # otherwise `shm.close()` unmaps the memory while the array is still alive, instead
+    # of raising a `BufferError`, and accessing the array afterwards is a segfault.
+    count = int(np.prod(shape))
+    return np.frombuffer(shm.buf.obj, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def _shm_header(shm: shared_memory.SharedMemory) -> np.ndarray:
+    return _shm_array(shm, (2,), np.dtype('int64'))
+
+
+# ========================================================================= #
+# Shared Arrays                                                             #
+# ========================================================================= #
+
+
+def shm_attach_or_create(
+    name: str,
+    shape: Tuple[int, ...],
+    dtype: Union[np.dtype, str],
+    fill_fn: Optional[Callable[[np.ndarray], None]] = None,
+) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Attach to the shared memory segment with the given name, or if it does
+    not exist, create it and fill the array in-place by calling `fill_fn(array)`.
+    The reference count is incremented, call `shm_release` when done.
+    - The returned array is read-only.
+    """
+    dtype = np.dtype(dtype)
+    size = _SHM_HEADER_BYTES + int(np.prod(shape)) * dtype.itemsize
+    with _shm_lock(name):
+        # attach to the existing segment
+        try:
+            shm = _shm_open(name)
+        except FileNotFoundError:
+            shm = None
+        # the previous creator crashed while filling the segment
+        if (shm is not None) and (_shm_header(shm)[0] != _SHM_READY):
+            log.warning(f'removing incomplete shared memory segment: {repr(name)}')
+            shm.close()
+            _shm_unlink(name)
+            shm = None
+        # create & fill the segment
+        if shm is None:
+            if fill_fn is None:
+                raise FileNotFoundError(f'shared memory segment does not exist: {repr(name)}')
+            shm = _shm_open(name, create=True, size=size)
+            try:
+                array = _shm_array(shm, shape, dtype, offset=_SHM_HEADER_BYTES)
+                fill_fn(array)
+                del array
+            except BaseException:
+                # the traceback may still reference the array, the memory
+                # is then unmapped once the array is garbage collected
+                array = None
+                try:
+                    shm.close()
+                except BufferError:
+                    pass
+                _shm_unlink(name)
+                raise
+            _shm_header(shm)[:] = (_SHM_READY, 0)
+            log.debug(f'created shared memory segment: {repr(name)} of size: {size} bytes')
+        # check the segment
+        if shm.size < size:
+            shm.close()
+            raise ValueError(f'shared memory segment: {repr(name)} is too small for an array of shape: {tuple(shape)} and dtype: {dtype}, got: {shm.size} bytes, expected: {size} bytes')
+        # increment the reference count
+        _shm_header(shm)[1] += 1
+    # get the array
+    array = _shm_array(shm, shape, dtype, offset=_SHM_HEADER_BYTES)
+    array.flags.writeable = False
+    return shm, array
+
+
+def shm_release(shm: shared_memory.SharedMemory, name: str):
+    """
+    Decrement the reference count of the segment, unlinking it if this
+    was the last reference. Existing arrays remain valid until they are
+    garbage collected, the memory is freed once all mappings are closed.
+    """
+    with _shm_lock(name):
+        header = _shm_header(shm)
+        header[1] -= 1
+        refs = int(header[1])
+        del header
+        if refs <= 0:
+            _shm_unlink(name)
+            log.debug(f'unlinked shared memory segment: {repr(name)}')
+
+
+def shm_refcount(name: str) -> int:
+    """
+    Get the reference count of the segment, or zero if it does not exist.
+    """
+    with _shm_lock(name):
+        try:
+            shm = _shm_open(name)
+        except FileNotFoundError:
+            return 0
+        try:
+            return int(_shm_header(shm)[1])
+        finally:
+            shm.close()
+
+
+def _shm_unlink(name: str):
+    from multiprocessing.shared_memory import _posixshmem
+    with contextlib.suppress(FileNotFoundError):
+        _posixshmem.shm_unlink(f'/{name}')
+
+
+def shm_unlink(name: str):
+    """
+    Forcefully remove a shared memory segment, eg. one that was leaked
+    by a process that was killed. Attached processes are unaffected.
+    """
+    with _shm_lock(name):
+        _shm_unlink(name)
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
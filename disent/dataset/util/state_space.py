@@ -30,6 +30,7 @@ from typing import Union
 
 import numpy as np
 from disent.util.iters import LengthIter
+from disent.util.jit import try_njit_or
 from disent.util.visualize.vis_util import get_idx_traversal
 
 
@@ -155,22 +156,30 @@ class StateSpace(LengthIter):
         Convert a position to an index (or convert a list of positions to a list of indices)
         - positions are lists of integers, with each element < their corresponding factor size
         - indices are integers < size
-
-        TODO: can factor_multipliers be used to speed this up?
         """
-        positions = np.moveaxis(positions, source=-1, destination=0)
-        return np.ravel_multi_index(positions, self.__factor_sizes)
+        positions = np.asarray(positions)
+        # uncommon inputs are handled by numpy, which also raises the appropriate errors
+        if (positions.dtype.kind not in 'iu') or (positions.ndim == 0) or (positions.shape[-1] != self.num_factors):
+            return np.ravel_multi_index(np.moveaxis(positions, source=-1, destination=0), self.__factor_sizes)
+        # convert the flattened positions
+        indices = _pos_to_idx(positions.reshape(-1, self.num_factors).astype(np.int64, copy=False), self.__factor_sizes, self.__factor_multipliers)
+        indices = indices.reshape(positions.shape[:-1])
+        # return a numpy scalar, not a 0-dim array
+        return indices[()] if (indices.ndim == 0) else indices
 
     def idx_to_pos(self, indices) -> np.ndarray:
         """
         Convert an index to a position (or convert a list of indices to a list of positions)
         - indices are integers < size
         - positions are lists of integers, with each element < their corresponding factor size
-
-        TODO: can factor_multipliers be used to speed this up?
         """
-        positions = np.array(np.unravel_index(indices, self.__factor_sizes))
-        return np.moveaxis(positions, source=0, destination=-1)
+        indices = np.asarray(indices)
+        # uncommon inputs are handled by numpy, which also raises the appropriate errors
+        if indices.dtype.kind not in 'iu':
+            return np.moveaxis(np.array(np.unravel_index(indices, self.__factor_sizes)), source=0, destination=-1)
+        # convert the flattened indices
+        positions = _idx_to_pos(indices.reshape(-1).astype(np.int64, copy=False), self.__factor_sizes, self.__factor_multipliers)
+        return positions.reshape(*indices.shape, self.num_factors)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Iterators                                                             #
@@ -233,10 +242,10 @@ class StateSpace(LengthIter):
         # mask of known factors
         known_mask = np.zeros(self.num_factors, dtype='bool')
         known_mask[known_factor_indices] = True
-        # set values
-        all_factors = np.zeros((*known_factors.shape[:-1], self.num_factors), dtype='int')
+        # set values, sampling is the same as `self.sample_factors(size=known_factors.shape[:-1], factor_indices=~known_mask)`
+        all_factors = np.empty((*known_factors.shape[:-1], self.num_factors), dtype='int')
         all_factors[..., known_mask] = known_factors
-        all_factors[..., ~known_mask] = self.sample_factors(size=known_factors.shape[:-1], factor_indices=~known_mask)
+        all_factors[..., ~known_mask] = np.random.randint(0, self.__factor_sizes[~known_mask], size=(*known_factors.shape[:-1], self.num_factors - known_mask.sum()))
         return all_factors
 
     def resample_factors(self, factors, fixed_factor_indices) -> np.ndarray:
@@ -246,6 +255,18 @@ class StateSpace(LengthIter):
         """
         return self.sample_missing_factors(np.array(factors)[..., fixed_factor_indices], fixed_factor_indices)
 
+    def resample_factors_masked(self, factors, fixed_mask) -> np.ndarray:
+        """
+        Batched version of `resample_factors`, where each row can keep a different set of factors constant.
+        - factors have the shape (..., num_factors)
+        - fixed_mask is a boolean array that broadcasts with factors, factors where
+          the mask is True are kept constant, all the other factors are resampled.
+        """
+        factors = np.asarray(factors)
+        fixed_mask = np.asarray(fixed_mask, dtype='bool')
+        assert factors.shape[-1] == self.num_factors, f'last dimension of factors must be num_factors={self.num_factors}, got shape: {factors.shape}'
+        return np.where(fixed_mask, factors, np.random.randint(0, self.__factor_sizes, size=factors.shape))
+
     def _get_f_idx_and_factors_and_size(self, f_idx: int = None, base_factors=None, num: int = None):
         """
         :param f_idx: Sampled randomly in the range [0, num_factors) if not given.
@@ -282,6 +303,39 @@ class StateSpace(LengthIter):
         # return factors (num_frames, num_factors)
         return base_factors
 
+    def sample_random_factor_traversals(self, num_traversals: int, f_idxs=None, base_factors=None, num: int = None, mode: str = 'interval', start_index: int = 0) -> np.ndarray:
+        """
+        Batched version of `sample_random_factor_traversal`, sampling multiple traversals at once.
+
+        :param num_traversals: The number of traversals to generate.
+        :param f_idxs: A single factor or a factor for each traversal, sampled randomly for each traversal if not given.
+        :param base_factors: A single position or a position for each traversal, sampled randomly for each traversal if not given.
+        :param num: The number of frames in each traversal. If not given, all traversals must be along factors of the same size.
+        :return: The factors of the traversals with shape (num_traversals, num, num_factors)
+        """
+        # choose random factors if not given
+        if f_idxs is None:
+            f_idxs = np.random.randint(0, self.num_factors, size=num_traversals)
+        f_idxs = np.broadcast_to(f_idxs, (num_traversals,))
+        # sample factors if not given
+        if base_factors is None:
+            base_factors = self.sample_factors(size=num_traversals)
+        base_factors = np.broadcast_to(base_factors, (num_traversals, self.num_factors))
+        # get size if not given
+        if num is None:
+            sizes = np.unique(self.__factor_sizes[f_idxs])
+            if len(sizes) > 1:
+                raise ValueError(f'traversals along factors of different sizes: {sizes.tolist()} require `num` to be specified')
+            num = int(sizes[0]) if len(sizes) else 1
+        else:
+            assert num > 0
+        # generate the traversals, each unique factor traversal is only computed once
+        traversals = np.repeat(base_factors[:, None, :], num, axis=1)
+        for f_idx in np.unique(f_idxs):
+            traversals[f_idxs == f_idx, :, f_idx] = get_idx_traversal(self.__factor_sizes[f_idx], num_frames=num, mode=mode, start_index=start_index)
+        # return factors (num_traversals, num_frames, num_factors)
+        return traversals
+
 
 # ========================================================================= #
 # Hidden State Space                                                        #
@@ -304,15 +358,50 @@ def _get_step_size(factor_sizes, f_idx: int):
 def _dims_multipliers(factor_sizes: np.ndarray) -> np.ndarray:
     factor_sizes = np.array(factor_sizes)
     assert factor_sizes.ndim == 1
-    return np.append(np.cumprod(factor_sizes[::-1])[::-1], 1)
+    return np.append(np.cumprod(factor_sizes[::-1])[::-1], 1).astype(np.int64)
+
+
+# ========================================================================= #
+# Kernels - numba is optional, numpy is used as a fallback                  #
+# ========================================================================= #
 
 
-# @try_njit
-# def _idx_to_pos(idxs, dims_mul):
-#     factors = np.expand_dims(np.array(idxs, dtype='int'), axis=-1)
-#     factors = factors % dims_mul[:-1]
-#     factors //= dims_mul[1:]
-#     return factors
+def _np_idx_to_pos(idxs: np.ndarray, factor_sizes: np.ndarray, factor_multipliers: np.ndarray) -> np.ndarray:
+    # (N,) -> (N, num_factors), faster than using the multipliers with numpy
+    return np.stack(np.unravel_index(idxs, factor_sizes), axis=-1)
+
+
+def _np_pos_to_idx(pos: np.ndarray, factor_sizes: np.ndarray, factor_multipliers: np.ndarray) -> np.ndarray:
+    # (N, num_factors) -> (N,)
+    return np.ravel_multi_index(pos.T, factor_sizes)
+
+
+@try_njit_or(_np_idx_to_pos)
+def _idx_to_pos(idxs: np.ndarray, factor_sizes: np.ndarray, factor_multipliers: np.ndarray) -> np.ndarray:
+    # (N,) -> (N, num_factors), using the precomputed multipliers
+    pos = np.empty((len(idxs), len(factor_sizes)), dtype=np.int64)
+    for i in range(len(idxs)):
+        idx = idxs[i]
+        if (idx < 0) or (idx >= factor_multipliers[0]):
+            raise ValueError('invalid entry in index array')
+        for j in range(len(factor_sizes)):
+            pos[i, j] = (idx % factor_multipliers[j]) // factor_multipliers[j+1]
+    return pos
+
+
+@try_njit_or(_np_pos_to_idx)
+def _pos_to_idx(pos: np.ndarray, factor_sizes: np.ndarray, factor_multipliers: np.ndarray) -> np.ndarray:
+    # (N, num_factors) -> (N,), using the precomputed multipliers
+    idxs = np.empty(len(pos), dtype=np.int64)
+    for i in range(len(pos)):
+        idx = 0
+        for j in range(len(factor_sizes)):
+            p = pos[i, j]
+            if (p < 0) or (p >= factor_sizes[j]):
+                raise ValueError('invalid entry in coordinates array')
+            idx += p * factor_multipliers[j+1]
+        idxs[i] = idx
+    return idxs
 
 
 # ========================================================================= #
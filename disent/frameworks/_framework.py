@@ -35,6 +35,7 @@ from typing import Optional
 from typing import Tuple
 from typing import Union
 
+import numpy as np
 import torch
 
 from disent import registry
@@ -46,6 +47,10 @@ from disent.util.imports import import_obj
 log = logging.getLogger(__name__)
 
 
+# schedules are not compiled for longer runs, 8MB per table
+_MAX_COMPILED_SCHEDULE_STEPS = 1_000_000
+
+
 # ========================================================================= #
 # framework config                                                          #
 # ========================================================================= #
@@ -105,6 +110,7 @@ class DisentFramework(DisentConfigurable, DisentLightningModule):
         # - maybe add support for schedules in the config?
         self._registered_schedules = set()
         self._active_schedules: Dict[str, Tuple[Any, Schedule]] = {}
+        self._compiled_schedules: Optional[Dict[str, Tuple[Any, Schedule]]] = None
 
     @staticmethod
     def _check_optimizer(optimizer: str):
@@ -231,6 +237,7 @@ class DisentFramework(DisentConfigurable, DisentLightningModule):
         if self.has_schedule(target):
             self._registered_schedules.remove(target)
             self._active_schedules.pop(target)
+            self._compiled_schedules = None
         else:
             raise KeyError(f'Cannot remove schedule for target {repr(target)} that does not exist!')
 
@@ -254,6 +261,7 @@ class DisentFramework(DisentConfigurable, DisentLightningModule):
         if target in possible_targets:
             initial_val = getattr(self.cfg, target)
             self._active_schedules[target] = (initial_val, schedule)
+            self._compiled_schedules = None
             if logging:
                 log.info(f'Activating schedule for target {repr(target)} on {repr(self.__class__.__name__)}.')
             return True
@@ -262,20 +270,53 @@ class DisentFramework(DisentConfigurable, DisentLightningModule):
                 log.warning(f'Unactivated schedule for target {repr(target)} on {repr(self.__class__.__name__)} because the key was not found in the config.')
             return False
 
+    @final
+    def _compile_schedules(self, max_steps: Optional[int]) -> Dict[str, Tuple[Any, Schedule]]:
+        # precompute the values of the schedules for every step of training,
+        # unless the number of steps is unknown or the tables would be too large
+        # - older versions of pytorch lightning use `None` instead of -1 for unlimited steps
+        if (max_steps is None) or not (0 <= max_steps <= _MAX_COMPILED_SCHEDULE_STEPS):
+            return dict(self._active_schedules)
+        return {
+            target: (initial_val, self._try_compile_schedule(target, schedule, max_steps=max_steps, value=initial_val))
+            for target, (initial_val, schedule) in self._active_schedules.items()
+        }
+
+    @staticmethod
+    def _try_compile_schedule(target: str, schedule: Schedule, max_steps: int, value) -> Schedule:
+        # custom schedules may only support scalar steps, in which case computing the
+        # table fails or gives different values, so the schedule is used uncompiled
+        try:
+            compiled = schedule.compile(max_steps=max_steps, value=value)
+            for step in sorted({0, max_steps // 2, max_steps}):
+                if not np.isclose(compiled.table[step], schedule.compute_value(step=step, value=value)):
+                    raise ValueError(f'the precomputed value at step {step} does not match the value computed for a single step')
+        except Exception as e:
+            log.warning(f'could not precompute the schedule for: {repr(target)}, falling back to computing each step. {e.__class__.__name__}: {e}')
+            return schedule
+        return compiled
+
     @final
     def _update_config_from_schedules(self):
         if not self._active_schedules:
             return
-        # log the step value
-        self.log('scheduler/step', self.trainer.global_step)
+        step = self.trainer.global_step
+        # lazily compile the schedules, the trainer is not available when they are registered
+        if self._compiled_schedules is None:
+            self._compiled_schedules = self._compile_schedules(max_steps=self.trainer.max_steps)
         # update the values
-        for target, (initial_val, scheduler) in self._active_schedules.items():
+        logs = {'scheduler/step': step}
+        for target, (initial_val, scheduler) in self._compiled_schedules.items():
             # get the scheduled value
-            new_value = scheduler.compute_value(step=self.trainer.global_step, value=initial_val)
+            new_value = scheduler.compute_value(step=step, value=initial_val)
             # update it on the config
             setattr(self.cfg, target, new_value)
             # log that things changed
-            self.log(f'scheduled/{target}', new_value)
+            logs[f'scheduled/{target}'] = new_value
+        # values logged on each step are only written every `log_every_n_steps`
+        # steps, so skip the overhead of logging on the steps in between
+        if (step + 1) % self.trainer.log_every_n_steps == 0:
+            self.log_dict(logs)
 
 
 # ========================================================================= #
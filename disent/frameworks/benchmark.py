@@ -0,0 +1,529 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Benchmark the training throughput of frameworks on the CPU.
+
+Each case is a combination of a framework, a model, a dataset and a sampler, all
+referenced by their names in `disent.registry`. A case is trained for a fixed number
+of steps with the real `DisentDataset` & `DataLoader` pipeline, using a manual
+training loop so that the time of every step can be split into:
+    - "data":      time spent waiting on the dataloader for the next batch
+    - "forward":   the framework training step, including batch augmentation
+    - "backward":  `loss.backward()`
+    - "optimizer": `optimizer.step()` and `optimizer.zero_grad()`
+
+Results are saved in the same JSON layout as `pytest-benchmark`, with the step time
+statistics under "stats" and the throughput, peak RSS & stage times under "extra_info",
+so that two runs can be compared to catch performance regressions between releases.
+
+Usage from the command line:
+    $ python3 -m disent.frameworks.benchmark --frameworks ae beta_vae --models linear conv64 --steps 50 --save results.json
+    $ python3 -m disent.frameworks.benchmark --frameworks ae beta_vae --models linear conv64 --steps 50 --compare results.json
+
+The memory & time of the `BetaTcVae` total correlation against the batch size, with
+and without chunking, can be benchmarked instead with:
+    $ python3 -m disent.frameworks.benchmark --tc-batch-sizes 64 256 1024 4096 --tc-chunk-sizes none 256
+"""
+
+import json
+import logging
+import platform
+import sys
+import time
+import warnings
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from disent.util.strings.fmt import bytes_to_human
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Cases                                                                     #
+# ========================================================================= #
+
+
+STAGES = ('data', 'forward', 'backward', 'optimizer')
+
+# samplers used when a case does not specify one, based on `Framework.REQUIRED_OBS`
+_DEFAULT_SAMPLERS = {1: 'gt_single', 2: 'gt_pair', 3: 'gt_triple'}
+
+
+def benchmark_case_name(case: Dict[str, Any]) -> str:
+    return f'{case["framework"]}[{case["model"]}-{case["dataset"]}-{case["sampler"]}]'
+
+
+def make_benchmark_cases(
+    frameworks: Optional[Sequence[str]] = None,
+    models: Sequence[str] = ('linear', 'conv64'),
+    datasets: Sequence[str] = ('xyobject',),
+    samplers: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Get all the combinations of frameworks, models, datasets and samplers.
+    - If no frameworks are given, all the registered frameworks are used.
+    - If no samplers are given, the ground-truth sampler that returns the number
+      of observations required by each framework is used. Otherwise samplers that
+      return the wrong number of observations for a framework are skipped.
+    """
+    from disent import registry
+    if frameworks is None:
+        frameworks = list(registry.FRAMEWORKS)
+    cases = []
+    for framework in frameworks:
+        required_obs = registry.FRAMEWORKS[framework].REQUIRED_OBS
+        for sampler in ([_DEFAULT_SAMPLERS[required_obs]] if (samplers is None) else samplers):
+            num_samples = registry.SAMPLERS[sampler]().num_samples
+            if num_samples != required_obs:
+                log.debug(f'skipping sampler: {repr(sampler)} for framework: {repr(framework)}, returns {num_samples} observations but {required_obs} are required')
+                continue
+            for model in models:
+                for dataset in datasets:
+                    cases.append(dict(framework=framework, model=model, dataset=dataset, sampler=sampler))
+    return cases
+
+
+def _make_framework(case: Dict[str, Any], x_shape, z_size: int):
+    from disent import registry
+    from disent.frameworks.vae import Vae
+    from disent.model import AutoEncoder
+    Framework = registry.FRAMEWORKS[case['framework']]
+    return Framework(
+        model=AutoEncoder(
+            encoder=registry.MODELS[f'encoder_{case["model"]}'](x_shape=x_shape, z_size=z_size, z_multiplier=2 if issubclass(Framework, Vae) else 1),
+            decoder=registry.MODELS[f'decoder_{case["model"]}'](x_shape=x_shape, z_size=z_size),
+        ),
+        cfg=Framework.cfg(**case.get('cfg_kwargs', {})),
+    )
+
+
+# ========================================================================= #
+# Benchmark                                                                 #
+# ========================================================================= #
+
+
+def _get_peak_rss() -> int:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    return int(peak) if (sys.platform == 'darwin') else int(peak) * 1024
+
+
+def _compute_stats(times: np.ndarray) -> Dict[str, float]:
+    # the same keys as pytest-benchmark
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    mean = float(np.mean(times))
+    return dict(
+        min=float(np.min(times)),
+        max=float(np.max(times)),
+        mean=mean,
+        stddev=float(np.std(times, ddof=1)) if (len(times) > 1) else 0.0,
+        median=float(median),
+        iqr=float(q3 - q1),
+        q1=float(q1),
+        q3=float(q3),
+        rounds=int(len(times)),
+        total=float(np.sum(times)),
+        ops=(1 / mean) if (mean > 0) else 0.0,
+    )
+
+
+def benchmark_framework(
+    case: Dict[str, Any],
+    steps: int = 50,
+    warmup_steps: int = 5,
+    batch_size: int = 64,
+    num_workers: int = 0,
+    z_size: int = 9,
+    seed: int = 7777,
+    num_threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Train the framework of the benchmark case for a fixed number of steps,
+    and return the results for the case in the `pytest-benchmark` format.
+    - The warmup steps are not timed, these also start the dataloader workers.
+    - The peak RSS is that of the entire process, run each case in a
+      new process with `isolate=True` in `benchmark_frameworks` to
+      measure the peak memory usage of each case separately.
+    - The number of torch threads is set in the process that runs the case.
+    """
+    from disent import registry
+    from disent.dataset import DisentDataset
+    from disent.dataset.transform import ToImgTensorF32
+    from disent.util.seeds import seed as seed_all
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    seed_all(seed)
+    # make the dataset & framework
+    data = registry.DATASETS[case['dataset']]()
+    dataset = DisentDataset(data, registry.SAMPLERS[case['sampler']](), transform=ToImgTensorF32())
+    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers, persistent_workers=num_workers > 0)
+    framework = _make_framework(case, x_shape=data.x_shape, z_size=z_size)
+    framework.train()
+    optimizer = framework.configure_optimizers()
+    # get the next batch, restarting the dataloader if it is exhausted
+    iterator = iter(dataloader)
+    def _next_batch():
+        nonlocal iterator
+        try:
+            return next(iterator)
+        except StopIteration:
+            iterator = iter(dataloader)
+            return next(iterator)
+    # train the framework
+    times = np.zeros((steps, len(STAGES)), dtype='float64')
+    with warnings.catch_warnings():
+        # logging outside of a trainer warns on every call
+        warnings.simplefilter('ignore')
+        for i in range(-warmup_steps, steps):
+            t0 = time.perf_counter()
+            batch = _next_batch()
+            t1 = time.perf_counter()
+            loss = framework._compute_loss_step(batch, max(i, 0), update_schedules=False)
+            t2 = time.perf_counter()
+            loss.backward()
+            t3 = time.perf_counter()
+            optimizer.step()
+            optimizer.zero_grad()
+            t4 = time.perf_counter()
+            if i >= 0:
+                times[i] = (t1 - t0, t2 - t1, t3 - t2, t4 - t3)
+    # shutdown the workers
+    del iterator
+    # compute the results
+    step_times = times.sum(axis=1)
+    stats = _compute_stats(step_times)
+    images_per_step = batch_size * registry.FRAMEWORKS[case['framework']].REQUIRED_OBS
+    return dict(
+        name=benchmark_case_name(case),
+        group=case['framework'],
+        params=dict(case, batch_size=batch_size, num_workers=num_workers, z_size=z_size),
+        stats=stats,
+        extra_info=dict(
+            steps_per_sec=stats['ops'],
+            images_per_sec=stats['ops'] * images_per_step,
+            peak_rss=_get_peak_rss(),
+            torch_num_threads=torch.get_num_threads(),
+            **{f'{stage}_time': float(t) for stage, t in zip(STAGES, times.mean(axis=0))},
+        ),
+    )
+
+
+def _benchmark_framework_error(case: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+    try:
+        return benchmark_framework(case, **kwargs)
+    except Exception as e:
+        log.warning(f'failed to benchmark: {benchmark_case_name(case)}, {e.__class__.__name__}: {e}')
+        return dict(name=benchmark_case_name(case), group=case['framework'], params=dict(case), error=f'{e.__class__.__name__}: {e}')
+
+
+def get_machine_info(num_threads: Optional[int] = None) -> Dict[str, Any]:
+    import os
+    return dict(
+        node=platform.node(),
+        processor=platform.processor(),
+        machine=platform.machine(),
+        system=platform.system(),
+        release=platform.release(),
+        python_implementation=platform.python_implementation(),
+        python_version=platform.python_version(),
+        cpu_count=os.cpu_count(),
+        torch_version=torch.__version__,
+        torch_num_threads=torch.get_num_threads() if (num_threads is None) else num_threads,
+    )
+
+
+def benchmark_frameworks(
+    cases: Sequence[Dict[str, Any]],
+    steps: int = 50,
+    warmup_steps: int = 5,
+    batch_size: int = 64,
+    num_workers: int = 0,
+    z_size: int = 9,
+    seed: int = 7777,
+    isolate: bool = False,
+    num_threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Benchmark all the cases, see `benchmark_framework`, cases that fail are logged
+    and recorded with an "error" instead of stats. The output can be saved with
+    `save_framework_benchmark` and compared with `compare_framework_benchmarks`.
+    - If `isolate=True`, each case is run in a new spawned process so that
+      the peak RSS of each case is measured independently.
+    """
+    kwargs = dict(steps=steps, warmup_steps=warmup_steps, batch_size=batch_size, num_workers=num_workers, z_size=z_size, seed=seed, num_threads=num_threads)
+    benchmarks = []
+    for case in cases:
+        if isolate:
+            import multiprocessing
+            with multiprocessing.get_context('spawn').Pool(processes=1) as pool:
+                result = pool.apply(_benchmark_framework_error, (case,), kwargs)
+        else:
+            result = _benchmark_framework_error(case, **kwargs)
+        benchmarks.append(result)
+    # done!
+    results = dict(
+        machine_info=get_machine_info(num_threads=num_threads),
+        datetime=datetime.now().isoformat(),
+        version=_get_version(),
+        benchmarks=benchmarks,
+    )
+    log_framework_benchmark(results)
+    return results
+
+
+def _get_version() -> Optional[str]:
+    try:
+        from importlib.metadata import version
+        return version('disent')
+    except Exception:
+        return None
+
+
+# ========================================================================= #
+# Results                                                                   #
+# ========================================================================= #
+
+
+def save_framework_benchmark(results: Dict[str, Any], path: str):
+    with open(path, 'w') as fp:
+        json.dump(results, fp, indent=4)
+
+
+def load_framework_benchmark(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def log_framework_benchmark(results: Dict[str, Any]):
+    benchmarks = results['benchmarks']
+    if not benchmarks:
+        return
+    width = max(len(b['name']) for b in benchmarks)
+    log.info(
+        f'{"name":{width}s} | {"min (ms)":>9s} {"max (ms)":>9s} {"mean (ms)":>9s} {"stddev":>9s} {"median":>9s} {"ops":>8s} | '
+        f'{"images/s":>9s} {"peak rss":>12s} | ' + ' '.join(f'{s:>9s}' for s in STAGES)
+    )
+    for b in benchmarks:
+        if 'error' in b:
+            log.info(f'{b["name"]:{width}s} | ERROR: {b["error"]}')
+            continue
+        s, e = b['stats'], b['extra_info']
+        log.info(
+            f'{b["name"]:{width}s} | {s["min"]*1000:9.2f} {s["max"]*1000:9.2f} {s["mean"]*1000:9.2f} {s["stddev"]*1000:9.2f} {s["median"]*1000:9.2f} {s["ops"]:8.2f} | '
+            f'{e["images_per_sec"]:9.1f} {bytes_to_human(e["peak_rss"], color=False):>12s} | ' + ' '.join(f'{e[f"{st}_time"]*1000:7.2f}ms' for st in STAGES)
+        )
+
+
+def compare_framework_benchmarks(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    threshold: float = 0.10,
+    stat: str = 'median',
+) -> List[Dict[str, Any]]:
+    """
+    Compare the step times of the benchmarks with the same names in two results,
+    and return the comparisons of those that are slower by more than the threshold
+    fraction, eg. `0.1` for 10% slower. Benchmarks that failed are ignored.
+    """
+    old_benchmarks = {b['name']: b for b in old['benchmarks'] if 'stats' in b}
+    regressions = []
+    for b in new['benchmarks']:
+        if ('stats' not in b) or (b['name'] not in old_benchmarks):
+            continue
+        t_old, t_new = old_benchmarks[b['name']]['stats'][stat], b['stats'][stat]
+        change = (t_new - t_old) / t_old
+        if change > threshold:
+            regressions.append(dict(name=b['name'], old=t_old, new=t_new, change=change))
+            log.warning(f'performance regression: {b["name"]} {stat} step time increased by {change*100:.1f}% from {t_old*1000:.2f}ms to {t_new*1000:.2f}ms')
+    return regressions
+
+
+# ========================================================================= #
+# Total Correlation                                                         #
+# ========================================================================= #
+
+
+def _benchmark_total_correlation_point(
+    batch_size: int,
+    chunk_size: Optional[int],
+    z_size: int = 9,
+    estimator: str = 'mws',
+    repeats: int = 5,
+    seed: int = 7777,
+    num_threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    from disent.frameworks.vae import BetaTcVae
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    g = torch.Generator().manual_seed(seed)
+    z_mean = torch.randn(batch_size, z_size, generator=g).requires_grad_(True)
+    z_logvar = torch.randn(batch_size, z_size, generator=g).mul_(0.1).requires_grad_(True)
+    z_sampled = (z_mean + torch.randn(batch_size, z_size, generator=g) * torch.exp(0.5 * z_logvar)).detach().requires_grad_(True)
+    # the peak RSS can only increase, so this only measures the memory
+    # used by this point if it is more than that used by previous points
+    rss_start = _get_peak_rss()
+    times = np.zeros(repeats, dtype='float64')
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        tc = BetaTcVae._betatc_compute_total_correlation(z_sampled, z_mean, z_logvar, estimator=estimator, dataset_size=max(batch_size, 737280), chunk_size=chunk_size)
+        tc.backward()
+        times[i] = time.perf_counter() - t0
+    return dict(
+        name=f'total_correlation[{estimator}-b{batch_size}-c{chunk_size}]',
+        group='total_correlation',
+        params=dict(batch_size=batch_size, chunk_size=chunk_size, z_size=z_size, estimator=estimator),
+        stats=_compute_stats(times),
+        extra_info=dict(peak_rss=_get_peak_rss(), peak_rss_increase=_get_peak_rss() - rss_start, torch_num_threads=torch.get_num_threads()),
+    )
+
+
+def benchmark_total_correlation(
+    batch_sizes: Sequence[int] = (64, 256, 1024, 4096),
+    chunk_sizes: Sequence[Optional[int]] = (None, 256),
+    z_size: int = 9,
+    estimator: str = 'mws',
+    repeats: int = 5,
+    seed: int = 7777,
+    isolate: bool = False,
+    num_threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Measure the time & memory of the forward and backward pass of the `BetaTcVae`
+    total correlation estimator against the batch size, with & without chunking.
+    - The memory usage is the increase in the peak RSS, which is only
+      accurate if each point is run in a new process with `isolate=True`
+    - The dataset size of the 'mss' estimator is that of dsprites
+    """
+    kwargs = dict(z_size=z_size, estimator=estimator, repeats=repeats, seed=seed, num_threads=num_threads)
+    benchmarks = []
+    for chunk_size in chunk_sizes:
+        for batch_size in batch_sizes:
+            if isolate:
+                import multiprocessing
+                with multiprocessing.get_context('spawn').Pool(processes=1) as pool:
+                    result = pool.apply(_benchmark_total_correlation_point, (batch_size, chunk_size), kwargs)
+            else:
+                result = _benchmark_total_correlation_point(batch_size, chunk_size, **kwargs)
+            benchmarks.append(result)
+    # done!
+    results = dict(
+        machine_info=get_machine_info(num_threads=num_threads),
+        datetime=datetime.now().isoformat(),
+        version=_get_version(),
+        benchmarks=benchmarks,
+    )
+    log_total_correlation_benchmark(results)
+    return results
+
+
+def log_total_correlation_benchmark(results: Dict[str, Any]):
+    log.info(f'{"chunk size":>10s} {"batch size":>10s} | {"min (ms)":>9s} {"mean (ms)":>9s} {"median":>9s} | {"memory":>12s}')
+    for b in results['benchmarks']:
+        p, s = b['params'], b['stats']
+        log.info(f'{str(p["chunk_size"]):>10s} {p["batch_size"]:10d} | {s["min"]*1000:9.2f} {s["mean"]*1000:9.2f} {s["median"]*1000:9.2f} | {bytes_to_human(b["extra_info"]["peak_rss_increase"], color=False):>12s}')
+
+
+# ========================================================================= #
+# Entrypoint                                                                #
+# ========================================================================= #
+
+
+def _parse_args(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='benchmark the training throughput of frameworks on the CPU')
+    parser.add_argument('--frameworks', type=str, nargs='+', default=None, help='names of frameworks in `disent.registry.FRAMEWORKS`, defaults to all')
+    parser.add_argument('--models', type=str, nargs='+', default=['linear', 'conv64'], help='model names, eg. `conv64` for `encoder_conv64` & `decoder_conv64` in `disent.registry.MODELS`')
+    parser.add_argument('--datasets', type=str, nargs='+', default=['xyobject'], help='names of datasets in `disent.registry.DATASETS`')
+    parser.add_argument('--samplers', type=str, nargs='+', default=None, help='names of samplers in `disent.registry.SAMPLERS`, defaults to the ground-truth sampler required by each framework')
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup-steps', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--z-size', type=int, default=9)
+    parser.add_argument('--num-threads', type=int, default=None, help='number of torch threads')
+    parser.add_argument('--no-isolate', action='store_true', help='run all the cases in this process, the peak RSS is then the maximum over all previous cases')
+    parser.add_argument('--save', type=str, default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', type=str, default=None, help='compare the results to a previous JSON file, exits with an error if there are regressions')
+    parser.add_argument('--threshold', type=float, default=0.10, help='fraction the step time can increase by before it is a regression')
+    parser.add_argument('--tc-batch-sizes', type=int, nargs='+', default=None, help='benchmark the BetaTcVae total correlation against these batch sizes instead of the frameworks')
+    parser.add_argument('--tc-chunk-sizes', type=str, nargs='+', default=['none', '256'], help='the chunk sizes to benchmark the total correlation with, `none` disables chunking')
+    parser.add_argument('--tc-estimator', type=str, default='mws', help='the total correlation estimator, "mws" or "mss"')
+    return parser.parse_args(args)
+
+
+def main(args=None) -> int:
+    args = _parse_args(args)
+    # benchmark everything
+    if args.tc_batch_sizes is not None:
+        results = benchmark_total_correlation(
+            batch_sizes=args.tc_batch_sizes,
+            chunk_sizes=[None if (c.lower() == 'none') else int(c) for c in args.tc_chunk_sizes],
+            z_size=args.z_size,
+            estimator=args.tc_estimator,
+            isolate=not args.no_isolate,
+            num_threads=args.num_threads,
+        )
+    else:
+        results = benchmark_frameworks(
+            cases=make_benchmark_cases(frameworks=args.frameworks, models=args.models, datasets=args.datasets, samplers=args.samplers),
+            steps=args.steps,
+            warmup_steps=args.warmup_steps,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            z_size=args.z_size,
+            isolate=not args.no_isolate,
+            num_threads=args.num_threads,
+        )
+    if args.save is not None:
+        save_framework_benchmark(results, args.save)
+        log.info(f'saved benchmark results to: {args.save}')
+    # check for regressions
+    if args.compare is not None:
+        regressions = compare_framework_benchmarks(load_framework_benchmark(args.compare), results, threshold=args.threshold)
+        if regressions:
+            return 1
+        log.info(f'no performance regressions compared to: {args.compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
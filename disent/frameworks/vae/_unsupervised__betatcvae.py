@@ -22,15 +22,24 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import math
 from dataclasses import dataclass
+from typing import Optional
 from typing import Sequence
+from typing import Tuple
 
 import torch
 from torch.distributions import Normal
+from torch.utils.checkpoint import checkpoint
 
 from disent.frameworks.helper.util import compute_ave_loss_and_logs
 from disent.frameworks.vae._unsupervised__betavae import BetaVae
 
+
+# `use_reentrant` was added in torch 1.11, older versions always use the reentrant checkpoint
+_CHECKPOINT_KWARGS = dict(use_reentrant=False) if (tuple(int(v) for v in torch.__version__.split('.')[:2]) >= (1, 11)) else {}
+
+
 # ========================================================================= #
 # Beta-TC-VAE                                                               #
 # ========================================================================= #
@@ -53,7 +62,28 @@ class BetaTcVae(BetaVae):
     class cfg(BetaVae.cfg):
         """
         Equation (4) with alpha=gamma=1 can be written as ELBO+(1-beta)*TC
+
+        betatc_estimator:
+            - 'mws': minibatch weighted sampling, without the constant dataset
+                     size normalisation, like the reference implementation.
+            - 'mss': minibatch stratified sampling, requires the size of
+                     the dataset to be set with `betatc_dataset_size`.
+        betatc_chunk_size:
+            The log density of every sample under the posterior of every other
+            sample in the batch is a tensor of size (B, B, Z). If set, this is
+            computed for this many samples at a time and recomputed on the
+            backward pass, bounding the memory usage to (chunk_size, B, Z).
         """
+        betatc_estimator: str = 'mws'
+        betatc_dataset_size: Optional[int] = None
+        betatc_chunk_size: Optional[int] = None
+
+    def __init__(self, model: 'AutoEncoder', cfg: cfg = None, batch_augment=None):
+        super().__init__(model=model, cfg=cfg, batch_augment=batch_augment)
+        # checks
+        assert self.cfg.betatc_estimator in {'mws', 'mss'}, f'unsupported betatc_estimator={repr(self.cfg.betatc_estimator)} for {self.__class__.__name__}. Must be one of: {{"mws", "mss"}}'
+        assert (self.cfg.betatc_estimator != 'mss') or (self.cfg.betatc_dataset_size is not None), 'betatc_dataset_size must be set when betatc_estimator="mss"'
+        assert (self.cfg.betatc_chunk_size is None) or (self.cfg.betatc_chunk_size >= 1), 'betatc_chunk_size must be >= 1'
 
     # --------------------------------------------------------------------- #
     # Overrides                                                             #
@@ -82,6 +112,9 @@ class BetaTcVae(BetaVae):
             z_sampled=z_sampled,
             z_mean=d_posterior.mean,
             z_logvar=torch.log(d_posterior.variance),
+            estimator=self.cfg.betatc_estimator,
+            dataset_size=self.cfg.betatc_dataset_size,
+            chunk_size=self.cfg.betatc_chunk_size,
         )
         tc_reg_loss = (self.cfg.beta - 1.) * tc_loss
         return tc_reg_loss, {
@@ -90,26 +123,81 @@ class BetaTcVae(BetaVae):
         }
 
     @staticmethod
-    def _betatc_compute_total_correlation(z_sampled, z_mean, z_logvar):
+    def _betatc_compute_total_correlation(z_sampled, z_mean, z_logvar, estimator: str = 'mws', dataset_size: Optional[int] = None, chunk_size: Optional[int] = None):
         """
         Estimate total correlation over a batch.
         Reference implementation is from: https://github.com/amir-abdi/disentanglement-pytorch
         """
-        # Compute log(q(z(x_j)|x_i)) for every sample in the batch, which is a
-        # tensor of size [batch_size, batch_size, num_latents]. In the following
-        # comments, [batch_size, batch_size, num_latents] are indexed by [j, i, l].
+        B = z_sampled.shape[0]
+        if (chunk_size is None) or (chunk_size >= B):
+            log_qz, log_qz_product = BetaTcVae._betatc_compute_log_qz(z_sampled, z_mean, z_logvar, 0, estimator, dataset_size)
+        else:
+            # recompute each chunk on the backward pass, otherwise autograd
+            # keeps the log densities of all the chunks in memory anyway
+            recompute = torch.is_grad_enabled() and (z_sampled.requires_grad or z_mean.requires_grad or z_logvar.requires_grad)
+            chunks = []
+            for j in range(0, B, chunk_size):
+                args = (z_sampled[j:j+chunk_size], z_mean, z_logvar, j, estimator, dataset_size)
+                if recompute:
+                    chunks.append(checkpoint(BetaTcVae._betatc_compute_log_qz, *args, **_CHECKPOINT_KWARGS))
+                else:
+                    chunks.append(BetaTcVae._betatc_compute_log_qz(*args))
+            log_qz, log_qz_product = (torch.cat(xs, dim=0) for xs in zip(*chunks))
+        return (log_qz - log_qz_product).mean()
+
+    @staticmethod
+    def _betatc_compute_log_qz(z_sampled, z_mean, z_logvar, start: int = 0, estimator: str = 'mws', dataset_size: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Compute log(q(z(x_j))) and log(prod_l q(z(x_j)_l)) for the chunk of samples
+        z_sampled, starting at index `start` of the batch. The mean and log variance
+        are those of the entire batch.
+        """
+        # Compute log(q(z(x_j)|x_i)) for every sample in the chunk, which is a
+        # tensor of size [chunk_size, batch_size, num_latents]. In the following
+        # comments, [chunk_size, batch_size, num_latents] are indexed by [j, i, l].
         log_qz_prob = BetaTcVae._betatc_compute_gaussian_log_density(z_sampled.unsqueeze(dim=1), z_mean.unsqueeze(dim=0), z_logvar.unsqueeze(dim=0))
+        # log(prod_l q(z(x_j)_l|x_i)), which is a tensor of size [chunk_size, batch_size]
+        log_qz_joint = log_qz_prob.sum(dim=2, keepdim=False)
+
+        # The minibatch weighted sampling estimator weights every term by the
+        # same constant, which is skipped like the reference implementation.
+        if estimator == 'mss':
+            log_w = BetaTcVae._betatc_compute_mss_log_weights(z_sampled.shape[0], z_mean.shape[0], start, dataset_size, dtype=log_qz_prob.dtype, device=log_qz_prob.device)
+            log_qz_prob = log_qz_prob + log_w.unsqueeze(dim=2)
+            log_qz_joint = log_qz_joint + log_w
+        elif estimator != 'mws':
+            raise KeyError(f'invalid total correlation estimator: {repr(estimator)}, must be one of: {{"mws", "mss"}}')
 
         # Compute log prod_l p(z(x_j)_l) = sum_l(log(sum_i(q(z(z_j)_l|x_i)))
-        # + constant) for each sample in the batch, which is a vector of size
-        # [batch_size,].
-        log_qz_product = log_qz_prob.exp().sum(dim=1, keepdim=False).log().sum(dim=1, keepdim=False)
+        # + constant) for each sample in the chunk, which is a vector of size
+        # [chunk_size,].
+        log_qz_product = torch.logsumexp(log_qz_prob, dim=1, keepdim=False).sum(dim=1, keepdim=False)
 
         # Compute log(q(z(x_j))) as log(sum_i(q(z(x_j)|x_i))) + constant =
         # log(sum_i(prod_l q(z(x_j)_l|x_i))) + constant.
-        log_qz = log_qz_prob.sum(dim=2, keepdim=False).exp().sum(dim=1, keepdim=False).log()
+        log_qz = torch.logsumexp(log_qz_joint, dim=1, keepdim=False)
 
-        return (log_qz - log_qz_product).mean()
+        return log_qz, log_qz_product
+
+    @staticmethod
+    def _betatc_compute_mss_log_weights(num_rows: int, batch_size: int, start: int, dataset_size: int, dtype=None, device=None) -> torch.Tensor:
+        """
+        Get the rows [start, start + num_rows) of the log importance weight matrix of
+        the minibatch stratified sampling estimator, from Appendix C.2 of the paper.
+        Sample j is weighted by 1/N, the next sample in the batch by (N-M)/(NM),
+        and the remaining samples by 1/M, where M = batch_size - 1.
+        """
+        N, M = dataset_size, batch_size - 1
+        if M < 1:
+            raise ValueError(f'the minibatch stratified sampling estimator requires a batch size of at least 2, got: {batch_size}')
+        if N < batch_size:
+            raise ValueError(f'the dataset size: {N} must not be less than the batch size: {batch_size}')
+        rows = torch.arange(num_rows, device=device)
+        cols = rows + start
+        log_w = torch.full((num_rows, batch_size), -math.log(M), dtype=dtype, device=device)
+        log_w[rows, (cols + 1) % batch_size] = (math.log(N - M) - math.log(N * M)) if (N > M) else -math.inf
+        log_w[rows, cols] = -math.log(N)
+        return log_w
 
     @staticmethod
     def _betatc_compute_gaussian_log_density(samples, mean, log_var):
@@ -118,9 +206,7 @@ class BetaTcVae(BetaVae):
         Reference implementation is from: https://github.com/amir-abdi/disentanglement-pytorch
         """
         # TODO: can this be replaced with some variant of Normal.log_prob?
-        import math
-        pi = torch.tensor(math.pi, requires_grad=False)
-        normalization = torch.log(2 * pi)
+        normalization = math.log(2 * math.pi)
         inv_sigma = torch.exp(-log_var)
         tmp = samples - mean
-        return -0.5 * (tmp * tmp * inv_sigma + log_var + normalization)
\ No newline at end of file
+        return -0.5 * (tmp * tmp * inv_sigma + log_var + normalization)
@@ -27,7 +27,7 @@ Representations" (https://openreview.net/forum?id=By-7dz-AZ).
 """
 
 import logging
-from tqdm import tqdm
+from typing import Optional
 
 from disent.dataset import DisentDataset
 from disent.metrics import utils
@@ -52,9 +52,11 @@ def metric_dci(
         representation_function: callable,
         num_train: int = 10000,
         num_test: int = 5000,
-        batch_size: int = 16,
+        batch_size: int = 256,
         boost_mode='sklearn',
         show_progress=False,
+        executor: Optional[str] = None,
+        num_workers: Optional[int] = None,
 ):
     """Computes the DCI scores according to Sec 2.
     Args:
@@ -66,6 +68,8 @@ def metric_dci(
       batch_size: Batch size for sampling.
       boost_mode: which boosting algorithm should be used [sklearn, xgboost, lightgbm] (this can have a significant effect on score)
       show_progress: If a tqdm progress bar should be shown
+      executor: Fit the model for each factor in parallel, one of [None, serial, thread, process, joblib]
+      num_workers: The number of parallel workers used by the executor, defaults to the number of cpus.
     Returns:
       Dictionary with average disentanglement score, completeness and
         informativeness (train and test).
@@ -79,14 +83,14 @@ def metric_dci(
     mus_test, ys_test = utils.generate_batch_factor_code(dataset, representation_function, num_test, batch_size, show_progress=False)
 
     log.debug("Computing DCI metric.")
-    scores = _compute_dci(mus_train, ys_train, mus_test, ys_test, boost_mode=boost_mode, show_progress=show_progress)
+    scores = _compute_dci(mus_train, ys_train, mus_test, ys_test, boost_mode=boost_mode, show_progress=show_progress, executor=executor, num_workers=num_workers)
 
     return scores
 
 
-def _compute_dci(mus_train, ys_train, mus_test, ys_test, boost_mode='sklearn', show_progress=False):
+def _compute_dci(mus_train, ys_train, mus_test, ys_test, boost_mode='sklearn', show_progress=False, executor: Optional[str] = None, num_workers: Optional[int] = None):
     """Computes score based on both training and testing codes and factors."""
-    importance_matrix, train_err, test_err = _compute_importance_gbt(mus_train, ys_train, mus_test, ys_test, boost_mode=boost_mode, show_progress=show_progress)
+    importance_matrix, train_err, test_err = _compute_importance_gbt(mus_train, ys_train, mus_test, ys_test, boost_mode=boost_mode, show_progress=show_progress, executor=executor, num_workers=num_workers)
     assert importance_matrix.shape[0] == mus_train.shape[0]
     assert importance_matrix.shape[1] == ys_train.shape[0]
     return {
@@ -97,34 +101,52 @@ def _compute_dci(mus_train, ys_train, mus_test, ys_test, boost_mode='sklearn', s
     }
 
 
-def _compute_importance_gbt(x_train, y_train, x_test, y_test, boost_mode='sklearn', show_progress=False):
+def _compute_importance_gbt(x_train, y_train, x_test, y_test, boost_mode='sklearn', show_progress=False, executor: Optional[str] = None, num_workers: Optional[int] = None):
     """Compute importance based on gradient boosted trees."""
     num_factors = y_train.shape[0]
     num_codes = x_train.shape[0]
+    if boost_mode not in ('sklearn', 'xgboost', 'lightgbm'):
+        raise KeyError(f'Invalid boosting mode: {boost_mode=}')
+    # fit the model for each factor, possibly in parallel
+    results = utils.parallel_map(
+        _fit_gbt,
+        [x_train] * num_factors, y_train, [x_test] * num_factors, y_test, [boost_mode] * num_factors, utils.sample_seeds(num_factors),
+        executor=executor,
+        num_workers=num_workers,
+        show_progress=show_progress,
+    )
+    # collect the results in order
     importance_matrix = np.zeros(shape=[num_codes, num_factors], dtype=np.float64)
     train_loss = []
     test_loss = []
-    for i in tqdm(range(num_factors), disable=(not show_progress)):
-        if boost_mode == 'sklearn':
-            from sklearn.ensemble import GradientBoostingClassifier
-            model = GradientBoostingClassifier()
-        elif boost_mode == 'xgboost':
-            from xgboost import XGBClassifier
-            model = XGBClassifier()
-        elif boost_mode == 'lightgbm':
-            from lightgbm import LGBMClassifier
-            model = LGBMClassifier()
-        else:
-            raise KeyError(f'Invalid boosting mode: {boost_mode=}')
-
-        model.fit(x_train.T, y_train[i, :])
-        importance_matrix[:, i] = np.abs(model.feature_importances_)
-        train_loss.append(np.mean(model.predict(x_train.T) == y_train[i, :]))
-        test_loss.append(np.mean(model.predict(x_test.T) == y_test[i, :]))
-
+    for i, (importances, train_acc, test_acc) in enumerate(results):
+        importance_matrix[:, i] = importances
+        train_loss.append(train_acc)
+        test_loss.append(test_acc)
     return importance_matrix, np.mean(train_loss), np.mean(test_loss)
 
 
+def _fit_gbt(x_train, y_train_i, x_test, y_test_i, boost_mode: str, seed: int):
+    """Fit the gradient boosted trees for a single factor, this is a module level function so that it can be pickled."""
+    if boost_mode == 'sklearn':
+        from sklearn.ensemble import GradientBoostingClassifier
+        model = GradientBoostingClassifier(random_state=seed)
+    elif boost_mode == 'xgboost':
+        from xgboost import XGBClassifier
+        model = XGBClassifier(random_state=seed)
+    elif boost_mode == 'lightgbm':
+        from lightgbm import LGBMClassifier
+        model = LGBMClassifier(random_state=seed)
+    else:
+        raise KeyError(f'Invalid boosting mode: {boost_mode=}')
+
+    model.fit(x_train.T, y_train_i)
+    importances = np.abs(model.feature_importances_)
+    train_acc = np.mean(model.predict(x_train.T) == y_train_i)
+    test_acc = np.mean(model.predict(x_test.T) == y_test_i)
+    return importances, train_acc, test_acc
+
+
 def _disentanglement_per_code(importance_matrix):
     """Compute disentanglement score of each code."""
     # importance_matrix is of shape [num_codes, num_factors].
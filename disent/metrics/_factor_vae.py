@@ -52,6 +52,7 @@ def metric_factor_vae(
         num_train: int = 10000,
         num_eval: int = 5000,
         num_variance_estimate: int = 10000,
+        eval_batch_size: int = 1024,
         show_progress=False,
 ):
     """
@@ -93,6 +94,7 @@ def metric_factor_vae(
       num_train: Number of points used for training.
       num_eval: Number of points used for evaluation.
       num_variance_estimate: Number of points used to estimate global variances.
+      eval_batch_size: Number of observations encoded at once, this does not affect the votes.
       show_progress: If a tqdm progress bar should be shown
     Returns:
       Dictionary with scores:
@@ -101,7 +103,7 @@ def metric_factor_vae(
     """
 
     log.debug("Computing global variances to standardise.")
-    global_variances = _compute_variances(dataset, representation_function, num_variance_estimate)
+    global_variances = _compute_variances(dataset, representation_function, num_variance_estimate, eval_batch_size=eval_batch_size)
     active_dims = _prune_dims(global_variances)
 
     if not active_dims.any():
@@ -112,7 +114,7 @@ def metric_factor_vae(
         }
 
     log.debug("Generating training set.")
-    training_votes = _generate_training_batch(dataset, representation_function, batch_size, num_train, global_variances, active_dims, show_progress=show_progress)
+    training_votes = _generate_training_batch(dataset, representation_function, batch_size, num_train, global_variances, active_dims, eval_batch_size=eval_batch_size, show_progress=show_progress)
     classifier = np.argmax(training_votes, axis=0)
     other_index = np.arange(training_votes.shape[1])
 
@@ -120,7 +122,7 @@ def metric_factor_vae(
     train_accuracy = np.sum(training_votes[classifier, other_index]) * 1. / np.sum(training_votes)
 
     log.debug("Generating evaluation set.")
-    eval_votes = _generate_training_batch(dataset, representation_function, batch_size, num_eval, global_variances, active_dims, show_progress=show_progress)
+    eval_votes = _generate_training_batch(dataset, representation_function, batch_size, num_eval, global_variances, active_dims, eval_batch_size=eval_batch_size, show_progress=show_progress)
 
     # Evaluate evaluation set accuracy
     eval_accuracy = np.sum(eval_votes[classifier, other_index]) * 1. / np.sum(eval_votes)
@@ -142,7 +144,7 @@ def _compute_variances(
         dataset: DisentDataset,
         representation_function: callable,
         batch_size: int,
-        eval_batch_size: int = 64
+        eval_batch_size: int = 256
 ):
     """Computes the variance for each dimension of the representation.
     Args:
@@ -160,6 +162,79 @@ def _compute_variances(
     return np.var(representations, axis=0, ddof=1)
 
 
+def _sample_fixed_factor_groups(
+        dataset: DisentDataset,
+        batch_size: int,
+        num_points: int,
+) -> (np.ndarray, np.ndarray):
+    """Sample all the mini-batches of ground-truth factors, each with a single factor fixed.
+    - the random draws are made in the same order as `_generate_training_sample`
+      so that seeded results are identical to the sequential implementation.
+    Returns:
+      factor_indices: (num_points,)-sized array of the factor fixed in each mini-batch.
+      factors: (num_points, batch_size, num_factors)-sized array of factors.
+    """
+    gt_data = dataset.gt_data
+    factor_indices = np.empty(num_points, dtype=np.int64)
+    factors = np.empty((num_points, batch_size, gt_data.num_factors), dtype=np.int64)
+    for i in range(num_points):
+        factor_indices[i] = np.random.randint(gt_data.num_factors)
+        factors[i] = gt_data.sample_factors(batch_size)
+    # Fix the selected factor across each mini-batch.
+    groups = np.arange(num_points)
+    factors[groups, :, factor_indices] = factors[groups, 0, factor_indices][:, None]
+    return factor_indices, factors
+
+
+def _generate_training_batch(
+        dataset: DisentDataset,
+        representation_function: callable,
+        batch_size: int,
+        num_points: int,
+        global_variances: np.ndarray,
+        active_dims: list,
+        eval_batch_size: int = 1024,
+        show_progress=False,
+):
+    """Sample a set of training samples based on a batch of ground-truth data.
+    All the mini-batches are sampled up front, then encoded together in large chunks.
+    Args:
+      dataset: DisentDataset to be sampled from.
+      representation_function: Function that takes observations as input and outputs a dim_representation sized representation for each observation.
+      batch_size: Number of points to be used to compute the training_sample.
+      num_points: Number of points to be sampled for training set.
+      global_variances: Numpy vector with variances for all dimensions of representation.
+      active_dims: Indexes of active dimensions.
+      eval_batch_size: Number of observations encoded at once.
+    Returns:
+      (num_factors, dim_representation)-sized numpy array with votes.
+    """
+    votes = np.zeros((dataset.gt_data.num_factors, global_variances.shape[0]), dtype=np.int64)
+    if num_points <= 0:
+        return votes
+    # sample all the mini-batches & encode them in large chunks
+    factor_indices, factors = _sample_fixed_factor_groups(dataset, batch_size, num_points)
+    factors = factors.reshape(num_points * batch_size, -1)
+    representations = utils.encode_batches(
+        get_batch=lambda i, j: dataset.dataset_batch_from_factors(factors[i:j], mode='input'),
+        representation_function=representation_function,
+        num_points=num_points * batch_size,
+        batch_size=eval_batch_size,
+        show_progress=show_progress,
+    )
+    representations = representations.reshape(num_points, batch_size, -1)
+    # compute the argmin of the normalised variances for each mini-batch
+    local_variances = np.var(representations, axis=1, ddof=1)
+    argmins = np.argmin(local_variances[:, active_dims] / global_variances[active_dims], axis=1)
+    np.add.at(votes, (factor_indices, argmins), 1)
+    return votes
+
+
+# ========================================================================= #
+# factor_vae - reference implementation                                     #
+# ========================================================================= #
+
+
 def _generate_training_sample(
         dataset: DisentDataset,
         representation_function: callable,
@@ -193,7 +268,7 @@ def _generate_training_sample(
     return factor_index, argmin
 
 
-def _generate_training_batch(
+def _generate_training_batch_loop(
         dataset: DisentDataset,
         representation_function: callable,
         batch_size: int,
@@ -202,14 +277,7 @@ def _generate_training_batch(
         active_dims: list,
         show_progress=False,
 ):
-    """Sample a set of training samples based on a batch of ground-truth data.
-    Args:
-      dataset: DisentDataset to be sampled from.
-      representation_function: Function that takes observations as input and outputs a dim_representation sized representation for each observation.
-      batch_size: Number of points to be used to compute the training_sample.
-      num_points: Number of points to be sampled for training set.
-      global_variances: Numpy vector with variances for all dimensions of representation.
-      active_dims: Indexes of active dimensions.
+    """Sequential version of `_generate_training_batch`, each mini-batch is encoded separately.
     Returns:
       (num_factors, dim_representation)-sized numpy array with votes.
     """
@@ -219,6 +287,7 @@ def _generate_training_batch(
         votes[factor_index, argmin] += 1
     return votes
 
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -48,7 +48,7 @@ def metric_mig(
         dataset: DisentDataset,
         representation_function,
         num_train=10000,
-        batch_size=16,
+        batch_size=256,
 ):
     """Computes the mutual information gap.
     Args:
@@ -27,6 +27,7 @@ Observations" (https://openreview.net/forum?id=H1kG7GZAW), Section 3.
 """
 
 import logging
+from typing import Optional
 
 import numpy as np
 from sklearn import svm
@@ -50,8 +51,10 @@ def metric_sap(
         representation_function,
         num_train=10000,
         num_test=5000,
-        batch_size=16,
-        continuous_factors=False
+        batch_size=256,
+        continuous_factors=False,
+        executor: Optional[str] = None,
+        num_workers: Optional[int] = None,
 ):
     """Computes the SAP score.
     Args:
@@ -62,6 +65,8 @@ def metric_sap(
       num_test: Number of points used for testing discrete variables.
       batch_size: Batch size for sampling.
       continuous_factors: Factors are continuous variable (True) or not (False).
+      executor: Fit the classifier for each (latent, factor) pair in parallel, one of [None, serial, thread, process, joblib]
+      num_workers: The number of parallel workers used by the executor, defaults to the number of cpus.
     Returns:
       Dictionary with SAP score.
     """
@@ -69,12 +74,12 @@ def metric_sap(
     mus, ys = utils.generate_batch_factor_code(dataset, representation_function, num_train, batch_size)
     mus_test, ys_test = utils.generate_batch_factor_code(dataset, representation_function, num_test, batch_size)
     log.debug("Computing score matrix.")
-    return _compute_sap(mus, ys, mus_test, ys_test, continuous_factors)
+    return _compute_sap(mus, ys, mus_test, ys_test, continuous_factors, executor=executor, num_workers=num_workers)
 
 
-def _compute_sap(mus, ys, mus_test, ys_test, continuous_factors):
+def _compute_sap(mus, ys, mus_test, ys_test, continuous_factors, executor: Optional[str] = None, num_workers: Optional[int] = None):
     """Computes score based on both training and testing codes and factors."""
-    score_matrix = _compute_score_matrix(mus, ys, mus_test, ys_test, continuous_factors)
+    score_matrix = _compute_score_matrix(mus, ys, mus_test, ys_test, continuous_factors, executor=executor, num_workers=num_workers)
     # Score matrix should have shape [num_latents, num_factors].
     assert score_matrix.shape[0] == mus.shape[0]
     assert score_matrix.shape[1] == ys.shape[0]
@@ -86,16 +91,16 @@ def _compute_sap(mus, ys, mus_test, ys_test, continuous_factors):
     }
 
 
-def _compute_score_matrix(mus, ys, mus_test, ys_test, continuous_factors):
+def _compute_score_matrix(mus, ys, mus_test, ys_test, continuous_factors, executor: Optional[str] = None, num_workers: Optional[int] = None):
     """Compute score matrix as described in Section 3."""
     num_latents = mus.shape[0]
     num_factors = ys.shape[0]
     score_matrix = np.zeros([num_latents, num_factors])
-    for i in range(num_latents):
-        for j in range(num_factors):
-            mu_i = mus[i, :]
-            y_j = ys[j, :]
-            if continuous_factors:
+    if continuous_factors:
+        for i in range(num_latents):
+            for j in range(num_factors):
+                mu_i = mus[i, :]
+                y_j = ys[j, :]
                 # Attribute is considered continuous.
                 cov_mu_i_y_j = np.cov(mu_i, y_j, ddof=1)
                 cov_mu_y = cov_mu_i_y_j[0, 1] ** 2
@@ -105,17 +110,28 @@ def _compute_score_matrix(mus, ys, mus_test, ys_test, continuous_factors):
                     score_matrix[i, j] = cov_mu_y * 1. / (var_mu * var_y)
                 else:
                     score_matrix[i, j] = 0.
-            else:
-                # Attribute is considered discrete.
-                mu_i_test = mus_test[i, :]
-                y_j_test = ys_test[j, :]
-                classifier = svm.LinearSVC(C=0.01, class_weight="balanced")
-                classifier.fit(mu_i[:, np.newaxis], y_j)
-                pred = classifier.predict(mu_i_test[:, np.newaxis])
-                score_matrix[i, j] = np.mean(pred == y_j_test)
+    else:
+        # Attribute is considered discrete.
+        # - fit the classifier for each pair, possibly in parallel
+        ii, jj = np.meshgrid(np.arange(num_latents), np.arange(num_factors), indexing='ij')
+        ii, jj = ii.ravel(), jj.ravel()
+        scores = utils.parallel_map(
+            _fit_svc, mus[ii, :], ys[jj, :], mus_test[ii, :], ys_test[jj, :], utils.sample_seeds(len(ii)),
+            executor=executor,
+            num_workers=num_workers,
+        )
+        score_matrix[ii, jj] = scores
     return score_matrix
 
 
+def _fit_svc(mu_i, y_j, mu_i_test, y_j_test, seed: int):
+    """Fit the classifier for a single (latent, factor) pair, this is a module level function so that it can be pickled."""
+    classifier = svm.LinearSVC(C=0.01, class_weight="balanced", random_state=seed)
+    classifier.fit(mu_i[:, np.newaxis], y_j)
+    pred = classifier.predict(mu_i_test[:, np.newaxis])
+    return np.mean(pred == y_j_test)
+
+
 def _compute_avg_diff_top_two(matrix):
     sorted_matrix = np.sort(matrix, axis=0)
     return np.mean(sorted_matrix[-1, :] - sorted_matrix[-2, :])
@@ -47,7 +47,7 @@ def metric_unsupervised(
         dataset: DisentDataset,
         representation_function,
         num_train=10000,
-        batch_size=16
+        batch_size=256
 ):
     """Computes unsupervised scores based on covariance and mutual information.
     Args:
@@ -0,0 +1,360 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Persistent cache of encoded ground-truth datasets: "encode once, evaluate many".
+
+The observations of a dataset are encoded once into a memory-mapped `(N, z)`
+array, stored in a cache directory and keyed by a hash of the model weights
+and the dataset. The cached codes are then exposed as a ground-truth dataset
+whose observations are the codes themselves, along with an identity
+representation function. Any metric can be computed from the cache without
+loading images or running forward passes.
+
+```
+cache = EncodingCache.from_model(dataset, model.encode, model=model, cache_dir='data/cache/encodings')
+scores = cache.compute_metrics([metric_dci, metric_mig])
+```
+
+NOTE: metrics that compare the observations themselves, eg. the `*_data`
+      distances of the factored components metric, compare the codes instead.
+"""
+
+import hashlib
+import logging
+import os
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import torch
+
+from disent.dataset import DisentDataset
+from disent.dataset.data import GroundTruthData
+from disent.dataset.util.memmap import memmap_load_meta
+from disent.dataset.util.memmap import memmap_meta_path
+from disent.dataset.util.memmap import memmap_open
+from disent.dataset.util.memmap import memmap_save_meta
+from disent.metrics.utils import encode_batches
+from disent.util.inout.files import AtomicSaveFile
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Hashing                                                                   #
+# ========================================================================= #
+
+
+def hash_model_weights(model: torch.nn.Module, hash_type: str = 'md5') -> str:
+    """
+    Hash the names, dtypes, shapes and values of all the parameters & buffers of a model.
+    """
+    hasher = hashlib.new(hash_type)
+    for name, tensor in sorted(model.state_dict().items()):
+        array = tensor.detach().cpu().contiguous().numpy()
+        hasher.update(f'{name}:{array.dtype.str}:{array.shape};'.encode())
+        hasher.update(array.tobytes())
+    return hasher.hexdigest()
+
+
+def hash_dataset(dataset: DisentDataset, num_samples: int = 16, hash_type: str = 'md5') -> str:
+    """
+    Hash the attributes of the ground-truth data and the transform, as well as
+    the model inputs for evenly spaced observations in the dataset.
+    """
+    gt_data = dataset.gt_data
+    hasher = hashlib.new(hash_type)
+    hasher.update(f'{gt_data.__class__.__qualname__}:{gt_data.name}:{gt_data.factor_names}:{gt_data.factor_sizes}:{dataset.transform!r};'.encode())
+    # hash the observations
+    idxs = np.linspace(0, len(gt_data) - 1, num=min(num_samples, len(gt_data))).round().astype('int64')
+    obs = dataset.dataset_batch_from_indices(idxs, mode='input')
+    obs = obs.detach().cpu().contiguous().numpy() if torch.is_tensor(obs) else np.ascontiguousarray(obs)
+    hasher.update(f'{obs.dtype.str}:{obs.shape};'.encode())
+    hasher.update(obs.tobytes())
+    return hasher.hexdigest()
+
+
+# ========================================================================= #
+# Subsets                                                                   #
+# ========================================================================= #
+
+
+def _normalise_factor_strides(factor_strides: Optional[Union[int, Sequence[int]]], num_factors: int) -> Tuple[int, ...]:
+    if factor_strides is None:
+        factor_strides = 1
+    if isinstance(factor_strides, int):
+        factor_strides = [factor_strides] * num_factors
+    factor_strides = tuple(int(s) for s in factor_strides)
+    if len(factor_strides) != num_factors:
+        raise ValueError(f'the number of factor_strides: {factor_strides} does not match the number of factors: {num_factors}')
+    if any(s < 1 for s in factor_strides):
+        raise ValueError(f'factor_strides must all be >= 1, got: {factor_strides}')
+    return factor_strides
+
+
+def stratified_factor_grid(factor_sizes: Sequence[int], factor_strides: Optional[Union[int, Sequence[int]]] = None) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    """
+    Get the evenly spaced sub-grid of the ground-truth factors that
+    takes every n-th value along each factor.
+    - The sub-grid is itself a valid factor space, with the returned
+      factor sizes, so metrics can sample from it as usual.
+    Returns:
+      factors: (N, num_factors)-sized array of factors in the sub-grid, in the same order as the sub-grid indices.
+      sub_factor_sizes: the size of each factor in the sub-grid.
+    """
+    factor_strides = _normalise_factor_strides(factor_strides, len(factor_sizes))
+    values = [np.arange(0, size, stride) for size, stride in zip(factor_sizes, factor_strides)]
+    factors = np.stack(np.meshgrid(*values, indexing='ij'), axis=-1).reshape(-1, len(factor_sizes))
+    return factors, tuple(len(v) for v in values)
+
+
+# ========================================================================= #
+# Encoded Data                                                              #
+# ========================================================================= #
+
+
+class EncodedGroundTruthData(GroundTruthData):
+    """
+    Ground-truth data where each observation is the cached
+    representation of the corresponding original observation.
+    """
+
+    def __init__(self, codes: np.ndarray, factor_names: Sequence[str], factor_sizes: Sequence[int], name: str = 'encoded', transform=None):
+        self._codes = codes
+        self._attr_name = name
+        self._attr_factor_names = tuple(factor_names)
+        self._attr_factor_sizes = tuple(int(size) for size in factor_sizes)
+        # initialize!
+        super().__init__(transform=transform)
+        # checks
+        if len(codes) != len(self):
+            raise ValueError(f'the number of codes: {len(codes)} does not match the product of the factor_sizes: {self.factor_sizes}')
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes
+
+    @property
+    def name(self) -> str:
+        return self._attr_name
+
+    @property
+    def factor_names(self) -> Tuple[str, ...]:
+        return self._attr_factor_names
+
+    @property
+    def factor_sizes(self) -> Tuple[int, ...]:
+        return self._attr_factor_sizes
+
+    @property
+    def x_shape(self) -> Tuple[int, ...]:
+        return tuple(self._codes.shape[1:])
+
+    @property
+    def img_shape(self) -> Tuple[int, ...]:
+        return tuple(self._codes.shape[1:])
+
+    def _get_observation(self, idx):
+        return np.asarray(self._codes[idx])
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return np.asarray(self._codes[idxs])
+
+
+def _identity_representation(observations):
+    return observations
+
+
+# ========================================================================= #
+# Encoding Cache                                                            #
+# ========================================================================= #
+
+
+class EncodingCache(object):
+    """
+    Memory-mapped `(N, z)` array of the encoded observations of a ground-truth dataset,
+    saved to `<cache_dir>/<key>.npy` alongside a json sidecar file with the factors.
+
+    Metrics are computed from the cache by passing `cache.dataset` and `cache.representation_function`
+    to the metric in place of the original dataset & representation function, or by using `cache.compute_metrics`.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        meta = memmap_load_meta(path)
+        self._meta = meta
+        self._gt_data = EncodedGroundTruthData(
+            codes=memmap_open(path, mode='r'),
+            factor_names=meta['factor_names'],
+            factor_sizes=meta['factor_sizes'],
+            name=meta['dataset_name'],
+        )
+        self._dataset = DisentDataset(self._gt_data)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def meta(self) -> dict:
+        return self._meta
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._gt_data.codes
+
+    @property
+    def dataset(self) -> DisentDataset:
+        return self._dataset
+
+    @property
+    def representation_function(self) -> Callable[[torch.Tensor], torch.Tensor]:
+        return _identity_representation
+
+    def __len__(self):
+        return len(self._gt_data)
+
+    def compute_metrics(self, metrics: Sequence[Callable]) -> Dict[str, float]:
+        """
+        Compute all the metrics from the cached codes, merging their scores.
+        """
+        scores = {}
+        for metric in metrics:
+            scores.update(metric(self.dataset, self.representation_function))
+        return scores
+
+    @staticmethod
+    def make_key(dataset: DisentDataset, model: torch.nn.Module, factor_strides: Optional[Union[int, Sequence[int]]] = None) -> str:
+        factor_strides = _normalise_factor_strides(factor_strides, dataset.gt_data.num_factors)
+        key = f'{dataset.gt_data.name}_{hash_dataset(dataset)}_{hash_model_weights(model)}'
+        if any(s != 1 for s in factor_strides):
+            key = f'{key}_s{"-".join(map(str, factor_strides))}'
+        return key
+
+    @classmethod
+    def from_model(
+        cls,
+        dataset: DisentDataset,
+        representation_function: Callable[[torch.Tensor], torch.Tensor],
+        cache_dir: str,
+        model: Optional[torch.nn.Module] = None,
+        key: Optional[str] = None,
+        factor_strides: Optional[Union[int, Sequence[int]]] = None,
+        batch_size: int = 256,
+        show_progress: bool = False,
+        overwrite: bool = False,
+    ) -> 'EncodingCache':
+        """
+        Load the cached encodings of the dataset, encoding them first if they do not yet exist.
+        :param model: the model whose weights are hashed to compute the cache key, defaults to the
+               `representation_function` if it is a `torch.nn.Module`, otherwise a `key` must be given.
+        :param key: the name of the cache file, overrides the key computed from the model & dataset.
+        :param factor_strides: cache a stratified subset of the dataset, the evenly spaced sub-grid
+               that takes every n-th value along each factor. The metrics then run over this sub-grid.
+        """
+        # get the cache key
+        if key is None:
+            if model is None:
+                if not isinstance(representation_function, torch.nn.Module):
+                    raise ValueError('either the `model` or the `key` must be given if the `representation_function` is not a `torch.nn.Module`')
+                model = representation_function
+            key = cls.make_key(dataset, model, factor_strides=factor_strides)
+        path = os.path.join(cache_dir, f'{key}.npy')
+        # encode the dataset, the data & meta files are saved separately, so if only
+        # one exists or they do not match, an earlier run was interrupted and is overwritten
+        if overwrite or not cls._is_cached(path, dataset, factor_strides=factor_strides):
+            cls._encode_and_save(path, dataset, representation_function, factor_strides=factor_strides, batch_size=batch_size, show_progress=show_progress, overwrite=True)
+        else:
+            log.debug(f'loading cached encodings: {path}')
+        return cls(path)
+
+    @staticmethod
+    def _is_cached(path: str, dataset: DisentDataset, factor_strides: Optional[Union[int, Sequence[int]]] = None) -> bool:
+        if not (os.path.exists(path) and os.path.exists(memmap_meta_path(path))):
+            return False
+        try:
+            meta = memmap_load_meta(path)
+            memmap_open(path, mode='r', shape=meta['shape'], dtype=meta['dtype'])
+        except (ValueError, KeyError, OSError) as e:
+            log.warning(f'invalid cached encodings: {path}, {e.__class__.__name__}: {e}')
+            return False
+        # the factors must match the subset of the dataset
+        _, sub_factor_sizes = stratified_factor_grid(dataset.gt_data.factor_sizes, factor_strides)
+        if list(meta['factor_sizes']) != [int(s) for s in sub_factor_sizes]:
+            log.warning(f'cached encodings: {path} have factor sizes: {meta["factor_sizes"]}, expected: {list(sub_factor_sizes)}')
+            return False
+        return True
+
+    @staticmethod
+    def _encode_and_save(
+        path: str,
+        dataset: DisentDataset,
+        representation_function: Callable[[torch.Tensor], torch.Tensor],
+        factor_strides: Optional[Union[int, Sequence[int]]] = None,
+        batch_size: int = 256,
+        show_progress: bool = False,
+        overwrite: bool = False,
+    ):
+        gt_data = dataset.gt_data
+        # get the indices of the observations in the subset
+        factors, sub_factor_sizes = stratified_factor_grid(gt_data.factor_sizes, factor_strides)
+        idxs = gt_data.pos_to_idx(factors)
+        # encode the observations
+        log.debug(f'encoding {len(idxs)} observations to: {path}')
+        codes = encode_batches(
+            get_batch=lambda i, j: dataset.dataset_batch_from_indices(idxs[i:j], mode='input'),
+            representation_function=representation_function,
+            num_points=len(idxs),
+            batch_size=batch_size,
+            show_progress=show_progress,
+        )
+        # save the codes
+        with AtomicSaveFile(path, overwrite=overwrite) as temp_file:
+            out = memmap_open(temp_file, mode='w+', shape=codes.shape, dtype=codes.dtype)
+            out[...] = codes
+            out.flush()
+            del out
+        # save the meta file, the data must exist first
+        memmap_save_meta(
+            path=path,
+            shape=codes.shape,
+            dtype=codes.dtype,
+            factor_sizes=sub_factor_sizes,
+            factor_names=gt_data.factor_names,
+            dataset_name=gt_data.name,
+            dataset_cls_name=gt_data.__class__.__name__,
+            overwrite=overwrite,
+            attrs=dict(factor_strides=list(_normalise_factor_strides(factor_strides, gt_data.num_factors))),
+        )
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
@@ -23,6 +23,7 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 from ._schedule import Schedule
+from ._schedule import CompiledSchedule
 
 # schedules
 from ._schedule import ClipSchedule
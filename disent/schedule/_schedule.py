@@ -45,6 +45,60 @@ class Schedule(object):
     def compute_value(self, step: int, value):
         raise NotImplementedError
 
+    def compute_values(self, steps: np.ndarray, value) -> np.ndarray:
+        """
+        Compute the values of the schedule for an array of steps at once.
+        - The default implementation passes the array of steps to `compute_value`,
+          custom schedules that do not support arrays should override this.
+        """
+        steps = np.asarray(steps)
+        values = np.asarray(self.compute_value(step=steps, value=value), dtype='float64')
+        return np.broadcast_to(values, steps.shape).copy()
+
+    def compile(self, max_steps: int, value) -> 'CompiledSchedule':
+        """
+        Precompute the values of the schedule for every step in
+        the range [0, max_steps], see `CompiledSchedule`.
+        """
+        return CompiledSchedule(schedule=self, max_steps=max_steps, value=value)
+
+
+class CompiledSchedule(Schedule):
+    """
+    A schedule with a lookup table of the values of the wrapped schedule for every
+    step in the range [0, max_steps], computed for a single input value. Lookups
+    are O(1), steps or values that are not in the table fall back to the wrapped
+    schedule. The table can also be used to plot or export the schedule.
+    """
+
+    def __init__(self, schedule: Schedule, max_steps: int, value):
+        """
+        :param schedule: The wrapped schedule that is precomputed
+        :param max_steps: The last step that is precomputed, usually the `max_steps` of the trainer
+        :param value: The value passed to the wrapped schedule, usually the initial value from the config
+        """
+        assert isinstance(schedule, Schedule)
+        assert max_steps >= 0
+        # don't nest tables
+        if isinstance(schedule, CompiledSchedule):
+            schedule = schedule.schedule
+        self.schedule = schedule
+        self.max_steps = max_steps
+        self.value = value
+        self.table = schedule.compute_values(np.arange(max_steps + 1), value)
+        self.table.flags.writeable = False
+
+    def compute_value(self, step: int, value):
+        if isinstance(step, (int, np.integer)) and (0 <= step <= self.max_steps) and (value == self.value):
+            return self.table[step]
+        return self.schedule.compute_value(step=step, value=value)
+
+    def compute_values(self, steps: np.ndarray, value) -> np.ndarray:
+        steps = np.asarray(steps)
+        if (steps.dtype.kind in 'iu') and (value == self.value) and np.all((0 <= steps) & (steps <= self.max_steps)):
+            return self.table[steps]
+        return self.schedule.compute_values(steps, value)
+
 
 # ========================================================================= #
 # Value Schedules                                                           #
@@ -222,7 +276,7 @@ class CyclicSchedule(Schedule):
     def compute_value(self, step: int, value):
         # shift the start
         if self.start_step is not None:
-            step = max(0, step - self.start_step)
+            step = np.maximum(0, step - self.start_step)
         # outputs value in range [0, 1]
         ratio = cyclical_anneal(
             step=step,
@@ -355,7 +409,7 @@ class ClipSchedule(Schedule):
     def compute_value(self, step: int, value):
         if self.max_step is not None: step = np.minimum(self.max_step, step)
         if self.min_step is not None: step = np.maximum(self.min_step, step)
-        if self.shift_step is not None: step += self.shift_step
+        if self.shift_step is not None: step = step + self.shift_step
         result = self.schedule(step, value)
         if self.max_value is not None: result = np.minimum(self.max_value, result)
         if self.min_value is not None: result = np.maximum(self.min_value, result)
@@ -373,8 +427,8 @@ if __name__ == '__main__':
         import matplotlib.pyplot as plt
         fig, axs = plt.subplots(1, len(schedules), figsize=(3*len(schedules), 3))
         for ax, s in zip(axs, schedules):
-            xs = list(range(total))
-            ys = [s(x, value) for x in xs]
+            xs = np.arange(total)
+            ys = s.compute_values(xs, value)
             ax.set_xlim([-0.05 * total, total + 0.05 * total])
             ax.set_ylim([-0.05 * value, value + 0.05 * value])
             ax.plot(xs, ys)
@@ -48,6 +48,31 @@ def try_njit(*args, **kwargs):
     return njit(*args, **kwargs)
 
 
+def has_numba() -> bool:
+    """
+    Check if numba is installed.
+    """
+    try:
+        import numba
+    except ImportError:
+        return False
+    return True
+
+
+def try_njit_or(fallback, *args, **kwargs):
+    """
+    Wrapper around numba.njit that replaces the decorated function if numba is missing
+    - If numba is installed, then we JIT the decorated function
+    - If numba is missing, then we return the `fallback` function instead, eg. a
+      vectorized numpy version, rather than leaving slow python loops untouched!
+    """
+    def _wrapper(func):
+        if has_numba():
+            return try_njit(*args, **kwargs)(func)
+        return fallback
+    return _wrapper
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -26,6 +26,7 @@ from disent.util.lightning.callbacks._callbacks_base import BaseCallbackPeriodic
 from disent.util.lightning.callbacks._callbacks_base import BaseCallbackTimed
 
 from disent.util.lightning.callbacks._callback_print_progress import LoggerProgressCallback
+from disent.util.lightning.callbacks._callback_log_profiler import DataProfilerLoggingCallback
 from disent.util.lightning.callbacks._callback_log_metrics import VaeMetricLoggingCallback
 from disent.util.lightning.callbacks._callback_vis_latents import VaeLatentCycleLoggingCallback
 from disent.util.lightning.callbacks._callback_vis_dists import VaeGtDistsLoggingCallback
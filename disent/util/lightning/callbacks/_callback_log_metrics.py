@@ -22,15 +22,24 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import copy
 import logging
+import multiprocessing
+import queue
 import warnings
+from typing import Callable
+from typing import Iterator
+from typing import List
 from typing import Optional
 from typing import Sequence
+from typing import Tuple
 
 import pytorch_lightning as pl
 
 from disent import registry as R
+from disent.dataset import DisentDataset
 from disent.dataset.data import GroundTruthData
+from disent.metrics.utils import RepresentationBank
 from disent.util.lightning.callbacks._callbacks_base import BaseCallbackPeriodic
 from disent.util.lightning.callbacks._helper import _get_dataset_and_ae_like
 from disent.util.lightning.logger_util import log_metrics
@@ -73,44 +82,89 @@ class VaeMetricLoggingCallback(BaseCallbackPeriodic):
         train_end_metrics: Optional[Sequence[str]] = None,
         every_n_steps: Optional[int] = None,
         begin_first_step: bool = False,
+        bank_max_points: Optional[int] = 20_000,
+        run_async: bool = False,
+        async_queue_size: int = 1,
+        async_queue_policy: str = 'coalesce',
+        async_mp_context: str = 'spawn',
     ):
+        """
+        :param bank_max_points: The maximum number of encoded points that are shared between the metrics
+               computed during each step using a `RepresentationBank`. Set to `None` to disable sharing,
+               each metric then samples and encodes its own points.
+        :param run_async: If enabled, the framework weights are snapshot and the metrics are computed in a background
+               process on the CPU, with its own handle to the dataset. Results are logged with the global_step
+               of the snapshot once they become available. The final metrics still block until they are done.
+        :param async_queue_size: The maximum number of evaluations waiting for the background process.
+        :param async_queue_policy: What to do if the queue is full and the background process has fallen behind,
+               either "skip" the new evaluation, or "coalesce" by replacing the oldest pending evaluation with the new one.
+        :param async_mp_context: The multiprocessing start method used for the background process, "spawn" is safe with CUDA.
+        """
         super().__init__(every_n_steps, begin_first_step)
+        self.bank_max_points = bank_max_points
         self.step_end_metrics = step_end_metrics if step_end_metrics else []
         self.train_end_metrics = train_end_metrics if train_end_metrics else []
         assert isinstance(self.step_end_metrics, list)
         assert isinstance(self.train_end_metrics, list)
         assert self.step_end_metrics or self.train_end_metrics, 'No metrics given to step_end_metrics or train_end_metrics'
+        # background evaluation
+        if async_queue_policy not in ('skip', 'coalesce'):
+            raise KeyError(f'Invalid {async_queue_policy=}, must be one of: "skip", "coalesce"')
+        self.run_async = run_async
+        self.async_queue_size = async_queue_size
+        self.async_queue_policy = async_queue_policy
+        self.async_mp_context = async_mp_context
+        self._evaluator: Optional[_AsyncMetricsEvaluator] = None
 
-    def _compute_metrics_and_log(self, trainer: pl.Trainer, pl_module: pl.LightningModule, metrics: list, is_final=False):
+    def _get_gt_dataset_and_ae_like(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
         # get dataset and vae framework from trainer and module
         dataset, vae = _get_dataset_and_ae_like(trainer, pl_module, unwrap_groundtruth=True)
         # check if we need to skip
         # TODO: dataset needs to be able to handle wrapped datasets!
         if not dataset.is_ground_truth:
             warnings.warn(f'{dataset.__class__.__name__} is not an instance of {GroundTruthData.__name__}. Skipping callback: {self.__class__.__name__}!')
+            return None, None
+        return dataset, vae
+
+    def _compute_metrics_and_log(self, trainer: pl.Trainer, pl_module: pl.LightningModule, metrics: list, is_final=False):
+        dataset, vae = self._get_gt_dataset_and_ae_like(trainer, pl_module)
+        if dataset is None:
             return
-        # get padding amount
-        pad = max(7+len(k) for k in R.METRICS)  # I know this is a magic variable... im just OCD
-        # compute all metrics
-        for metric in metrics:
-            if is_final:
-                log.info(f'| {metric.__name__:<{pad}} - computing...')
-            with Timer() as timer:
-                scores = metric(dataset, lambda x: vae.encode(x.to(vae.device)))
-            metric_results = ' '.join(f'{k}{c.GRY}={c.lMGT}{v:.3f}{c.RST}' for k, v in scores.items())
-            log.info(f'| {metric.__name__:<{pad}} - time{c.GRY}={c.lYLW}{timer.pretty:<9}{c.RST} - {metric_results}')
+        # compute & log all metrics
+        for name, scores in _compute_metrics(dataset, vae, _named_metrics(metrics), is_final=is_final, bank_max_points=self.bank_max_points):
+            _log_scores(trainer.logger, scores, is_final=is_final)
+
+    def _submit_metrics_async(self, trainer: pl.Trainer, pl_module: pl.LightningModule, metrics: list, is_final=False):
+        # start the background process, this needs the dataset
+        if self._evaluator is None:
+            dataset, _ = self._get_gt_dataset_and_ae_like(trainer, pl_module)
+            if dataset is None:
+                return
+            self._evaluator = _AsyncMetricsEvaluator(
+                dataset=dataset,
+                bank_max_points=self.bank_max_points,
+                queue_size=self.async_queue_size,
+                queue_policy=self.async_queue_policy,
+                mp_context=self.async_mp_context,
+            )
+        # snapshot the weights & submit
+        self._evaluator.submit(trainer.global_step, is_final, pl_module, metrics)
 
-            # log to trainer
-            prefix = 'final_metric' if is_final else 'epoch_metric'
-            prefixed_scores = {f'{prefix}/{k}': v for k, v in scores.items()}
-            log_metrics(trainer.logger, _normalized_numeric_metrics(prefixed_scores))
+    def _log_async_results(self, trainer: pl.Trainer, wait: bool = False):
+        if self._evaluator is not None:
+            for step, is_final, name, scores in self._evaluator.poll(wait=wait):
+                _log_scores(trainer.logger, scores, is_final=is_final, step=step)
 
-            # log summary for WANDB
-            # this is kinda hacky... the above should work for parallel coordinate plots
-            wb_log_reduced_summaries(trainer.logger, prefixed_scores, reduction='max')
+    def on_batch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self._log_async_results(trainer)
+        super().on_batch_end(trainer, pl_module)
 
     def do_step(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
         if self.step_end_metrics:
+            if self.run_async:
+                log.debug('Submitting Epoch Metrics...')
+                self._submit_metrics_async(trainer, pl_module, metrics=self.step_end_metrics, is_final=False)
+                return
             log.debug('Computing Epoch Metrics:')
             with Timer() as timer:
                 self._compute_metrics_and_log(trainer, pl_module, metrics=self.step_end_metrics, is_final=False)
@@ -120,8 +174,181 @@ class VaeMetricLoggingCallback(BaseCallbackPeriodic):
         if self.train_end_metrics:
             log.debug('Computing Final Metrics...')
             with Timer() as timer:
-                self._compute_metrics_and_log(trainer, pl_module, metrics=self.train_end_metrics, is_final=True)
+                if self.run_async:
+                    self._submit_metrics_async(trainer, pl_module, metrics=self.train_end_metrics, is_final=True)
+                else:
+                    self._compute_metrics_and_log(trainer, pl_module, metrics=self.train_end_metrics, is_final=True)
             log.debug(f'Computed Final Metrics! {timer.pretty}')
+        # wait for pending evaluations to finish
+        if self._evaluator is not None:
+            self._log_async_results(trainer, wait=True)
+            self._evaluator.close()
+            self._evaluator = None
+
+
+# ========================================================================= #
+# Metric Computation                                                        #
+# ========================================================================= #
+
+
+def _named_metrics(metrics: list) -> List[Tuple[str, Callable]]:
+    # multiprocessing pickles partial functions without their `__dict__`,
+    # so the `__name__` of each metric needs to be sent explicitly
+    return [(metric.__name__, metric) for metric in metrics]
+
+
+def _compute_metrics(dataset: DisentDataset, vae, named_metrics: List[Tuple[str, Callable]], is_final: bool = False, bank_max_points: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    """
+    Compute each of the metrics in turn, yielding the name & scores of each metric once done.
+    """
+    # get padding amount
+    pad = max(7+len(k) for k in R.METRICS)  # I know this is a magic variable... im just OCD
+    # share encoded points between metrics, the encodings are only valid for the current weights
+    representation_function = lambda x: vae.encode(x.to(vae.device))
+    if bank_max_points is not None:
+        representation_function = RepresentationBank(dataset, representation_function, max_points=bank_max_points)
+    # compute all metrics
+    for name, metric in named_metrics:
+        if is_final:
+            log.info(f'| {name:<{pad}} - computing...')
+        if isinstance(representation_function, RepresentationBank):
+            representation_function.rewind()
+        with Timer() as timer:
+            scores = metric(dataset, representation_function)
+        metric_results = ' '.join(f'{k}{c.GRY}={c.lMGT}{v:.3f}{c.RST}' for k, v in scores.items())
+        log.info(f'| {name:<{pad}} - time{c.GRY}={c.lYLW}{timer.pretty:<9}{c.RST} - {metric_results}')
+        yield name, scores
+    # log how much encoding was saved
+    if isinstance(representation_function, RepresentationBank):
+        log.debug(f'| representation bank - encoded{c.GRY}={c.lYLW}{representation_function.num_encoded}{c.RST} drawn{c.GRY}={c.lYLW}{representation_function.num_drawn}{c.RST}')
+
+
+def _log_scores(logger, scores: dict, is_final: bool = False, step: Optional[int] = None):
+    # log to trainer
+    prefix = 'final_metric' if is_final else 'epoch_metric'
+    prefixed_scores = {f'{prefix}/{k}': v for k, v in scores.items()}
+    log_metrics(logger, _normalized_numeric_metrics(prefixed_scores), step=step)
+    # log summary for WANDB
+    # this is kinda hacky... the above should work for parallel coordinate plots
+    wb_log_reduced_summaries(logger, prefixed_scores, reduction='max')
+
+
+# ========================================================================= #
+# Background Metric Computation                                             #
+# ========================================================================= #
+
+
+def _snapshot_framework(pl_module: pl.LightningModule) -> pl.LightningModule:
+    # rebuild the framework on the cpu from its config & weights, instead of copying
+    # the module directly, which would also copy the trainer & dataloaders it references
+    state_dict = {k: v.detach().cpu() for k, v in pl_module.state_dict().items()}
+    snapshot = pl_module.__class__(model=copy.deepcopy(pl_module._model).cpu(), cfg=copy.deepcopy(pl_module.cfg))
+    snapshot.load_state_dict(state_dict)
+    return snapshot.eval()
+
+
+def _async_metrics_worker(dataset: DisentDataset, bank_max_points: Optional[int], tasks, results):
+    """
+    Entry point of the background process. Computes the metrics for each
+    snapshot of the framework, sending back the scores to be logged.
+    - A `None` task stops the worker
+    - A `None` metric name marks the end of an evaluation
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        step, is_final, vae, named_metrics = task
+        try:
+            for name, scores in _compute_metrics(dataset, vae, named_metrics, is_final=is_final, bank_max_points=bank_max_points):
+                results.put((step, is_final, name, scores))
+        except Exception:
+            log.error(f'Failed to compute background metrics for step: {step}', exc_info=True)
+        results.put((step, is_final, None, None))
+
+
+class _AsyncMetricsEvaluator(object):
+    """
+    Compute metrics in a background process, with a bounded queue of pending evaluations.
+    """
+
+    def __init__(self, dataset: DisentDataset, bank_max_points: Optional[int], queue_size: int = 1, queue_policy: str = 'coalesce', mp_context: str = 'spawn'):
+        if queue_size < 1:
+            raise ValueError(f'queue_size must be >= 1, got: {repr(queue_size)}')
+        if queue_policy not in ('skip', 'coalesce'):
+            raise KeyError(f'Invalid {queue_policy=}, must be one of: "skip", "coalesce"')
+        self._queue_policy = queue_policy
+        self._num_pending = 0
+        # start the process
+        ctx = multiprocessing.get_context(mp_context)
+        self._tasks = ctx.Queue(maxsize=queue_size)
+        self._results = ctx.Queue()
+        self._process = ctx.Process(target=_async_metrics_worker, args=(dataset, bank_max_points, self._tasks, self._results), daemon=True)
+        self._process.start()
+
+    @property
+    def num_pending(self) -> int:
+        return self._num_pending
+
+    def submit(self, step: int, is_final: bool, pl_module: pl.LightningModule, metrics: list) -> bool:
+        # skip early to avoid copying the weights
+        if (not is_final) and (self._queue_policy == 'skip') and self._tasks.full():
+            log.warning(f'Skipped background metrics for step: {step}, previous evaluations are still pending.')
+            return False
+        task = (step, is_final, _snapshot_framework(pl_module), _named_metrics(metrics))
+        # never skip the final metrics
+        if is_final:
+            self._tasks.put(task)
+        else:
+            try:
+                self._tasks.put_nowait(task)
+            except queue.Full:
+                if self._queue_policy == 'skip':
+                    log.warning(f'Skipped background metrics for step: {step}, previous evaluations are still pending.')
+                    return False
+                # replace the oldest pending evaluation
+                try:
+                    old_step, *_ = self._tasks.get_nowait()
+                    self._num_pending -= 1
+                    log.warning(f'Coalesced background metrics for step: {old_step} into step: {step}, previous evaluations are still pending.')
+                except queue.Empty:
+                    pass
+                self._tasks.put(task)
+        self._num_pending += 1
+        return True
+
+    def poll(self, wait: bool = False) -> List[Tuple[int, bool, str, dict]]:
+        """
+        Get the scores of all the metrics that have finished computing.
+        - if `wait` is enabled, block until all the pending evaluations are done.
+        """
+        finished = []
+        while True:
+            try:
+                if wait and (self._num_pending > 0):
+                    step, is_final, name, scores = self._results.get(timeout=1.0)
+                else:
+                    step, is_final, name, scores = self._results.get_nowait()
+            except queue.Empty:
+                if wait and (self._num_pending > 0) and self._process.is_alive():
+                    continue
+                if self._num_pending > 0 and not self._process.is_alive():
+                    log.error(f'Background metrics process died, {self._num_pending} pending evaluations were lost.')
+                    self._num_pending = 0
+                break
+            # check if an evaluation is done
+            if name is None:
+                self._num_pending -= 1
+            else:
+                finished.append((step, is_final, name, scores))
+        return finished
+
+    def close(self, timeout: float = 10.0):
+        if self._process.is_alive():
+            self._tasks.put(None)
+            self._process.join(timeout=timeout)
+        if self._process.is_alive():
+            self._process.terminate()
 
 
 # ========================================================================= #
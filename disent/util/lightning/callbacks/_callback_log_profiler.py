@@ -0,0 +1,92 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+import logging
+from typing import Optional
+
+import pytorch_lightning as pl
+
+from disent.util.lightning.callbacks._callbacks_base import BaseCallbackPeriodic
+from disent.util.lightning.logger_util import log_metrics
+from disent.util.profiling import StageProfiler
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Data Pipeline Profiling                                                   #
+# ========================================================================= #
+
+
+def _find_train_profiler(trainer: pl.Trainer) -> Optional[StageProfiler]:
+    # pytorch lightning wraps the dataloader in a `CombinedLoader`
+    dataloader = getattr(trainer, 'train_dataloader', None)
+    dataloader = getattr(dataloader, 'loaders', dataloader)
+    dataset = getattr(dataloader, 'dataset', None)
+    return getattr(dataset, 'profiler', None)
+
+
+class DataProfilerLoggingCallback(BaseCallbackPeriodic):
+
+    """
+    Periodically log the per-stage timings of the data pipeline recorded by a
+    `StageProfiler`, eg. from `disent.dataset.make_data_profiler`. If the profiler
+    is not given, it is obtained from the `DisentDataset` of the train dataloader.
+    - The statistics are aggregated across all the DataLoader workers
+    - If `reset` is enabled, each log only covers the steps since the previous log
+    """
+
+    def __init__(
+        self,
+        profiler: Optional[StageProfiler] = None,
+        every_n_steps: Optional[int] = None,
+        begin_first_step: bool = False,
+        reset: bool = True,
+        log_level: Optional[int] = logging.INFO,
+    ):
+        super().__init__(every_n_steps=every_n_steps, begin_first_step=begin_first_step)
+        self._profiler = profiler
+        self._reset = reset
+        self._log_level = log_level
+
+    def do_step(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        profiler = self._profiler if (self._profiler is not None) else _find_train_profiler(trainer)
+        if profiler is None:
+            log.warning('no data profiler was found, make sure the `DisentDataset` used for training was created with a `profiler`')
+            return
+        # log the statistics
+        summary = profiler.summary()
+        if summary:
+            log_metrics(trainer.logger, {f'data_profile/{stage}/{k}': v for stage, stats in summary.items() for k, v in stats.items()})
+            if self._log_level is not None:
+                log.log(self._log_level, f'data pipeline profile at step {trainer.global_step}:\n{profiler.pretty()}')
+        # reset the statistics
+        if self._reset:
+            profiler.reset()
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
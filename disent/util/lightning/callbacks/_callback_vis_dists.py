@@ -86,10 +86,16 @@ _VAE_DIST_NAMES = ('x', 'z', 'kl', 'x_recon')
 
 
 @torch.no_grad()
-def _get_dists_ae(ae: Ae, x_a: torch.Tensor, x_b: torch.Tensor):
-    # feed forware
-    z_a, z_b = ae.encode(x_a), ae.encode(x_b)
-    r_a, r_b = ae.decode(z_a), ae.decode(z_b)
+def _encode_ae(ae: Ae, x: torch.Tensor):
+    # feed forward
+    z = ae.encode(x)
+    r = ae.decode(z)
+    return x, z, r
+
+
+@torch.no_grad()
+def _get_dists_ae(ae: Ae, feats_a, feats_b):
+    (x_a, z_a, r_a), (x_b, z_b, r_b) = feats_a, feats_b
     # distances
     return [
         ae.recon_handler.compute_pairwise_loss(x_a, x_b),
@@ -99,12 +105,19 @@ def _get_dists_ae(ae: Ae, x_a: torch.Tensor, x_b: torch.Tensor):
 
 
 @torch.no_grad()
-def _get_dists_vae(vae: Vae, x_a: torch.Tensor, x_b: torch.Tensor):
+def _encode_vae(vae: Vae, x: torch.Tensor):
+    # feed forward, the posterior is rebuilt from its parameters when computing distances
+    z_post, z_prior = vae.encode_dists(x)
+    z = z_post.mean
+    r = vae.decode(z)
+    return x, z, r, type(z_post), z_post.loc, z_post.scale
+
+
+@torch.no_grad()
+def _get_dists_vae(vae: Vae, feats_a, feats_b):
     from torch.distributions import kl_divergence
-    # feed forward
-    (z_post_a, z_prior_a), (z_post_b, z_prior_b) = vae.encode_dists(x_a), vae.encode_dists(x_b)
-    z_a, z_b = z_post_a.mean, z_post_b.mean
-    r_a, r_b = vae.decode(z_a), vae.decode(z_b)
+    (x_a, z_a, r_a, dist_cls, loc_a, scale_a), (x_b, z_b, r_b, _, loc_b, scale_b) = feats_a, feats_b
+    z_post_a, z_post_b = dist_cls(loc=loc_a, scale=scale_a), dist_cls(loc=loc_b, scale=scale_b)
     # dists
     kl_ab = 0.5 * kl_divergence(z_post_a, z_post_b) + 0.5 * kl_divergence(z_post_b, z_post_a)
     # distances
@@ -116,28 +129,56 @@ def _get_dists_vae(vae: Vae, x_a: torch.Tensor, x_b: torch.Tensor):
     ]
 
 
-def _get_dists_fn(model: Ae) -> Tuple[Optional[Tuple[str, ...]], Optional[Callable[[object, object], Sequence[Sequence[float]]]]]:
-    # get aggregate function
+def _get_dists_fn(model: Ae) -> Tuple[Optional[Tuple[str, ...]], Optional[Callable[[torch.Tensor], object]], Optional[Callable[[object, object], Sequence[torch.Tensor]]]]:
+    # get encode & aggregate functions
     if isinstance(model, Vae):
-        dists_names, dists_fn = _VAE_DIST_NAMES, wrapped_partial(_get_dists_vae, model)
+        dists_names, encode_fn, dists_fn = _VAE_DIST_NAMES, wrapped_partial(_encode_vae, model), wrapped_partial(_get_dists_vae, model)
     elif isinstance(model, Ae):
-        dists_names, dists_fn = _AE_DIST_NAMES, wrapped_partial(_get_dists_ae, model)
+        dists_names, encode_fn, dists_fn = _AE_DIST_NAMES, wrapped_partial(_encode_ae, model), wrapped_partial(_get_dists_ae, model)
     else:
-        dists_names, dists_fn = None, None
-    return dists_names, dists_fn
+        dists_names, encode_fn, dists_fn = None, None, None
+    return dists_names, encode_fn, dists_fn
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Features are a tensor, or a tuple of tensors and constants, where the     #
+# first dimension of each tensor corresponds to the observations.           #
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+def _feats_index(feats, idxs):
+    if isinstance(feats, tuple):
+        return tuple((f[idxs] if isinstance(f, torch.Tensor) else f) for f in feats)
+    return feats[idxs]
+
+
+def _feats_cat(feats_list):
+    if isinstance(feats_list[0], tuple):
+        return tuple((torch.cat(fs, dim=0) if isinstance(fs[0], torch.Tensor) else fs[0]) for fs in zip(*feats_list))
+    return torch.cat(feats_list, dim=0)
 
 
 @torch.no_grad()
-def _collect_dists_subbatches(dists_fn: Callable[[object, object], Sequence[Sequence[float]]], batch: torch.Tensor, i_a: np.ndarray, i_b: np.ndarray, batch_size: int = 64):
-    # feed forward
+def _encode_subbatches(encode_fn: Optional[Callable[[torch.Tensor], object]], batch: torch.Tensor, batch_size: int = 64):
+    # feed forward each observation once
+    if encode_fn is None:
+        return batch
+    return _feats_cat([encode_fn(x) for x in torch.split(batch, batch_size, dim=0)])
+
+
+@torch.no_grad()
+def _collect_dists_subbatches(dists_fn: Callable[[object, object], Sequence[torch.Tensor]], feats, num_traversals: int, traversal_len: int, i_a: np.ndarray, i_b: np.ndarray, batch_size: int = 64) -> List[torch.Tensor]:
+    # compute the distances between the pairs of each traversal, the features of
+    # the traversals are concatenated, with each traversal of length `traversal_len`
+    # - returns a list of dists, each with shape (num_traversals, len(i_a))
+    offsets = torch.arange(num_traversals)[:, None] * traversal_len
     results = []
-    for idxs in chunked(np.stack([i_a, i_b], axis=-1), chunk_size=batch_size):
-        ia, ib = idxs.T
-        x_a, x_b = batch[ia], batch[ib]
-        # feed forward
-        data = dists_fn(x_a, x_b)
-        results.append(data)
-    return [torch.cat(r, dim=0) for r in zip(*results)]
+    for idxs in chunked(np.stack([i_a, i_b], axis=-1), chunk_size=max(1, batch_size // num_traversals)):
+        ia, ib = torch.from_numpy(idxs.T)
+        # feed forward -- (len(names), num_traversals * len(ia))
+        data = dists_fn(_feats_index(feats, (offsets + ia).reshape(-1)), _feats_index(feats, (offsets + ib).reshape(-1)))
+        results.append([d.reshape(num_traversals, len(idxs)) for d in data])
+    return [torch.cat(r, dim=1) for r in zip(*results)]
 
 
 def _compute_and_collect_dists(
@@ -149,6 +190,7 @@ def _compute_and_collect_dists(
     include_gt_factor_dists: bool = True,
     transform_batch: Callable[[object], object] = None,
     data_mode: str = 'input',
+    encode_fn: Callable[[torch.Tensor], object] = None,
 ) -> Tuple[Tuple[str, ...], List[List[np.ndarray]]]:
     assert traversal_repeats > 0
     gt_data = dataset.gt_data
@@ -156,31 +198,36 @@ def _compute_and_collect_dists(
     f_grid = []
     # generate
     for f_idx, f_size in enumerate(gt_data.factor_sizes):
-        # save for the current factor (traversal_repeats, len(names), len(i_a))
+        # save for the current factor (len(names), traversal_repeats, len(i_a))
         f_dists = []
         # upper triangle excluding diagonal
         i_a, i_b = np.triu_indices(f_size, k=1)
-        # repeat over random traversals
-        for i in range(traversal_repeats):
-            # get random factor traversal
-            factors = gt_data.sample_random_factor_traversal(f_idx=f_idx)
-            indices = gt_data.pos_to_idx(factors)
+        # get random factor traversals (traversal_repeats, f_size, num_factors)
+        # - this samples the same traversals as calling `sample_random_factor_traversal` repeatedly
+        traversals = gt_data.sample_random_factor_traversals(traversal_repeats, f_idxs=f_idx)
+        # group traversals so that each forward pass is close to the batch size
+        group_size = max(1, batch_size // f_size)
+        for i in range(0, traversal_repeats, group_size):
+            factors = traversals[i:i+group_size]
+            indices = gt_data.pos_to_idx(factors).reshape(-1)
             # load data
             batch = dataset.dataset_batch_from_indices(indices, data_mode)
             if transform_batch is not None:
                 batch = transform_batch(batch)
-            # feed forward & compute dists -- (len(names), len(i_a))
-            dists = _collect_dists_subbatches(dists_fn=dists_fn, batch=batch, i_a=i_a, i_b=i_b, batch_size=batch_size)
+            # feed forward each observation once & compute dists -- (len(names), len(factors), len(i_a))
+            feats = _encode_subbatches(encode_fn=encode_fn, batch=batch, batch_size=batch_size)
+            dists = _collect_dists_subbatches(dists_fn=dists_fn, feats=feats, num_traversals=len(factors), traversal_len=f_size, i_a=i_a, i_b=i_b, batch_size=batch_size)
             assert len(dists) == len(dists_names)
             # distances
             f_dists.append(dists)
         # aggregate all dists into distances matrices for current factor
         f_dmats = [
-            _to_dmat(size=f_size, i_a=i_a, i_b=i_b, dists=torch.stack(dists, dim=0).mean(dim=0))
+            _to_dmat(size=f_size, i_a=i_a, i_b=i_b, dists=torch.cat(dists, dim=0).mean(dim=0))
             for dists in zip(*f_dists)
         ]
         # handle factors
         if include_gt_factor_dists:
+            factors = traversals[-1]
             i_dmat = _to_dmat(size=f_size, i_a=i_a, i_b=i_b, dists=np.abs(factors[i_a] - factors[i_b]).sum(axis=-1))
             f_dmats = [i_dmat, *f_dmats]
         # append data
@@ -202,7 +249,16 @@ def compute_factor_distances(
     transform_batch: Callable[[object], object] = None,
     seed: Optional[int] = 777,
     data_mode: str = 'input',
+    encode_fn: Callable[[torch.Tensor], object] = None,
 ) -> Tuple[Tuple[str, ...], List[List[np.ndarray]]]:
+    """
+    Compute the average distance matrices between the observations of random traversals along each factor.
+    - `encode_fn(batch)` is called once for each observation in the traversals, batched over the traversals of
+      a factor. It should return a tensor, or a tuple of tensors & constants, with the first dimension of each
+      tensor corresponding to the observations. If not given, the batch itself is used.
+    - `dists_fn(feats_a, feats_b)` is called on the features of all the pairs of observations, and should return
+      a list of distances, one for each of `dists_names`, each with shape (num_pairs,)
+    """
     # log this callback
     gt_data = dataset.gt_data
     log.info(f'| {gt_data.name} - computing factor distances...')
@@ -217,6 +273,7 @@ def compute_factor_distances(
             include_gt_factor_dists=include_gt_factor_dists,
             transform_batch=transform_batch,
             data_mode=data_mode,
+            encode_fn=encode_fn,
         )
     # log this callback!
     log.info(f'| {gt_data.name} - computed factor distances! time{c.GRY}={c.lYLW}{timer.pretty:<9}{c.RST}')
@@ -288,7 +345,7 @@ class VaeGtDistsLoggingCallback(BaseCallbackPeriodic):
             log.warning(f'cannot run {self.__class__.__name__} over non-ground-truth data, skipping!')
             return
         # get aggregate function
-        dists_names, dists_fn = _get_dists_fn(vae)
+        dists_names, encode_fn, dists_fn = _get_dists_fn(vae)
         if (dists_names is None) or (dists_fn is None):
             log.warning(f'cannot run {self.__class__.__name__}, unsupported model type: {type(vae)}, must be {Ae.__name__} or {Vae.__name__}')
             return
@@ -303,6 +360,7 @@ class VaeGtDistsLoggingCallback(BaseCallbackPeriodic):
             transform_batch=lambda batch: batch.to(vae.device),
             seed=self._seed,
             data_mode='input',
+            encode_fn=encode_fn,
         )
         # plot these results
         fig, axs = plt_factor_distances(
@@ -23,6 +23,8 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import logging
+import os
+import tempfile
 from typing import Literal
 from typing import Optional
 from typing import Tuple
@@ -39,10 +41,14 @@ from disent.util.lightning.callbacks._callbacks_base import BaseCallbackPeriodic
 from disent.util.lightning.callbacks._helper import _get_dataset_and_ae_like
 from disent.util.lightning.logger_util import wb_log_metrics
 from disent.util.seeds import TempNumpySeed
+from disent.util.strings.fmt import bytes_to_human
 from disent.util.visualize.vis_img import torch_to_images
-from disent.util.visualize.vis_latents import make_decoded_latent_cycles
+from disent.util.visualize.vis_latents import iter_decoded_latent_cycles
+from disent.util.visualize.vis_latents import make_latent_zs_cycles
+from disent.util.visualize.vis_util import iter_animated_image_grid
 from disent.util.visualize.vis_util import make_animated_image_grid
 from disent.util.visualize.vis_util import make_image_grid
+from disent.util.visualize.vis_util import write_video
 
 
 log = logging.getLogger(__name__)
@@ -101,6 +107,34 @@ def get_vis_min_max(
     return recon_min, recon_max
 
 
+def _get_decode_batch_size(
+    cycles_shape: Tuple[int, int],
+    obs_shape: Tuple[int, ...],
+    obs_itemsize: int,
+    batch_size: Optional[int] = None,
+    max_memory_mb: Optional[float] = None,
+    pad: int = 4,
+) -> Tuple[int, int]:
+    # the number of frames that need to be decoded
+    z_size, num_frames = cycles_shape
+    num_total = z_size * num_frames
+    batch_size = num_total if (batch_size is None) else max(1, min(batch_size, num_total))
+    # buffers: the stills as uint8 rgb images, the image grid, a single frame of
+    # the animation which is smaller than the image grid, and a batch of decoded frames
+    (H, W) = obs_shape[-2:]
+    grid_bytes = ((H + pad) * z_size + pad) * ((W + pad) * num_frames + pad) * 3
+    fixed_bytes = (num_total * H * W * 3) + 2 * grid_bytes
+    decode_bytes = int(np.prod(obs_shape)) * obs_itemsize
+    # limit the batch size
+    if max_memory_mb is not None:
+        budget = int(max_memory_mb * 1024**2) - fixed_bytes
+        if budget < decode_bytes:
+            log.warning(f'latent cycle visualisation requires at least: {bytes_to_human(fixed_bytes + decode_bytes)}, exceeding the limit of: {max_memory_mb}MiB')
+        batch_size = max(1, min(batch_size, budget // decode_bytes))
+    # done
+    return batch_size, fixed_bytes + batch_size * decode_bytes
+
+
 # ========================================================================= #
 # Latent Visualisation Callback                                             #
 # ========================================================================= #
@@ -126,6 +160,9 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
         recon_max: MinMaxHint = None,    # scale data in this range [min, max] to [0, 1]
         recon_mean: MeanStdHint = None,  # automatically converted to min & max [(0-mean)/std, (1-mean)/std], assuming original range of values is [0, 1]
         recon_std: MeanStdHint = None,   # automatically converted to min & max [(0-mean)/std, (1-mean)/std], assuming original range of values is [0, 1]
+        # memory usage
+        decode_batch_size: Optional[int] = None,  # maximum number of frames decoded at once, all at once if None
+        max_memory_mb: Optional[float] = 256,     # limit the decoding batch size so that the visualisation buffers fit in this budget
     ):
         super().__init__(every_n_steps, begin_first_step)
         self._seed = seed
@@ -137,6 +174,8 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
         self._wandb_mode = wandb_mode
         self._num_frames = num_frames
         self._fps = wandb_fps
+        self._decode_batch_size = decode_batch_size
+        self._max_memory_mb = max_memory_mb
         # checks
         assert wandb_mode in {'img', 'vid', 'both'}, f'invalid wandb_mode={repr(wandb_mode)}, must be one of: ("img", "vid", "both")'
         # normalize
@@ -155,16 +194,22 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
             return
 
         # feed forward and visualise everything!
-        stills, animation, image = self.get_visualisations(trainer, pl_module)
+        # - the animation is not stacked in memory, frames are streamed to the video instead
+        stills, _, image = self.get_visualisations(trainer, pl_module, return_frames=False)
 
         # log video -- none, img, vid, both
-        # TODO: there might be a memory leak in making the video below? Or there could be one in the actual DSPRITES dataset? memory usage seems to be very high and increase on this dataset.
         if self._log_wandb:
             import wandb
-            wandb_items = {}
-            if self._wandb_mode in ('img', 'both'): wandb_items[f'{self._mode}_img'] = wandb.Image(image)
-            if self._wandb_mode in ('vid', 'both'): wandb_items[f'{self._mode}_vid'] = wandb.Video(np.transpose(animation, [0, 3, 1, 2]), fps=self._fps, format='mp4'),
-            wb_log_metrics(trainer.logger, wandb_items)
+            with tempfile.TemporaryDirectory(prefix='disent_latent_cycle_') as temp_dir:
+                wandb_items = {}
+                if self._wandb_mode in ('img', 'both'):
+                    wandb_items[f'{self._mode}_img'] = wandb.Image(image)
+                if self._wandb_mode in ('vid', 'both'):
+                    path = os.path.join(temp_dir, f'{self._mode}_vid.mp4')
+                    write_video(iter_animated_image_grid(stills, pad=4, border=True, bg_color=None), path, fps=self._fps)
+                    wandb_items[f'{self._mode}_vid'] = wandb.Video(path, format='mp4')
+                # the media files are copied when they are logged
+                wb_log_metrics(trainer.logger, wandb_items)
 
         # log locally
         if self._plt_show:
@@ -179,6 +224,7 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
         self,
         trainer_or_dataset: Union[pl.Trainer, DisentDataset],
         pl_module: pl.LightningModule,
+        return_frames: bool = True,
     ) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray, torch.Tensor, torch.Tensor]]:
         return self.generate_visualisations(
             trainer_or_dataset,
@@ -191,6 +237,9 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
             recon_max=self._recon_max,
             recon_mean=None,
             recon_std=None,
+            decode_batch_size=self._decode_batch_size,
+            max_memory_mb=self._max_memory_mb,
+            return_frames=return_frames,
         )
 
     @classmethod
@@ -207,7 +256,17 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
         recon_max: MinMaxHint = None,
         recon_mean: MeanStdHint = None,
         recon_std: MeanStdHint = None,
+        # memory usage
+        decode_batch_size: Optional[int] = None,
+        max_memory_mb: Optional[float] = None,
+        return_frames: bool = True,
     ) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray, torch.Tensor, torch.Tensor]]:
+        """
+        Decode latent cycles along each latent dimension, returning the stills (z_size, num_frames, H, W, C),
+        the animation frames (num_frames, H', W', C) or None if `return_frames=False`, and the image grid.
+        - The latent cycles are decoded in batches, with the batch size limited by `decode_batch_size`
+          and so that the decoded frames, converted stills and animation frame fit in `max_memory_mb`
+        """
         # normalize
         recon_min, recon_max = get_vis_min_max(
             recon_min=recon_min,
@@ -247,14 +306,22 @@ class VaeLatentCycleLoggingCallback(BaseCallbackPeriodic):
             if recon_max is None: recon_max = float(torch.amax(batch).cpu())
             log.info(f'auto visualisation min: {recon_min} and max: {recon_max} obtained from {len(batch)} samples')
 
-        # produce latent cycle still images & convert them to images
-        stills = make_decoded_latent_cycles(vae.decode, zs_mean, zs_logvar, mode=mode, num_animations=1, num_frames=num_frames, decoder_device=vae.device)[0]
-        stills = torch_to_images(stills, in_dims='CHW', out_dims='HWC', in_min=recon_min, in_max=recon_max, always_rgb=True, to_numpy=True)
+        # produce latent cycles (z_size, num_frames, z_size)
+        zs = make_latent_zs_cycles(zs_mean, zs_logvar, mode=mode, num_animations=1, num_frames=num_frames)[0]
+        # get the decoding batch size, limited by the memory budget
+        decode_batch_size, peak_bytes = _get_decode_batch_size(zs.shape[:2], obs_shape=batch.shape[1:], obs_itemsize=batch.element_size(), batch_size=decode_batch_size, max_memory_mb=max_memory_mb)
+        # decode the latent cycles in batches & convert them to still images (z_size, num_frames, H, W, C)
+        stills = np.concatenate([
+            torch_to_images(x_recon, in_dims='CHW', out_dims='HWC', in_min=recon_min, in_max=recon_max, always_rgb=True, to_numpy=True)
+            for x_recon in iter_decoded_latent_cycles(vae.decode, zs, batch_size=decode_batch_size, decoder_device=vae.device)
+        ], axis=0)
+        stills = stills.reshape(*zs.shape[:2], *stills.shape[1:])
+        log.info(f'latent cycle visualisation decoded {zs.shape[0] * zs.shape[1]} frames in batches of {decode_batch_size}, with estimated peak buffer memory: {bytes_to_human(peak_bytes)}')
 
         # generate the video frames and image grid from the stills
         # - TODO: this needs to be fixed to not use logvar, but rather the representations or distributions themselves
         # - TODO: should this not use `visualize_dataset_traversal`?
-        frames = make_animated_image_grid(stills, pad=4, border=True, bg_color=None)
+        frames = make_animated_image_grid(stills, pad=4, border=True, bg_color=None) if return_frames else None
         image = make_image_grid(stills.reshape(-1, *stills.shape[2:]), num_cols=stills.shape[1], pad=4, border=True, bg_color=None)
 
         # done
@@ -45,14 +45,15 @@ log = logging.getLogger(__name__)
 # ========================================================================= #
 
 
-def log_metrics(logger: Optional[LightningLoggerBase], metrics_dct: dict):
+def log_metrics(logger: Optional[LightningLoggerBase], metrics_dct: dict, step: Optional[int] = None):
     """
      Log the given values to the given logger.
      - warn the user if something goes wrong
+     - the step can be specified if the values were computed at an earlier step
     """
     if logger:
         try:
-            logger.log_metrics(metrics_dct)
+            logger.log_metrics(metrics_dct, step=step)
         except:
             warnings.warn(f'Failed to log metrics: {repr(metrics_dct)}')
     else:
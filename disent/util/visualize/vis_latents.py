@@ -24,6 +24,8 @@
 
 import logging
 from typing import Callable
+from typing import Iterator
+from typing import Optional
 
 import numpy as np
 import torch
@@ -127,6 +129,39 @@ def make_latent_zs_cycle(
 # ========================================================================= #
 
 
+def make_latent_zs_cycles(
+    z_means: torch.Tensor,
+    z_logvars: torch.Tensor,
+    mode: str = 'minmax_interval_cycle',
+    num_animations: int = 4,
+    num_frames: int = 20,
+) -> torch.Tensor:
+    # generate the latent cycles for every animation and latent dimension
+    zs = [
+        [make_latent_zs_cycle(z_means[i], z_means, z_logvars, z_idx, num_frames, mode=mode) for z_idx in range(z_means.shape[1])]
+        for i in range(num_animations)
+    ]
+    # (num_animations, z_size, num_frames, z_size)
+    return torch.stack([torch.stack(z_cycles, dim=0) for z_cycles in zs], dim=0)
+
+
+@torch.no_grad()
+def iter_decoded_latent_cycles(
+    decoder_func: Callable[[torch.Tensor], torch.Tensor],
+    zs: torch.Tensor,
+    batch_size: Optional[int] = None,
+    decoder_device=None,
+) -> Iterator[torch.Tensor]:
+    """
+    Decode the flattened latent cycles from `make_latent_zs_cycles` in
+    batches, yielding chunks of the decoded frames (B, C, H, W) in order.
+    - if `batch_size` is None, all the frames are decoded at once
+    """
+    zs = zs.reshape(-1, zs.shape[-1])
+    for z in torch.split(zs, batch_size or len(zs), dim=0):
+        yield decoder_func(torch.as_tensor(z, device=decoder_device))
+
+
 # TODO: this should be moved into the VAE and AE classes
 def make_decoded_latent_cycles(
     decoder_func: Callable[[torch.Tensor], torch.Tensor],
@@ -136,19 +171,13 @@ def make_decoded_latent_cycles(
     num_animations: int = 4,
     num_frames: int = 20,
     decoder_device=None,
+    batch_size: Optional[int] = None,
 ) -> torch.Tensor:
-    # generate multiple latent traversal visualisations
-    animations = []
-    for i in range(num_animations):
-        frames = []
-        for z_idx in range(z_means.shape[1]):
-            z = make_latent_zs_cycle(z_means[i], z_means, z_logvars, z_idx, num_frames, mode=mode)
-            z = torch.as_tensor(z, device=decoder_device)
-            frames.append(decoder_func(z))
-        animations.append(torch.stack(frames, dim=0))
-    animations = torch.stack(animations, dim=0)
+    # generate multiple latent traversal visualisations, decoding all the cycles in one or a few batches
+    zs = make_latent_zs_cycles(z_means, z_logvars, mode=mode, num_animations=num_animations, num_frames=num_frames)
+    frames = torch.cat(list(iter_decoded_latent_cycles(decoder_func, zs, batch_size=batch_size, decoder_device=decoder_device)), dim=0)
     # return everything
-    return animations  # (num_animations, z_size, num_frames, C, H, W)
+    return frames.reshape(*zs.shape[:3], *frames.shape[1:])  # (num_animations, z_size, num_frames, C, H, W)
 
 
 # ========================================================================= #
@@ -25,6 +25,8 @@
 import logging
 import warnings
 from functools import lru_cache
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Sequence
@@ -103,14 +105,38 @@ def make_animated_image_grid(list_of_animated_images: Sequence[np.ndarray], pad:
     :param num_cols: the number of output columns in the grid. None for auto square, -1 for rows==1, or > 0 for that many cols.
     :return: animated output image: (F, H', W') or (F, H', W', C)
     """
+    return to_numpy(list(iter_animated_image_grid(list_of_animated_images, pad=pad, border=border, bg_color=bg_color, num_cols=num_cols)))
+
+
+def iter_animated_image_grid(list_of_animated_images: Sequence[np.ndarray], pad: int = 8, border: bool = True, bg_color=None, num_cols: Optional[int] = None) -> Iterator[np.ndarray]:
+    """
+    Iterable version of `make_animated_image_grid` that yields each frame of the
+    animation in turn, so that frames can be streamed without stacking them.
+    :return: frames of the animated output image: (H', W') or (H', W', C)
+    """
     # first channel is the image (I)
     # second channel is the frame (F)
     # third, fourth, fifth channels are the (H, W, C)
     # -- (I, F, H, W, C)
-    frames = []
     for list_of_images in zip(*list_of_animated_images):
-        frames.append(make_image_grid(list_of_images, pad=pad, border=border, bg_color=bg_color, num_cols=num_cols))
-    return to_numpy(frames)
+        yield make_image_grid(list_of_images, pad=pad, border=border, bg_color=bg_color, num_cols=num_cols)
+
+
+def write_video(frames: Iterable[np.ndarray], path: str, fps: int = 4) -> int:
+    """
+    Encode frames to an mp4 video one at a time, the frames are never stacked in memory.
+    - frames should be uint8 images with shape (H, W, C) or (H, W)
+    - requires `imageio` and `imageio-ffmpeg`
+    :return: the number of frames written
+    """
+    import imageio
+    count = 0
+    # macro_block_size=2, libx264 requires even image sizes
+    with imageio.get_writer(path, format='FFMPEG', mode='I', fps=fps, codec='libx264', macro_block_size=2) as writer:
+        for frame in frames:
+            writer.append_data(frame)
+            count += 1
+    return count
 
 
 # ========================================================================= #
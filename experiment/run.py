@@ -24,6 +24,7 @@
 
 import logging
 import os
+from collections import defaultdict
 from datetime import datetime
 from typing import Callable
 from typing import Optional
@@ -42,6 +43,7 @@ from pytorch_lightning.loggers import LightningLoggerBase
 
 import disent.registry as R
 from disent.frameworks import DisentFramework
+from disent.util.lightning.callbacks import DataProfilerLoggingCallback
 from disent.util.lightning.callbacks import VaeMetricLoggingCallback
 from disent.util.seeds import seed
 from disent.util.strings import colors as c
@@ -149,6 +151,13 @@ def hydra_get_callbacks(cfg) -> list:
     return callbacks
 
 
+def hydra_get_profiler_callbacks(cfg) -> list:
+    # the profiler is obtained from the train dataloader
+    if not cfg.datamodule.get('profile_data', False):
+        return []
+    return [DataProfilerLoggingCallback(every_n_steps=cfg.datamodule.get('profile_every_n_steps', 500))]
+
+
 def hydra_get_metric_callbacks(cfg) -> list:
     # TODO: simplify this, make better use of the config!
     callbacks = []
@@ -157,9 +166,12 @@ def hydra_get_metric_callbacks(cfg) -> list:
     default_on_final         = cfg.metrics.default_on_final
     default_on_train         = cfg.metrics.default_on_train
     default_begin_first_step = cfg.metrics.default_begin_first_step
+    run_async                = cfg.metrics.get('run_async', False)
     # get metrics
     metric_list = cfg.metrics.metric_list
     assert isinstance(metric_list, (list, ListConfig)), f'`metrics.metric_list` is not a list, got: {type(metric_list)}'
+    # group metrics with the same schedule so that they can share encoded representations
+    grouped_metrics = defaultdict(lambda: ([], []))
     # get metrics
     for metric in metric_list:
         assert isinstance(metric, (dict, DictConfig)), f'entry in metric list is not a dictionary, got type: {type(metric)} or value: {repr(metric)}'
@@ -170,15 +182,20 @@ def hydra_get_metric_callbacks(cfg) -> list:
         # check values
         assert isinstance(metric, (dict, DictConfig)), f'settings for entry in metric list is not a dictionary, got type: {type(settings)} or value: {repr(settings)}'
         # make metrics
-        train_metric = [R.METRICS[name].compute_fast] if settings.get('on_train', default_on_train) else None
-        final_metric = [R.METRICS[name].compute]      if settings.get('on_final', default_on_final) else None
-        # add the metric callback
-        if final_metric or train_metric:
+        train_metrics, final_metrics = grouped_metrics[(settings.get('every_n_steps', default_every_n_steps), settings.get('begin_first_step', default_begin_first_step))]
+        if settings.get('on_train', default_on_train):
+            train_metrics.append(R.METRICS[name].compute_fast)
+        if settings.get('on_final', default_on_final):
+            final_metrics.append(R.METRICS[name].compute)
+    # add the metric callbacks
+    for (every_n_steps, begin_first_step), (train_metrics, final_metrics) in grouped_metrics.items():
+        if final_metrics or train_metrics:
             callbacks.append(VaeMetricLoggingCallback(
-                step_end_metrics  = train_metric,
-                train_end_metrics = final_metric,
-                every_n_steps     = settings.get('every_n_steps', default_every_n_steps),
-                begin_first_step  = settings.get('begin_first_step', default_begin_first_step),
+                step_end_metrics  = train_metrics,
+                train_end_metrics = final_metrics,
+                every_n_steps     = every_n_steps,
+                begin_first_step  = begin_first_step,
+                run_async         = run_async,
             ))
     return callbacks
 
@@ -225,6 +242,9 @@ def hydra_make_datamodule(cfg):
         # from: framework.meta
         return_indices        = cfg.framework.meta.get('requires_indices', False),
         return_factors        = cfg.framework.meta.get('requires_factors', False),
+        # from: datamodule
+        profile_data          = cfg.datamodule.get('profile_data', False),
+        transform_after_collate = cfg.datamodule.get('transform_after_collate', False),
     )
 
 # ========================================================================= #
@@ -306,6 +326,7 @@ def action_train(cfg: DictConfig):
         callbacks=[
             *hydra_get_callbacks(cfg),
             *hydra_get_metric_callbacks(cfg),
+            *hydra_get_profiler_callbacks(cfg),
             ModelSummary(max_depth=2),  # override default ModelSummary
         ],
         # additional kwargs from the config
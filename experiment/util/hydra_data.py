@@ -32,8 +32,10 @@ import hydra
 import torch.utils.data
 import pytorch_lightning as pl
 from omegaconf import DictConfig
+from torch.utils.data.dataloader import default_collate
 
 from disent.dataset import DisentDataset
+from disent.dataset import make_data_profiler
 from disent.dataset.transform import DisentDatasetTransform
 
 
@@ -96,6 +98,8 @@ class HydraDataModule(pl.LightningDataModule):
         prepare_data_per_node: bool = True,                  # DataHooks.prepare_data_per_node
         return_indices: bool = False,                        # = framework.meta.requires_indices
         return_factors: bool = False,                        # = framework.meta.requires_factors
+        profile_data: bool = False,                          # = datamodule.profile_data
+        transform_after_collate: bool = False,               # = datamodule.transform_after_collate
     ):
         super().__init__()
         # OVERRIDE:
@@ -110,18 +114,35 @@ class HydraDataModule(pl.LightningDataModule):
         self.input_transform = hydra.utils.instantiate(augment)
         assert (self.input_transform is None) or callable(self.input_transform)  # should be: `Callable[[torch.Tensor], torch.Tensor]`
         # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
+        # batch_transform: workers only apply the uint8 part of the transform, the conversion
+        # to float32 is applied to the collated batch by the framework, usually on the GPU.
+        # - this reduces the size of batches sent from workers by 4x, the results are the same.
+        # - only the training dataloader is split, `data_transform` is kept for callbacks.
+        self._worker_transform = self.data_transform
+        self._batch_transform = None
+        if transform_after_collate:
+            if not hasattr(self.data_transform, 'split_u8'):
+                raise TypeError(f'`transform_after_collate=True` requires a transform that can be split, eg. `ToImgTensorF32`, got: {repr(self.data_transform)}')
+            if (self.input_transform is not None) and (not augment_on_gpu):
+                raise ValueError('`transform_after_collate=True` requires `augment_on_gpu=True` when an augment is used, augments expect float32 inputs')
+            self._worker_transform, self._batch_transform = self.data_transform.split_u8()
+        # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
         # batch_augment: augments transformed data for inputs, should be applied across a batch
         # which version of the dataset we need to use if GPU augmentation is enabled or not.
         # - corresponds to below in train_dataloader()
         if augment_on_gpu:
-            self._gpu_batch_augment = DisentDatasetTransform(transform=self.input_transform)
+            self._gpu_batch_augment = DisentDatasetTransform(transform=self.input_transform, transform_obs=self._batch_transform)
             warnings.warn('`augment_on_gpu=True` is outdated and may no longer be equivalent to `augment_on_gpu=False`')
+        elif self._batch_transform is not None:
+            self._gpu_batch_augment = DisentDatasetTransform(transform_obs=self._batch_transform)
         else:
             self._gpu_batch_augment = None
         # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
         # datasets initialised in setup()
         self.dataset_train_noaug: DisentDataset = None
         self.dataset_train_aug: DisentDataset = None
+        self._dataset_train_u8: Optional[DisentDataset] = None
+        self.data_profiler = None
 
     @property
     def gpu_batch_augment(self) -> Optional[DisentDatasetTransform]:
@@ -145,10 +166,18 @@ class HydraDataModule(pl.LightningDataModule):
         # ground truth data
         log.info(f'Data - Instance')
         data = hydra.utils.instantiate(self.hparams.data)
+        # record the timings of each stage of the data pipeline, see: DataProfilerLoggingCallback
+        if self.hparams.profile_data:
+            self.data_profiler = make_data_profiler(max_workers=max(1, (self.hparams.dataloader_kwargs or {}).get('num_workers', 0)))
         # Wrap the data for the framework some datasets need triplets, pairs, etc.
         # Augmentation is done inside the frameworks so that it can be done on the GPU, otherwise things are very slow.
-        self.dataset_train_noaug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=None,               return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
-        self.dataset_train_aug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=self.input_transform, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
+        self.dataset_train_noaug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=None,               return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors, profiler=self.data_profiler)
+        self.dataset_train_aug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=self.input_transform, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors, profiler=self.data_profiler)
+        # the training dataloader only applies the uint8 part of the transform, the datasets
+        # above are still used by callbacks, eg. metrics & visualisations, which expect float32
+        # - augments are always applied on the GPU in this case, checked in __init__()
+        if self._batch_transform is not None:
+            self._dataset_train_u8 = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self._worker_transform, augment=None, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors, profiler=self.data_profiler)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Training Dataset:
@@ -169,7 +198,9 @@ class HydraDataModule(pl.LightningDataModule):
         """
         # Select which version of the dataset we need to use if GPU augmentation is enabled or not.
         # - corresponds to above in __init__()
-        if self.hparams.augment_on_gpu:
+        if self._dataset_train_u8 is not None:
+            dataset = self._dataset_train_u8
+        elif self.hparams.augment_on_gpu:
             dataset = self.dataset_train_noaug
         else:
             dataset = self.dataset_train_aug
@@ -185,9 +216,20 @@ class HydraDataModule(pl.LightningDataModule):
         kwargs = self.hparams.dataloader_kwargs
         if not kwargs:
             kwargs = {}
+        kwargs = dict(kwargs)
         # check required keys
         if ('batch_size' not in kwargs) or ('num_workers' not in kwargs):
             raise KeyError(f'`dataset.dataloader` must contain keys: ["batch_size", "num_workers"], got: {sorted(kwargs.keys())}')
+        # approximate shuffling that favours locality, useful
+        # with the block cache of hdf5 datasets that are not in memory
+        shuffle_block_size = kwargs.pop('shuffle_block_size', None)
+        shuffle_window_blocks = kwargs.pop('shuffle_window_blocks', 16)
+        if shuffle_block_size:
+            from disent.dataset.util.sampler import BlockShuffleSampler
+            default_kwargs['shuffle'] = False
+            default_kwargs['sampler'] = BlockShuffleSampler(dataset, block_size=shuffle_block_size, window_blocks=shuffle_window_blocks)
+        if dataset.profiler is not None:
+            kwargs['collate_fn'] = dataset.profiler.wrap(kwargs.get('collate_fn', default_collate), 'collate')
         # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
         # create dataloader
         return torch.utils.data.DataLoader(dataset=dataset, **{**default_kwargs, **kwargs})
@@ -30,6 +30,8 @@ from typing import Union
 import numpy as np
 
 from disent.dataset.data._groundtruth import GroundTruthData
+from disent.dataset.data._groundtruth__xyobject import _render_squares_batch
+from disent.dataset.data._groundtruth__xyobject import _square_axis_masks
 from disent.util.iters import iter_chunks
 
 
@@ -82,6 +84,15 @@ class XYSquaresMinimalData(GroundTruthData):
             obs[y:y+8, x:x+8, i] = 255
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        # get factors, shape: (B, squares, 2)
+        factors = np.reshape(self.idx_to_pos(idxs), (len(idxs), -1, 2))
+        # GENERATE
+        obs = np.zeros((len(idxs), *self.img_shape), dtype=np.uint8)
+        for i in range(factors.shape[1]):
+            obs[..., i][_square_masks_batch(_XY_SQUARES_MINIMAL_MASKS, factors[:, i, 0], factors[:, i, 1])] = 255
+        return obs
+
 
 # ========================================================================= #
 # xy multi grid data                                                        #
@@ -179,6 +190,8 @@ class XYSquaresData(GroundTruthData):
             self._placements = min(self._placements, grid_size)
         # center elements
         self._offset = (self._width - (self._square_size + (self._placements-1)*self._spacing)) // 2
+        # precompute the 1D masks for each square placement, shape: (placements, width)
+        self._axis_masks = _square_axis_masks(self._width, self._offset + self._spacing * np.arange(self._placements), self._square_size)
         # initialise parents -- they depend on self.factors
         super().__init__(transform=transform)
 
@@ -196,6 +209,19 @@ class XYSquaresData(GroundTruthData):
                 obs[y:y+size, x:x+size, :] = self._fill_value
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        # get factors, shape: (B, squares, 2)
+        factors = np.reshape(self.idx_to_pos(idxs), (len(idxs), self._num_squares, 2))
+        # GENERATE
+        obs = np.zeros((len(idxs), *self.img_shape), dtype=self._dtype)
+        for i in range(self._num_squares):
+            mask = _square_masks_batch(self._axis_masks, factors[:, i, 0], factors[:, i, 1])
+            if self._rgb:
+                obs[..., i][mask] = self._fill_value
+            else:
+                obs[mask] = self._fill_value
+        return obs
+
 
 # ========================================================================= #
 # xy minimal single square dataset                                          #
@@ -241,6 +267,8 @@ class XYSingleSquareData(GroundTruthData):
             self._placements = min(self._placements, grid_size)
         # center elements
         self._offset = (self._width - (self._square_size + (self._placements-1)*self._spacing)) // 2
+        # precompute the 1D masks for each square placement, shape: (placements, width)
+        self._axis_masks = _square_axis_masks(self._width, self._offset + self._spacing * np.arange(self._placements), self._square_size)
         # initialise parents -- they depend on self.factors
         super().__init__(transform=transform)
 
@@ -254,6 +282,27 @@ class XYSingleSquareData(GroundTruthData):
         obs[y:y+size, x:x+size, :] = 255
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        fx, fy = self.idx_to_pos(idxs).T
+        # draw squares onto images
+        return _render_squares_batch(self._axis_masks[fy], self._axis_masks[fx], np.full((len(idxs), 1), 255, dtype='uint8'))
+
+
+# ========================================================================= #
+# batch rendering helpers                                                   #
+# ========================================================================= #
+
+
+def _square_masks_batch(axis_masks: np.ndarray, fx: np.ndarray, fy: np.ndarray) -> np.ndarray:
+    """
+    Get the 2D boolean masks of shape (B, H, W) for a batch of squares
+    from the precomputed 1D axis masks of shape (placements, width)
+    """
+    return axis_masks[fy][:, :, None] & axis_masks[fx][:, None, :]
+
+
+_XY_SQUARES_MINIMAL_MASKS = _square_axis_masks(64, 8 * np.arange(8), 8)
+
 
 # ========================================================================= #
 # END                                                                       #
@@ -53,6 +53,9 @@ from disent.dataset.sampling import GroundTruthPairSampler
 from disent.dataset.sampling import GroundTruthTripleSampler
 from disent.dataset.sampling import RandomSampler
 from disent.dataset.transform import ToImgTensorF32
+from disent.dataset.util.export import export_encodings
+from disent.dataset.util.export import framework_encode_fn
+from disent.dataset.util.export import load_export
 from disent.dataset.util.stats import compute_data_mean_std
 from disent.frameworks.ae import Ae
 from disent.frameworks.vae import AdaVae
@@ -311,55 +314,62 @@ def run_experiments(
                 save_every_n_steps=train_steps,
             )
 
-            # generate data for rl
-            with torch.no_grad():
-                dataset: GroundTruthData = data_cls(**data_kwargs, transform=ToImgTensorF32(size=64, mean=data_mean, std=data_std))
-                dat = {
+            # generate data for rl -- encode the entire dataset in large batches
+            export = load_export(export_encodings(
+                data=data,
+                encode_fn=framework_encode_fn(framework.eval()),
+                out_path=str(save_dir.joinpath('rl_export')),
+                transform=ToImgTensorF32(size=64, mean=data_mean, std=data_std),
+                batch_size=256,
+                num_workers=num_workers,
+                save_obs=True,
+            ))
+            dat = {
+                # experiment info
+                'exp_name': save_dir.parent.name,
+                'run_name': save_dir.name,
+                'start_time': start_time,
+                # dataset data
+                'factor_names': data.factor_names,
+                'factor_sizes': data.factor_sizes,
+                # sizes
+                'num_factors': data.num_factors,
+                'num_obs':     len(data),
+                'num_latents': z_size,
+                # image data
+                'obs_indices': np.array(export['indices']),
+                'obs_factors': np.array(export['factors']),
+                'obs':         np.array(export['obs']),
+                # representations
+                'obs_encodings': np.array(export['codes']),
+                # results
+                'metrics': metrics,
+                # descriptions
+                '_desc_': {
                     # experiment info
-                    'exp_name': save_dir.parent.name,
-                    'run_name': save_dir.name,
-                    'start_time': start_time,
+                    'exp_name':      f'The name of the group of experiments',
+                    'run_name':      f'The name of this individual run that is part of the experiment',
+                    'start_time':    f'The starting time of this individual run',
                     # dataset data
-                    'factor_names': data.factor_names,
-                    'factor_sizes': data.factor_sizes,
+                    'factor_names':  f'The names of the ground truth factors in the dataset, eg. ["x", "y"]',
+                    'factor_sizes':  f'The sizes of the ground truth factors in the dataset, eg. [8, 8]',
                     # sizes
-                    'num_factors': data.num_factors,
-                    'num_obs':     len(data),
-                    'num_latents': z_size,
+                    'num_factors':   f'The number of different ground_truth factors in the dataset, eg. 2',
+                    'num_obs':       f'The number of elements in the dataset, equal to the product of all the factor sizes, eg. 8x8 = 64',
+                    'num_latents':   f'The number of latent units of the model or rather the number of encoder outputs, eg. 9',
                     # image data
-                    'obs_indices': np.array([i                  for i in range(len(data))]),
-                    'obs_factors': np.array([data.idx_to_pos(i) for i in range(len(data))]),
-                    'obs':         np.array([data[i]            for i in range(len(data))]),
-                    # representations
-                    'obs_encodings': np.array([framework.encode(dataset[i][None, ...].to(framework.device))[0].cpu().numpy() for i in range(len(data))]),
+                    'obs_indices':   f'The index of each observation in the dataset, eg. [0, 1, ..., 62, 63]. '
+                                     f'The shape is (num_obs,)',
+                    'obs_factors':   f'The ground truth factor of each observation in the dataset, eg. [[0, 0], [0, 1], ..., [7, 6], [7, 7]]. '
+                                     f'The shape is (num_obs, num_factors)',
+                    'obs':           f'The raw observations from the dataset, eg. [<img0>, ..., <img63>]. '
+                                     f'The shape is (num_obs, H, W, C)',
+                    'obs_encodings': f'The low dimensional encodings of each observations, eg. [<enc1>, ..., <enc63>]. '
+                                     f'The shape is (num_obs, num_latents)',
                     # results
-                    'metrics': metrics,
-                    # descriptions
-                    '_desc_': {
-                        # experiment info
-                        'exp_name':      f'The name of the group of experiments',
-                        'run_name':      f'The name of this individual run that is part of the experiment',
-                        'start_time':    f'The starting time of this individual run',
-                        # dataset data
-                        'factor_names':  f'The names of the ground truth factors in the dataset, eg. ["x", "y"]',
-                        'factor_sizes':  f'The sizes of the ground truth factors in the dataset, eg. [8, 8]',
-                        # sizes
-                        'num_factors':   f'The number of different ground_truth factors in the dataset, eg. 2',
-                        'num_obs':       f'The number of elements in the dataset, equal to the product of all the factor sizes, eg. 8x8 = 64',
-                        'num_latents':   f'The number of latent units of the model or rather the number of encoder outputs, eg. 9',
-                        # image data
-                        'obs_indices':   f'The index of each observation in the dataset, eg. [0, 1, ..., 62, 63]. '
-                                         f'The shape is (num_obs,)',
-                        'obs_factors':   f'The ground truth factor of each observation in the dataset, eg. [[0, 0], [0, 1], ..., [7, 6], [7, 7]]. '
-                                         f'The shape is (num_obs, num_factors)',
-                        'obs':           f'The raw observations from the dataset, eg. [<img0>, ..., <img63>]. '
-                                         f'The shape is (num_obs, H, W, C)',
-                        'obs_encodings': f'The low dimensional encodings of each observations, eg. [<enc1>, ..., <enc63>]. '
-                                         f'The shape is (num_obs, num_latents)',
-                        # results
-                        'metrics':       f'Dict[str, float] of various scores from different disentanglement metrics computed over the model and the data.',
-                    }
+                    'metrics':       f'Dict[str, float] of various scores from different disentanglement metrics computed over the model and the data.',
                 }
+            }
 
             # save the data for rl
             # | rl_dat_path = save_dir.joinpath('rl_data.json')
@@ -94,6 +94,39 @@ def test_hdf5_pickle_dataset():
                     future_2.result()
 
 
+def test_hdf5_block_cache():
+    import pickle
+    from disent.dataset.util.sampler import BlockShuffleSampler
+    with create_temp_h5data(chunks=(9, 4, 4, 3), compression='gzip') as (tmp_path, raw_data):
+        # cache all the blocks
+        with Hdf5Dataset(tmp_path, 'data', cache_bytes=10**6) as data:
+            assert data.chunk_len == 9
+            assert np.all(np.stack([data[i] for i in range(_TEST_LEN)]) == raw_data)
+            assert data.cache_info() == dict(hits=_TEST_LEN-6, misses=6, num_blocks=6, nbytes=raw_data.nbytes, max_bytes=10**6)
+            assert np.all(data[np.array([53, 0, 0, 17])] == raw_data[[53, 0, 0, 17]])
+            assert data.cache_info()['misses'] == 6
+            # the cache is not pickled
+            assert pickle.loads(pickle.dumps(data)).cache_info()['num_blocks'] == 0
+        # evict old blocks
+        with Hdf5Dataset(tmp_path, 'data', cache_bytes=2 * 9*4*4*3) as data:
+            assert np.all(np.stack([data[i] for i in range(_TEST_LEN)][::-1]) == raw_data[::-1])
+            assert data.cache_info()['num_blocks'] == 2
+            data[0]
+            assert data.cache_info()['misses'] == 7
+        # disabled cache
+        with Hdf5Dataset(tmp_path, 'data') as data:
+            assert data.cache_info() is None
+        # shuffle blocks that fit in the cache
+        sampler = BlockShuffleSampler(_TEST_LEN, block_size=9, window_blocks=2, seed=42)
+        idxs = list(sampler)
+        assert sorted(idxs) == list(range(_TEST_LEN))
+        assert idxs != list(range(_TEST_LEN))
+        assert all(len({i // 9 for i in idxs[w:w+18]}) == 2 for w in range(0, _TEST_LEN, 18))
+        with Hdf5Dataset(tmp_path, 'data', cache_bytes=2 * 9*4*4*3) as data:
+            assert np.all(np.stack([data[i] for i in idxs]) == raw_data[idxs])
+            assert data.cache_info()['misses'] == 6
+
+
 @pytest.mark.parametrize(['hash_mode', 'target_hash'], [
     ('full', 'a3b60a9e248b4b66bdbf4f87a78bf7cc'),
     ('fast', 'a20d554d4912a39e7654b4dc98207490'),
@@ -158,6 +191,368 @@ def test_hdf5_speed_test():
         hdf5_test_speed(path, dataset_name='data', access_method='sequential')
 
 
+def test_hdf5_builder_parallel_and_resumable():
+    import os
+    from tempfile import TemporaryDirectory
+    from disent.dataset.util.hdf5 import H5Builder
+    from disent.dataset.util.hdf5 import hdf5_benchmark_chunks_and_codecs
+    data = np.stack([img for img in TestXYObjectData()], axis=0)
+    # interrupt the fill part way through
+    def _interrupted(i, j):
+        if i >= 20:
+            raise KeyboardInterrupt
+        return data[i:j]
+    with TemporaryDirectory() as temp_dir:
+        serial_path, parallel_path, resume_path, unaligned_path, unaligned_resume_path, lzf_path = [f'{temp_dir}/{k}.h5' for k in ['serial', 'parallel', 'resume', 'unaligned', 'unaligned_resume', 'lzf']]
+        # serial & parallel gzip compression should produce identical files
+        with H5Builder(serial_path) as builder:
+            builder.add_dataset_from_array('data', data, chunk_shape=(5, 4, 4, 3), compression_lvl=4, batch_size=10)
+        with H5Builder(parallel_path) as builder:
+            builder.add_dataset_from_array('data', data, chunk_shape=(5, 4, 4, 3), compression_lvl=4, batch_size=10, compression_workers=2)
+        assert hash_file(serial_path, hash_type='md5') == hash_file(parallel_path, hash_type='md5')
+        # resume an interrupted fill
+        with pytest.raises(KeyboardInterrupt):
+            with H5Builder(resume_path) as builder:
+                builder.add_dataset('data', shape=data.shape, dtype='uint8', chunk_shape=(5, 4, 4, 3), compression_lvl=4)
+                builder.fill_dataset('data', _interrupted, batch_size=10, compression_workers=2, resumable=True)
+        with H5Builder(resume_path, mode='a') as builder:
+            assert builder.get_fill_progress('data') == 20
+            builder.fill_dataset('data', lambda i, j: data[i:j], batch_size=10, compression_workers=2, resumable=True)
+            assert builder.get_fill_progress('data') == len(data)
+        with h5py.File(resume_path, 'r') as file:
+            assert np.all(file['data'][...] == data)
+        # resuming a completed fill does nothing
+        resume_hash = hash_file(resume_path, hash_type='md5')
+        def _no_writes(i, j):
+            raise AssertionError('the completed fill should not be repeated')
+        with H5Builder(resume_path, mode='a') as builder:
+            builder.add_dataset_from_array('data', data, chunk_shape=(5, 4, 4, 3), compression_lvl=4, batch_size=10, mutator=_no_writes, resumable=True)
+            builder.fill_dataset('data', _no_writes, batch_size=10, compression_workers=2, resumable=True)
+        assert hash_file(resume_path, hash_type='md5') == resume_hash
+        # unaligned batches & resume points fall back to normal writes
+        with H5Builder(unaligned_path) as builder:
+            builder.add_dataset('data', shape=data.shape, dtype='uint8', chunk_shape=(4, 4, 4, 3), compression_lvl=4)
+            builder.fill_dataset_from_batches('data', (data[i:i+10] for i in range(0, len(data), 10)), batch_size=10, compression_workers=2)
+        with h5py.File(unaligned_path, 'r') as file:
+            assert np.all(file['data'][...] == data)
+        with pytest.raises(KeyboardInterrupt):
+            with H5Builder(unaligned_resume_path) as builder:
+                builder.add_dataset('data', shape=data.shape, dtype='uint8', chunk_shape=(4, 4, 4, 3), compression_lvl=4)
+                builder.fill_dataset('data', _interrupted, batch_size=7, resumable=True)
+        with H5Builder(unaligned_resume_path, mode='a') as builder:
+            assert builder.get_fill_progress('data') == 21
+            builder.fill_dataset('data', lambda i, j: data[i:j], batch_size=8, compression_workers=2, resumable=True)
+        with h5py.File(unaligned_resume_path, 'r') as file:
+            assert np.all(file['data'][...] == data)
+        # faster codecs
+        with H5Builder(lzf_path) as builder:
+            builder.add_dataset_from_array('data', data, chunk_shape='batch', compression='lzf', compression_workers=2)
+        with h5py.File(lzf_path, 'r') as file:
+            assert file['data'].compression == 'lzf'
+            assert np.all(file['data'][...] == data)
+    # benchmark
+    with no_stdout(), no_stderr():
+        results = hdf5_benchmark_chunks_and_codecs(data, chunk_shapes=['batch', (_TEST_LEN, 4, 4, 3)], codecs=[None, 'gzip', 'lzf'], max_entries=10)
+    assert len(results) == 6
+
+
+def test_storage_layout_benchmark_and_autotune():
+    import os
+    import json
+    from tempfile import TemporaryDirectory
+    from disent.dataset.util.benchmark import benchmark_storage_layouts
+    from disent.dataset.util.benchmark import hdf5_autotune_layout
+    from disent.dataset.util.benchmark import make_storage_layouts
+    from disent.dataset.util.benchmark import recommend_storage_layout
+    from disent.dataset.util.datafile import DataFileHashedDlH5
+    # benchmark all the backends & access patterns
+    data = np.stack([img for img in TestXYObjectData()], axis=0)
+    layouts = make_storage_layouts(obs_shape=(4, 4, 3), chunk_lens=[1, 8], codecs=[None, 'gzip'])
+    results = benchmark_storage_layouts(data, layouts=layouts, batch_size=8, max_entries=16)
+    assert [r['name'] for r in results] == ['hdf5[1x4x4x3]', 'hdf5[1x4x4x3,gzip:4]', 'hdf5[8x4x4x3]', 'hdf5[8x4x4x3,gzip:4]', 'memmap', 'npz']
+    assert all(r[k] > 0 for r in results for k in ['single', 'sorted_batch', 'random_batch', 'dataloader_w0'])
+    assert recommend_storage_layout(results, access_pattern='single', backends=['hdf5'])['layout']['backend'] == 'hdf5'
+    # auto-tune with the dataloader pattern, invalid patterns fail before benchmarking
+    with create_temp_h5data(chunks=(_TEST_LEN, 4, 4, 3)) as (inp_path, raw_data):
+        with no_stdout(), no_stderr():
+            layout, results = hdf5_autotune_layout(inp_path, 'data', access_pattern='dataloader', layouts=layouts[:2], max_entries=16, batch_size=8)
+        assert layout in layouts[:2]
+        assert all(r['dataloader_w0'] > 0 for r in results)
+        with pytest.raises(KeyError, match='invalid access pattern'):
+            hdf5_autotune_layout(inp_path, 'data', access_pattern='dataloader_w2', layouts=layouts[:2])
+        with pytest.raises(KeyError, match='invalid access pattern'):
+            DataFileHashedDlH5(uri=inp_path, uri_hash=None, file_hash=None, hdf5_dataset_name='data', hdf5_chunk_size=(_TEST_LEN, 4, 4, 3), hdf5_autotune='apply', hdf5_autotune_pattern='batch')
+    # auto-tune the layout of a generated file
+    with create_temp_h5data(chunks=(_TEST_LEN, 4, 4, 3)) as (inp_path, raw_data), TemporaryDirectory() as temp_dir:
+        datafile = DataFileHashedDlH5(
+            uri=inp_path,
+            uri_hash=hash_file(inp_path, hash_type='md5', hash_mode='fast'),
+            uri_name='data.h5',
+            file_hash=None,
+            hdf5_dataset_name='data',
+            hdf5_chunk_size=(_TEST_LEN, 4, 4, 3),
+            hdf5_autotune='apply',
+            hdf5_autotune_kwargs=dict(layouts=layouts, max_entries=16, batch_size=8),
+        )
+        with no_stdout(), no_stderr():
+            out_path = datafile.prepare(temp_dir)
+        with open(f'{out_path}.layout.json') as fp:
+            layout = json.load(fp)
+        with h5py.File(out_path, 'r') as file:
+            assert np.all(file['data'][...] == raw_data)
+            assert list(file['data'].chunks) == layout['chunks']
+        # the file is not re-generated
+        mtime = os.path.getmtime(out_path)
+        assert datafile.prepare(temp_dir) == out_path
+        assert os.path.getmtime(out_path) == mtime
+
+
+@pytest.mark.parametrize('ext', ['npy', 'bin'])
+def test_memmap_dataset(ext: str):
+    import pickle
+    from tempfile import TemporaryDirectory
+    from disent.dataset.data import MemmapGroundTruthData
+    from disent.dataset.data import SelfContainedHdf5GroundTruthData
+    from disent.dataset.util.hdf5 import H5Builder
+    from disent.dataset.util.memmap import memmap_save_from_hdf5
+    # convert the data
+    with TemporaryDirectory() as temp_dir:
+        h5_path, mm_path = f'{temp_dir}/data.h5', f'{temp_dir}/data.{ext}'
+        with no_stdout(), no_stderr():
+            with H5Builder(h5_path) as builder:
+                builder.add_dataset_from_gt_data(TestXYObjectData(), num_workers=0, show_progress=False)
+            memmap_save_from_hdf5(h5_path, mm_path, batch_size=7, show_progress=False)
+        # load the data
+        h5_data = SelfContainedHdf5GroundTruthData(h5_path)
+        mm_data = MemmapGroundTruthData(mm_path)
+        # check the attributes
+        assert len(mm_data) == len(h5_data) == _TEST_LEN
+        assert mm_data.name == h5_data.name
+        assert mm_data.factor_names == h5_data.factor_names
+        assert mm_data.factor_sizes == h5_data.factor_sizes
+        assert mm_data.img_shape == h5_data.img_shape
+        # check the observations
+        for i in range(_TEST_LEN):
+            assert np.all(mm_data[i] == h5_data[i])
+        # check that the memmap is reopened when pickled and not copied
+        unpickled = pickle.loads(pickle.dumps(mm_data))
+        assert len(pickle.dumps(mm_data)) < mm_data._data.shape[0] * np.prod(mm_data.img_shape)
+        assert np.all(unpickled[_TEST_LEN - 1] == h5_data[_TEST_LEN - 1])
+
+
+def _sum_observations(data):
+    return int(sum(int(data[i].sum()) for i in range(len(data))))
+
+
+def test_shared_memory_dataset():
+    import pickle
+    from tempfile import TemporaryDirectory
+    from disent.dataset.data import SelfContainedHdf5GroundTruthData
+    from disent.dataset.util.hdf5 import H5Builder
+    from disent.dataset.util.shm import shm_refcount
+    with TemporaryDirectory() as temp_dir:
+        h5_path = f'{temp_dir}/data.h5'
+        with no_stdout(), no_stderr():
+            with H5Builder(h5_path) as builder:
+                builder.add_dataset_from_gt_data(TestXYObjectData(), num_workers=0, show_progress=False)
+        # load the data
+        mem_data = SelfContainedHdf5GroundTruthData(h5_path, in_memory=True)
+        shm_data_a = SelfContainedHdf5GroundTruthData(h5_path, in_memory='shared')
+        shm_data_b = SelfContainedHdf5GroundTruthData(h5_path, in_memory='shared')
+        name = shm_data_a._data.name
+        try:
+            assert shm_data_b._data.name == name
+            assert shm_refcount(name) == 2
+            # check the observations
+            assert np.all(shm_data_a._data.array == mem_data._data)
+            assert np.all(shm_data_b[np.array([3, 1, 3])] == mem_data[np.array([3, 1, 3])])
+            assert not shm_data_a._data.array.flags.writeable
+            # only the name of the segment is pickled
+            assert len(pickle.dumps(shm_data_a)) < mem_data._data.nbytes
+            unpickled = pickle.loads(pickle.dumps(shm_data_a))
+            assert shm_refcount(name) == 3
+            assert np.all(unpickled[_TEST_LEN - 1] == mem_data[_TEST_LEN - 1])
+            unpickled._data.close()
+            assert shm_refcount(name) == 2
+            # attach from another process, the reference is released when the process exits
+            with ProcessPoolExecutor(1) as executor:
+                assert executor.submit(_sum_observations, shm_data_a).result() == _sum_observations(mem_data)
+            assert shm_refcount(name) == 2
+            # observations are copied out of the segment
+            obs = shm_data_a._data[0]
+            assert obs.flags.writeable
+            view = shm_data_b._data.array
+        finally:
+            shm_data_a._data.close()
+            # the segment is not unmapped while views are still alive
+            with pytest.raises(BufferError):
+                shm_data_b._data.close()
+        # the segment is removed with the last reference
+        assert shm_refcount(name) == 0
+        # the data is still valid
+        assert np.all(obs == mem_data._data[0])
+        assert np.all(view == mem_data._data)
+        del view
+
+
+@pytest.mark.parametrize('ext', ['npz', 'npy'])
+def test_shared_memory_numpy_file_dataset(ext: str):
+    import os
+    from tempfile import TemporaryDirectory
+    from disent.dataset.data import NumpyFileGroundTruthData
+    from disent.dataset.util.datafile import DataFile
+    from disent.dataset.util.npz import save_dataset_array
+    from disent.dataset.util.shm import shm_refcount
+    gt_data = TestXYObjectData()
+    class _NumpyData(NumpyFileGroundTruthData):
+        name = 'numpy_data'
+        factor_names = gt_data.factor_names
+        factor_sizes = gt_data.factor_sizes
+        img_shape = gt_data.img_shape
+        datafile = DataFile(f'data.{ext}')
+        data_key = 'images' if (ext == 'npz') else None
+    with TemporaryDirectory() as temp_dir:
+        path = f'{temp_dir}/numpy_data/data.{ext}'
+        os.makedirs(os.path.dirname(path))
+        array = np.stack([img for img in gt_data], axis=0)
+        if ext == 'npz':
+            save_dataset_array(array, path)
+        else:
+            np.save(path, array)
+        # load the data
+        mem_data = _NumpyData(data_root=temp_dir)
+        shm_data = _NumpyData(data_root=temp_dir, in_memory='shared')
+        name = shm_data._data.name
+        try:
+            assert shm_refcount(name) == 1
+            assert np.all(shm_data._data.array == mem_data._data)
+            assert np.all(shm_data[np.array([3, 1, 3])] == mem_data[np.array([3, 1, 3])])
+        finally:
+            shm_data._data.close()
+        assert shm_refcount(name) == 0
+        # numpy files cannot be read from disk
+        with pytest.raises(KeyError, match='invalid in_memory mode'):
+            _NumpyData(data_root=temp_dir, in_memory=False)
+
+
+@pytest.mark.parametrize('transform', [None, 'u8', 'f32', 'f32_norm'])
+def test_batched_observations(transform):
+    import torch
+    from torch.utils.data.dataloader import default_collate
+    from disent.dataset import DisentDataset
+    from disent.dataset.sampling import GroundTruthTripleSampler
+    from disent.dataset.transform import ToImgTensorF32
+    from disent.dataset.transform import ToImgTensorU8
+    transform = {
+        None: None,
+        'u8': ToImgTensorU8(),
+        'f32': ToImgTensorF32(),
+        'f32_norm': ToImgTensorF32(mean=[0.1, 0.2, 0.3], std=[0.4, 0.5, 0.6]),
+    }[transform]
+    gt_data = TestXYObjectData()
+    dataset = DisentDataset(gt_data, sampler=GroundTruthTripleSampler(), transform=transform, return_indices=True)
+    idxs = [3, 0, 3, _TEST_LEN - 1, 7]
+    # check the ground truth data
+    obs = gt_data.get_observations(idxs)
+    assert obs.shape == (len(idxs), *gt_data.img_shape)
+    assert np.all(obs == np.stack([gt_data[i] for i in idxs]))
+    # check the batches are the same as collating individual observations
+    for mode in ['raw', 'target', 'input', 'pair']:
+        batch = dataset.dataset_batch_from_indices(idxs, mode=mode)
+        target = default_collate([dataset.dataset_get(i, mode=mode) for i in idxs])
+        for b, t in (zip(batch, target) if (mode == 'pair') else [(batch, target)]):
+            assert b.dtype == t.dtype
+            assert b.shape == t.shape
+            assert torch.equal(b, t)
+    with pytest.raises(ValueError):
+        dataset.dataset_batch_from_indices(idxs, mode='invalid')
+    # check the batched items are the same as the individual items
+    np.random.seed(7)
+    items = dataset.__getitems__(idxs)
+    np.random.seed(7)
+    batch_idxs = dataset._sampler.sample_batch(idxs)
+    assert len(items) == len(idxs)
+    for item, obs_idxs in zip(items, batch_idxs.tolist()):
+        target = dataset._dataset_get_observation(*obs_idxs)
+        assert item['idx'] == target['idx']
+        assert len(item['x_targ']) == len(target['x_targ']) == 3
+        for x, t in zip(item['x_targ'], target['x_targ']):
+            assert np.all(np.asarray(x) == np.asarray(t))
+
+
+def test_data_profiler():
+    import pickle
+    from torch.utils.data import DataLoader
+    from torch.utils.data.dataloader import default_collate
+    from disent.dataset import DisentDataset
+    from disent.dataset import make_data_profiler
+    from disent.dataset.transform import ToImgTensorF32
+    profiler = make_data_profiler(max_workers=2)
+    dataset = DisentDataset(TestXYObjectData(), transform=ToImgTensorF32(), augment=lambda x: x, profiler=profiler)
+    assert dataset.shallow_copy().profiler is profiler
+    # single items
+    dataset[0]
+    assert {k: v['count'] for k, v in profiler.summary().items()} == dict(getitem=1, sample=1, read=1, transform=1, augment=1)
+    # batched items across workers
+    profiler.reset()
+    dataloader = DataLoader(dataset, batch_size=9, num_workers=2, collate_fn=profiler.wrap(default_collate, 'collate'))
+    assert sum(len(batch['x_targ'][0]) for batch in dataloader) == _TEST_LEN
+    summary = profiler.summary()
+    assert summary['getitem']['count'] == summary['collate']['count'] == _TEST_LEN // 9
+    assert summary['augment']['count'] == _TEST_LEN
+    assert all(0 < stats['p50_ms'] <= stats['p95_ms'] for stats in summary.values())
+    # pickling copies the statistics
+    assert pickle.loads(pickle.dumps(profiler)).summary() == summary
+    # disabled profiling
+    assert DisentDataset(TestXYObjectData()).profiler is None
+
+
+@pytest.mark.parametrize('ext', ['h5', 'npz', 'dir'])
+def test_export_encodings(ext: str):
+    import torch
+    from tempfile import TemporaryDirectory
+    from disent.dataset.transform import ToImgTensorF32
+    from disent.dataset.util.export import export_encodings
+    from disent.dataset.util.export import load_export
+    gt_data = TestXYObjectData()
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(int(np.prod(gt_data.img_shape)), 3))
+    # encode function that fails part way through
+    num_calls = [0]
+    def failing_encode_fn(x):
+        num_calls[0] += 1
+        if num_calls[0] > 2:
+            raise KeyboardInterrupt
+        return model(x)
+    # export the data
+    with TemporaryDirectory() as temp_dir:
+        path = f'{temp_dir}/export.{ext}'
+        with pytest.raises(KeyboardInterrupt):
+            export_encodings(gt_data, failing_encode_fn, path, transform=ToImgTensorF32(), batch_size=7, save_obs=True, attrs=dict(model='a'))
+        with pytest.raises(FileExistsError):
+            export_encodings(gt_data, model, path, transform=ToImgTensorF32(), batch_size=7, save_obs=True, resume=False, attrs=dict(model='a'))
+        # resuming with a different model or mismatched arrays fails
+        with pytest.raises(ValueError, match="attribute 'model'"):
+            export_encodings(gt_data, model, path, transform=ToImgTensorF32(), batch_size=7, save_obs=True, attrs=dict(model='b'))
+        with pytest.raises(ValueError, match="array 'codes'"):
+            export_encodings(gt_data, lambda x: model(x).double(), path, transform=ToImgTensorF32(), batch_size=7, save_obs=True, attrs=dict(model='a'))
+        # resume the export, skipping the first two batches
+        num_calls[0] = 0
+        export_encodings(gt_data, failing_encode_fn, path, transform=ToImgTensorF32(), batch_size=_TEST_LEN - 14, save_obs=True, attrs=dict(model='a'))
+        assert num_calls[0] == 1
+        with pytest.raises(ValueError, match="attribute 'model'"):
+            export_encodings(gt_data, model, path, transform=ToImgTensorF32(), batch_size=7, save_obs=True, attrs=dict(model='b'))
+        # check the results
+        dat = load_export(path)
+        assert dat['num_obs'] == _TEST_LEN
+        assert list(dat['factor_sizes']) == list(gt_data.factor_sizes)
+        assert np.all(dat['indices'][:] == np.arange(_TEST_LEN))
+        assert np.all(dat['factors'][:] == gt_data.idx_to_pos(np.arange(_TEST_LEN)))
+        assert np.all(dat['obs'][:] == gt_data.get_observations(np.arange(_TEST_LEN)))
+        with torch.no_grad():
+            codes = model(ToImgTensorF32().transform_batch(gt_data.get_observations(np.arange(_TEST_LEN)))).numpy()
+        assert np.allclose(dat['codes'][:], codes, atol=1e-6)
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
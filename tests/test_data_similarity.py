@@ -73,6 +73,24 @@ def test_xyobject_grey_similarity():
             assert np.allclose(data0[i], data1[i])
 
 
+def test_batched_rendering_similarity():
+    for data in [
+        XYObjectData(),
+        XYObjectData(palette='greys_4', rgb=False),
+        XYObjectData(grid_spacing=5, min_square_size=3, max_square_size=20),
+        XYObjectShadedData(),
+        XYObjectShadedData(palette='greys_4', rgb=False),
+        XYSquaresMinimalData(),                                                               # pragma: delete-on-release
+        XYSquaresData(),                                                                      # pragma: delete-on-release
+        XYSquaresData(rgb=False, grid_spacing=4, no_warnings=True),                           # pragma: delete-on-release
+        XYSquaresData(num_squares=2, grid_size=5, dtype='float32', fill_value=0.5),           # pragma: delete-on-release
+    ]:
+        idxs = np.concatenate([[0, len(data)-1], np.random.randint(len(data), size=100)])
+        obs = data.get_observations(idxs)
+        assert obs.dtype == data[0].dtype
+        assert np.array_equal(obs, np.stack([data[i] for i in idxs]))
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -47,6 +47,8 @@ RESEARCH_CFG_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(
     (dict(), ['run_action=skip']),
     (dict(), ['run_action=prepare_data']),
     (dict(), ['run_action=train']),
+    # workers only apply the uint8 transform, the metric & vis callbacks still need float32 data
+    (dict(), ['run_action=train', 'augment=none', '+datamodule.transform_after_collate=TRUE']),
     # test the configs with the research components  # pragma: delete-on-release
     # -- we need to modify the search path           # pragma: delete-on-release
     # -- we need to register all the components      # pragma: delete-on-release
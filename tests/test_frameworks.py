@@ -22,6 +22,7 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import os
 import pickle
 from dataclasses import asdict
 from functools import partial
@@ -72,6 +73,8 @@ _TEST_FRAMEWORKS = [
     (DfcVae,               dict(),                                                                      XYObjectData),
     (DfcVae,               dict(),                                                                      partial(XYObjectData, rgb=False)),
     (BetaTcVae,            dict(),                                                                      XYObjectData),
+    (BetaTcVae,            dict(betatc_chunk_size=3),                                                   XYObjectData),
+    (BetaTcVae,            dict(betatc_estimator='mss', betatc_dataset_size=1000),                      XYObjectData),
     # VAE - unsupervised - EXP                                                                                          # pragma: delete-on-release
     (DataOverlapTripletVae,dict(overlap_mine_triplet_mode='none'),                                      XYObjectData),  # pragma: delete-on-release
     (DataOverlapTripletVae,dict(overlap_mine_triplet_mode='semi_hard_neg'),                             XYObjectData),  # pragma: delete-on-release
@@ -178,6 +181,232 @@ def test_framework_config_defaults():
     )
 
 
+class _RecordingLogger(pl.loggers.LightningLoggerBase):
+
+    def __init__(self):
+        super().__init__()
+        self.logged = []
+
+    @property
+    def experiment(self):
+        return None
+
+    def log_hyperparams(self, params, *args, **kwargs):
+        pass
+
+    def log_metrics(self, metrics, step=None):
+        self.logged.append((step, dict(metrics)))
+
+    @property
+    def name(self):
+        return 'recording'
+
+    @property
+    def version(self):
+        return 0
+
+
+@pytest.mark.parametrize('run_async', [False, True])
+def test_framework_metric_callback(run_async: bool):
+    from disent.metrics import metric_mig
+    from disent.util.lightning.callbacks import VaeMetricLoggingCallback
+    # train a tiny framework with the metric callback
+    dataset = DisentDataset(XYObjectData(), GroundTruthSingleSampler(), transform=ToImgTensorF32())
+    dataloader = DataLoader(dataset=dataset, batch_size=4, shuffle=True)
+    framework = BetaVae(
+        model=AutoEncoder(
+            encoder=EncoderLinear(x_shape=(3, 64, 64), z_size=6, z_multiplier=2),
+            decoder=DecoderLinear(x_shape=(3, 64, 64), z_size=6),
+        ),
+        cfg=BetaVae.cfg(),
+    )
+    logger = _RecordingLogger()
+    callback = VaeMetricLoggingCallback(
+        step_end_metrics=[metric_mig.compute_fast],
+        train_end_metrics=[metric_mig.compute_fast],
+        every_n_steps=2,
+        run_async=run_async,
+    )
+    trainer = pl.Trainer(logger=logger, callbacks=[callback], checkpoint_callback=False, max_steps=4, log_every_n_steps=100, enable_progress_bar=False)
+    trainer.fit(framework, dataloader)
+    # check the results
+    epoch_logs = [(step, m) for step, m in logger.logged if any(k.startswith('epoch_metric/') for k in m)]
+    final_logs = [(step, m) for step, m in logger.logged if any(k.startswith('final_metric/') for k in m)]
+    assert len(final_logs) == 1
+    assert 'final_metric/mig.discrete_score' in final_logs[0][1]
+    assert 1 <= len(epoch_logs) <= 2
+    # background results are logged with the step of the snapshot
+    if run_async:
+        assert all(step in (2, 4) for step, _ in epoch_logs)
+        assert final_logs[0][0] == 4
+    assert callback._evaluator is None
+
+
+def test_framework_metric_snapshot():
+    import torch
+    from disent.util.lightning.callbacks._callback_log_metrics import _snapshot_framework
+    framework = BetaVae(
+        model=AutoEncoder(
+            encoder=EncoderLinear(x_shape=(3, 8, 8), z_size=6, z_multiplier=2),
+            decoder=DecoderLinear(x_shape=(3, 8, 8), z_size=6),
+        ),
+        cfg=BetaVae.cfg(beta=3),
+    )
+    snapshot = _snapshot_framework(framework)
+    assert (snapshot is not framework) and (snapshot.cfg == framework.cfg) and (snapshot.cfg is not framework.cfg)
+    assert not snapshot.training
+    # the weights are copied
+    for (k_a, v_a), (k_b, v_b) in zip(framework.state_dict().items(), snapshot.state_dict().items()):
+        assert (k_a == k_b) and torch.equal(v_a, v_b) and (v_a.data_ptr() != v_b.data_ptr())
+
+
+@pytest.mark.parametrize('Framework', [Ae, BetaVae])
+def test_framework_factor_distances(Framework):
+    import numpy as np
+    import torch
+    from disent.util.lightning.callbacks._callback_vis_dists import _get_dists_fn
+    from disent.util.lightning.callbacks._callback_vis_dists import compute_factor_distances
+    from disent.util.seeds import TempNumpySeed
+    dataset = DisentDataset(XYObjectData(grid_size=6, min_square_size=1, max_square_size=3, square_size_spacing=1), transform=ToImgTensorF32())
+    framework = Framework(
+        model=AutoEncoder(
+            encoder=EncoderLinear(x_shape=(3, 6, 6), z_size=4, z_multiplier=2 if issubclass(Framework, Vae) else 1),
+            decoder=DecoderLinear(x_shape=(3, 6, 6), z_size=4),
+        ),
+        cfg=Framework.cfg(),
+    )
+    dists_names, encode_fn, dists_fn = _get_dists_fn(framework)
+    # reference: encode & decode both observations of every pair
+    f_grid_orig = []
+    with TempNumpySeed(7):
+        for f_idx, f_size in enumerate(dataset.gt_data.factor_sizes):
+            i_a, i_b = np.triu_indices(f_size, k=1)
+            f_dists = []
+            for i in range(3):
+                batch = dataset.dataset_batch_from_indices(dataset.gt_data.pos_to_idx(dataset.gt_data.sample_random_factor_traversal(f_idx=f_idx)), 'input')
+                f_dists.append(dists_fn(encode_fn(batch[i_a]), encode_fn(batch[i_b])))
+            f_grid_orig.append([torch.stack(dists, dim=0).mean(dim=0) for dists in zip(*f_dists)])
+    # encode each observation once
+    names, f_grid = compute_factor_distances(dataset, dists_fn=dists_fn, dists_names=dists_names, traversal_repeats=3, batch_size=7, seed=7, encode_fn=encode_fn)
+    assert names == ('factors', *dists_names)
+    for f_dmats, f_dists_orig, f_size in zip(f_grid, f_grid_orig, dataset.gt_data.factor_sizes):
+        i_a, i_b = np.triu_indices(f_size, k=1)
+        assert len(f_dmats) == len(f_dists_orig) + 1
+        for dmat, dists_orig in zip(f_dmats[1:], f_dists_orig):
+            assert dmat.shape == (f_size, f_size)
+            assert np.allclose(dmat[i_a, i_b], dists_orig.numpy(), rtol=1e-5, atol=1e-6)
+            assert np.allclose(dmat, dmat.T)
+
+
+def test_framework_latent_cycles(tmp_path):
+    import numpy as np
+    import torch
+    from disent.util.lightning.callbacks import VaeLatentCycleLoggingCallback
+    from disent.util.seeds import seed
+    from disent.util.visualize.vis_latents import make_decoded_latent_cycles
+    from disent.util.visualize.vis_latents import make_latent_zs_cycle
+    from disent.util.visualize.vis_util import iter_animated_image_grid
+    from disent.util.visualize.vis_util import write_video
+    seed(7777)
+    dataset = DisentDataset(XYObjectData(grid_size=6, min_square_size=1, max_square_size=3, square_size_spacing=1), transform=ToImgTensorF32())
+    framework = BetaVae(
+        model=AutoEncoder(
+            encoder=EncoderLinear(x_shape=(3, 6, 6), z_size=5, z_multiplier=2),
+            decoder=DecoderLinear(x_shape=(3, 6, 6), z_size=5),
+        ),
+        cfg=BetaVae.cfg(),
+    )
+    # batched decoding gives the same results as decoding each cycle
+    zs_mean, zs_logvar = torch.randn(16, 5), torch.randn(16, 5)
+    cycles = make_decoded_latent_cycles(framework.decode, zs_mean, zs_logvar, num_animations=2, num_frames=7, batch_size=11)
+    assert cycles.shape == (2, 5, 7, 3, 6, 6)
+    for i in range(2):
+        for z_idx in range(5):
+            assert torch.allclose(cycles[i, z_idx], framework.decode(make_latent_zs_cycle(zs_mean[i], zs_mean, zs_logvar, z_idx, 7)), atol=1e-6)
+    # a tiny memory limit decodes in small batches, float differences between
+    # batch sizes can change the converted images by at most one uint8 level
+    stills, frames, image = VaeLatentCycleLoggingCallback.generate_visualisations(dataset, framework, num_frames=7, num_stats_samples=16)
+    stills_lim, frames_lim, image_lim = VaeLatentCycleLoggingCallback.generate_visualisations(dataset, framework, num_frames=7, num_stats_samples=16, max_memory_mb=0.01, return_frames=False)
+    assert stills.shape == (5, 7, 6, 6, 3)
+    assert frames_lim is None
+    assert np.abs(stills.astype('int16') - stills_lim).max() <= 1
+    assert np.abs(image.astype('int16') - image_lim).max() <= 1
+    # frames can be streamed to a video
+    streamed = list(iter_animated_image_grid(stills, pad=4, border=True))
+    assert np.array_equal(np.stack(streamed), frames)
+    path = str(tmp_path / 'vid.mp4')
+    assert write_video(iter(streamed), path, fps=4) == 7
+    assert os.path.getsize(path) > 0
+
+
+@pytest.mark.parametrize('estimator', ['mws', 'mss'])
+def test_betatc_total_correlation_chunked(estimator):
+    import torch
+    B, N = 13, 100
+    z_sampled, z_mean = torch.randn(B, 5, dtype=torch.float64), torch.randn(B, 5, dtype=torch.float64, requires_grad=True)
+    z_logvar = (0.1 * torch.randn(B, 5, dtype=torch.float64)).requires_grad_(True)
+    # dense reference
+    log_qz_prob = BetaTcVae._betatc_compute_gaussian_log_density(z_sampled[:, None], z_mean[None], z_logvar[None])
+    if estimator == 'mws':
+        log_w = torch.zeros(B, B, dtype=torch.float64)
+    else:
+        log_w = torch.full((B, B), 1 / (B - 1), dtype=torch.float64)
+        for j in range(B):
+            log_w[j, (j + 1) % B] = (N - B + 1) / (N * (B - 1))
+            log_w[j, j] = 1 / N
+        assert torch.allclose(log_w.sum(dim=1), torch.ones(B, dtype=torch.float64))
+        log_w = log_w.log()
+    target = (torch.logsumexp(log_qz_prob.sum(dim=2) + log_w, dim=1) - torch.logsumexp(log_qz_prob + log_w[:, :, None], dim=1).sum(dim=1)).mean()
+    target_grads = torch.autograd.grad(target, [z_mean, z_logvar])
+    # chunked versions should give the same results & gradients
+    for chunk_size in [None, 1, 4, 13, 100]:
+        tc = BetaTcVae._betatc_compute_total_correlation(z_sampled, z_mean, z_logvar, estimator=estimator, dataset_size=N, chunk_size=chunk_size)
+        grads = torch.autograd.grad(tc, [z_mean, z_logvar])
+        assert torch.allclose(tc, target)
+        assert all(torch.allclose(g, t) for g, t in zip(grads, target_grads))
+
+
+def test_framework_benchmark(tmp_path):
+    import torch
+    from disent.frameworks.benchmark import STAGES
+    from disent.frameworks.benchmark import benchmark_total_correlation
+    from disent.frameworks.benchmark import benchmark_frameworks
+    from disent.frameworks.benchmark import compare_framework_benchmarks
+    from disent.frameworks.benchmark import load_framework_benchmark
+    from disent.frameworks.benchmark import make_benchmark_cases
+    from disent.frameworks.benchmark import save_framework_benchmark
+    # samplers that return the wrong number of observations are skipped
+    cases = make_benchmark_cases(frameworks=['ae', 'ada_vae', 'tae'], models=['linear'], samplers=['gt_single', 'gt_pair'])
+    assert [c['framework'] for c in cases] == ['ae', 'ada_vae']
+    cases = make_benchmark_cases(frameworks=['ae', 'ada_vae', 'tae'], models=['linear'])
+    assert [c['sampler'] for c in cases] == ['gt_single', 'gt_pair', 'gt_triple']
+    # run the benchmark
+    results = benchmark_frameworks(cases, steps=3, warmup_steps=1, batch_size=4)
+    assert len(results['benchmarks']) == 3
+    for b in results['benchmarks']:
+        assert b['stats']['rounds'] == 3
+        assert b['extra_info']['images_per_sec'] > b['extra_info']['steps_per_sec'] > 0
+        assert b['extra_info']['peak_rss'] > 0
+        assert sum(b['extra_info'][f'{s}_time'] for s in STAGES) == pytest.approx(b['stats']['mean'])
+    # save & compare
+    path = str(tmp_path / 'bench.json')
+    save_framework_benchmark(results, path)
+    loaded = load_framework_benchmark(path)
+    assert loaded == results
+    assert compare_framework_benchmarks(loaded, results) == []
+    for b in loaded['benchmarks']:
+        b['stats']['median'] /= 2
+    assert len(compare_framework_benchmarks(loaded, results, threshold=0.5)) == 3
+    # total correlation against the batch size
+    results = benchmark_total_correlation(batch_sizes=[4, 16], chunk_sizes=[None, 3], repeats=2)
+    assert [(b['params']['chunk_size'], b['params']['batch_size']) for b in results['benchmarks']] == [(None, 4), (None, 16), (3, 4), (3, 16)]
+    # the number of threads is set in the isolated worker processes
+    num_threads = 1 if (torch.get_num_threads() > 1) else 2
+    results = benchmark_total_correlation(batch_sizes=[4], chunk_sizes=[None], repeats=1, isolate=True, num_threads=num_threads)
+    assert results['machine_info']['torch_num_threads'] == num_threads
+    assert results['benchmarks'][0]['extra_info']['torch_num_threads'] == num_threads
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -22,6 +22,8 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import os
+
 import pytest
 import torch
 
@@ -58,6 +60,197 @@ def test_metrics(metric_fn):
     metric_fn(dataset, get_repr)
 
 
+def test_representation_bank():
+    import numpy as np
+    from disent.metrics.utils import RepresentationBank
+    from disent.metrics.utils import generate_batch_factor_code
+    dataset = DisentDataset(XYObjectData(), transform=ToImgTensorF32())
+    # deterministic representation, so we can check that codes match their factors
+    get_repr = lambda x: x.mean(dim=(2, 3))
+    bank = RepresentationBank(dataset, get_repr, max_points=20)
+    # draws within a metric should not overlap
+    mus_a, ys_a = generate_batch_factor_code(dataset, bank, num_points=8, batch_size=3)
+    mus_b, ys_b = generate_batch_factor_code(dataset, bank, num_points=5, batch_size=3)
+    assert mus_a.shape == (3, 8) and ys_a.shape == (4, 8)
+    assert mus_b.shape == (3, 5) and ys_b.shape == (4, 5)
+    assert (bank.num_encoded, len(bank)) == (13, 13)
+    # points are re-used after rewinding
+    bank.rewind()
+    mus_c, ys_c = generate_batch_factor_code(dataset, bank, num_points=10, batch_size=3)
+    assert np.all(mus_c == np.concatenate([mus_a, mus_b], axis=1)[:, :10])
+    assert np.all(ys_c == np.concatenate([ys_a, ys_b], axis=1)[:, :10])
+    assert (bank.num_encoded, len(bank)) == (13, 13)
+    # the oldest points are evicted once the bank is full
+    mus_d, ys_d = generate_batch_factor_code(dataset, bank, num_points=15, batch_size=3)
+    assert (bank.num_encoded, len(bank)) == (25, 20)
+    bank.rewind()
+    mus_e, ys_e = generate_batch_factor_code(dataset, bank, num_points=10, batch_size=3)
+    assert np.all(ys_e[:, :3] == ys_a[:, 5:])
+    assert np.all(ys_e[:, 3:8] == ys_b)
+    # codes should always correspond to their factors
+    for mus, ys in [(mus_a, ys_a), (mus_b, ys_b), (mus_c, ys_c), (mus_d, ys_d), (mus_e, ys_e)]:
+        obs = dataset.dataset_batch_from_factors(ys.T, mode='input')
+        assert np.allclose(mus, get_repr(obs).numpy().T)
+    # too many points are encoded directly
+    with pytest.warns(UserWarning):
+        mus_f, ys_f = generate_batch_factor_code(dataset, bank, num_points=21, batch_size=3)
+    assert mus_f.shape == (3, 21) and (bank.num_encoded, len(bank)) == (46, 20)
+    # metrics should work with the bank
+    for metric_fn in [
+        wrapped_partial(metric_mig,          num_train=7),
+        wrapped_partial(metric_unsupervised, num_train=7),
+        wrapped_partial(metric_factor_vae,   num_train=7, num_eval=7, num_variance_estimate=7),
+    ]:
+        bank.rewind()
+        metric_fn(dataset, bank)
+
+
+@pytest.mark.parametrize(['num_points', 'batch_size', 'prefetch'], [(1, 7, False), (23, 7, False), (23, 7, True), (21, 7, True), (21, 256, True)])
+def test_encode_batches(num_points: int, batch_size: int, prefetch: bool):
+    import numpy as np
+    from disent.metrics.utils import encode_batches
+    from disent.metrics.utils import obtain_representation
+    observations = torch.randn(num_points, 3, 4, 4)
+    get_repr = lambda x: x.mean(dim=(2, 3)).requires_grad_(True)
+    # check the streaming encoder
+    zs = encode_batches(lambda i, j: observations[i:j], get_repr, num_points=num_points, batch_size=batch_size, prefetch=prefetch)
+    assert zs.shape == (num_points, 3)
+    assert np.allclose(zs, get_repr(observations).detach().numpy())
+    # check the transposed version
+    assert np.all(obtain_representation(observations, get_repr, batch_size=batch_size) == zs.T)
+
+
+@pytest.mark.parametrize(['num_points', 'z_size', 'dtype'], [(1, 1, 'float32'), (100, 3, 'float32'), (1000, 10, 'float64'), (1000, 5, 'int64')])
+def test_discrete_mutual_info(num_points: int, z_size: int, dtype: str):
+    import numpy as np
+    from disent.metrics.utils import discrete_entropy
+    from disent.metrics.utils import discrete_mutual_info
+    from disent.metrics.utils import histogram_discretize
+    from disent.metrics.utils import _discrete_entropy_loop
+    from disent.metrics.utils import _discrete_mutual_info_loop
+    from disent.metrics.utils import _histogram_discretize_loop
+    mus = (np.random.randn(z_size, num_points) * 10).astype(dtype)
+    mus[0, :] = 1  # constant codes have a single bin
+    ys = np.random.randint(0, [[1], [4], [40]], size=(3, num_points))
+    # check discretization
+    discretized = histogram_discretize(mus)
+    assert discretized.dtype == mus.dtype
+    assert np.all(discretized == _histogram_discretize_loop(mus))
+    # check mutual info & entropy
+    assert np.allclose(discrete_mutual_info(discretized, ys), _discrete_mutual_info_loop(discretized, ys))
+    assert np.allclose(discrete_mutual_info(discretized, discretized, max_chunk_bins=1024), _discrete_mutual_info_loop(discretized, discretized))
+    assert np.allclose(discrete_entropy(ys), _discrete_entropy_loop(ys))
+    # high cardinality labels use the non-zero bins of the joint histograms
+    assert np.allclose(discrete_mutual_info(discretized, discretized, max_chunk_bins=64), _discrete_mutual_info_loop(discretized, discretized))
+    assert np.allclose(discrete_mutual_info(mus, ys, max_chunk_bins=64), _discrete_mutual_info_loop(mus, ys))
+    assert np.allclose(discrete_entropy(mus), _discrete_entropy_loop(mus))
+
+
+def test_metric_pickling():
+    import pickle
+    from disent import registry
+    for name in registry.METRICS:
+        metric = registry.METRICS[name]
+        # metrics & their partial functions are pickled by reference
+        assert pickle.loads(pickle.dumps(metric)) is metric
+        assert pickle.loads(pickle.dumps(metric.compute)) is metric.compute
+        assert pickle.loads(pickle.dumps(metric.compute_fast)) is metric.compute_fast
+        # the original function is not modified
+        assert metric.unwrap.__qualname__ == metric.unwrap.__name__
+
+
+def test_histogram_discretize_float32():
+    import numpy as np
+    from disent.metrics.utils import histogram_discretize
+    from disent.metrics.utils import _histogram_discretize_loop
+    # float32 codes near the bin edges can be discretized differently if the edges are not computed in float64
+    for seed in range(300):
+        mus = (np.random.RandomState(seed).randn(8, 1000) * 3 + 5).astype('float32')
+        assert np.all(histogram_discretize(mus) == _histogram_discretize_loop(mus)), f'mismatch for seed: {seed}'
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process', 'joblib'])
+def test_metrics_executors(executor: str):
+    import numpy as np
+    from disent.metrics._dci import _compute_dci
+    from disent.metrics._sap import _compute_sap
+    from disent.metrics.utils import parallel_map
+    # check the order of results
+    assert parallel_map(pow, [2, 3, 4], [3, 2, 1], executor=executor, num_workers=2) == [8, 9, 4]
+    # generate random codes & factors
+    mus, ys = np.random.randn(3, 150), np.random.randint(0, 3, size=(2, 150))
+    mus_test, ys_test = np.random.randn(3, 50), np.random.randint(0, 3, size=(2, 50))
+    # parallel results should be the same as serial results
+    for compute in [
+        lambda **kwargs: _compute_dci(mus, ys, mus_test, ys_test, **kwargs),
+        lambda **kwargs: _compute_sap(mus, ys, mus_test, ys_test, continuous_factors=False, **kwargs),
+    ]:
+        np.random.seed(42)
+        serial = compute(executor=None)
+        np.random.seed(42)
+        parallel = compute(executor=executor, num_workers=2)
+        assert serial == parallel
+    # check invalid executors
+    with pytest.raises(KeyError):
+        parallel_map(pow, [2], [3], executor='invalid')
+
+
+@pytest.mark.parametrize(['batch_size', 'eval_batch_size'], [(64, 1024), (5, 7), (16, 16)])
+def test_factor_vae_batched_votes(batch_size: int, eval_batch_size: int):
+    import numpy as np
+    from disent.metrics._factor_vae import _generate_training_batch
+    from disent.metrics._factor_vae import _generate_training_batch_loop
+    dataset = DisentDataset(XYObjectData(), transform=ToImgTensorF32())
+    # deterministic representation, each dimension depends on a different part of the image
+    get_repr = lambda x: torch.stack([x[:, i % 3, (i * 8):(i * 8) + 32].mean(dim=(1, 2)) for i in range(5)], dim=1)
+    global_variances = np.linspace(0.5, 1.5, 5)
+    active_dims = np.array([True, True, False, True, True])
+    # the seeded votes should be identical
+    np.random.seed(42)
+    votes = _generate_training_batch(dataset, get_repr, batch_size, 37, global_variances, active_dims, eval_batch_size=eval_batch_size)
+    np.random.seed(42)
+    votes_loop = _generate_training_batch_loop(dataset, get_repr, batch_size, 37, global_variances, active_dims)
+    assert votes.sum() == 37
+    assert np.all(votes == votes_loop)
+
+
+@pytest.mark.parametrize('factor_strides', [3, [2, 4, 5, 6]])
+def test_encoding_cache(factor_strides, tmp_path):
+    import numpy as np
+    from disent.dataset.util.memmap import memmap_meta_path
+    from disent.metrics.cache import EncodingCache
+    from disent.metrics.cache import stratified_factor_grid
+    dataset = DisentDataset(XYObjectData(), transform=ToImgTensorF32())
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3*64*64, 5))
+    # encode & reload
+    cache = EncodingCache.from_model(dataset, model, cache_dir=str(tmp_path), factor_strides=factor_strides)
+    mtime = os.path.getmtime(cache.path)
+    cache = EncodingCache.from_model(dataset, model, cache_dir=str(tmp_path), factor_strides=factor_strides)
+    assert os.path.getmtime(cache.path) == mtime
+    # an interrupted save with only the data file is re-encoded
+    os.remove(memmap_meta_path(cache.path))
+    cache = EncodingCache.from_model(dataset, model, cache_dir=str(tmp_path), factor_strides=factor_strides)
+    assert os.path.exists(memmap_meta_path(cache.path))
+    # the codes should match the encodings of the subset
+    factors, sub_factor_sizes = stratified_factor_grid(dataset.gt_data.factor_sizes, factor_strides)
+    assert cache.dataset.gt_data.factor_sizes == sub_factor_sizes
+    with torch.no_grad():
+        codes = model(dataset.dataset_batch_from_factors(factors, mode='input')).numpy()
+    assert np.allclose(cache.codes, codes, atol=1e-6)
+    assert np.allclose(cache.dataset.dataset_batch_from_factors(np.array([sub_factor_sizes]) - 1, mode='input').numpy(), codes[-1:])
+    # changing the weights changes the key
+    with torch.no_grad():
+        model[1].bias += 1
+    assert EncodingCache.from_model(dataset, model, cache_dir=str(tmp_path), factor_strides=factor_strides).path != cache.path
+    # compute metrics from the cache
+    scores = cache.compute_metrics([
+        wrapped_partial(metric_mig, num_train=7),
+        wrapped_partial(metric_factor_vae, num_train=7, num_eval=7, num_variance_estimate=7),
+    ])
+    assert 'mig.discrete_score' in scores
+    assert 'factor_vae.eval_accuracy' in scores
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
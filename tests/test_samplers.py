@@ -45,7 +45,7 @@ class TestEpisodesData(BaseEpisodesData):
         ]
 
 
-@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], [
+_SAMPLER_TEST_CASES = [
     [XYObjectData(), 1, 'first', SingleSampler()],
     [XYObjectData(), 1, 'first', GroundTruthSingleSampler()],
 
@@ -91,7 +91,10 @@ class TestEpisodesData(BaseEpisodesData):
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=3)],  # sample_radius >= num_samples
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=4)],
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=-1)],
-])
+]
+
+
+@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], _SAMPLER_TEST_CASES)
 def test_samplers(dataset, num_samples: int, check_mode: Union[Literal['first'], Literal['any']], sampler: BaseDisentSampler):
     # check dataset
     wrapper = DisentDataset(dataset, sampler)
@@ -118,3 +121,77 @@ def test_samplers(dataset, num_samples: int, check_mode: Union[Literal['first'],
     check_samples(len(dataset) - 1)
     for i in range(10):
         check_samples(random.randint(0, len(dataset)-1))
+
+
+@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], _SAMPLER_TEST_CASES)
+def test_samplers_batch(dataset, num_samples: int, check_mode: Union[Literal['first'], Literal['any']], sampler: BaseDisentSampler):
+    # samplers are stateful, make sure we do not reuse the instances from above
+    wrapper = DisentDataset(dataset, sampler.uninit_copy())
+    sampler = wrapper.sampler
+    # check batches of samples
+    idxs = np.array([0, len(dataset) - 1, *np.random.randint(0, len(dataset), size=62)])
+    batch = sampler.sample_batch(idxs)
+    assert isinstance(batch, np.ndarray)
+    assert batch.shape == (len(idxs), num_samples)
+    assert np.all(0 <= batch) and np.all(batch < len(dataset))
+    if check_mode == 'first':
+        assert np.all(batch[:, 0] == idxs)
+    elif check_mode == 'any':
+        assert np.all(np.any(batch == idxs[:, None], axis=-1))
+    else:  # pragma: no cover
+        raise RuntimeError('test mode is invalid!')
+    # check empty batches
+    assert sampler.sample_batch([]).shape == (0, num_samples)
+    # check the dataset & dataloader integration
+    obs = wrapper.__getitems__(idxs[:4].tolist())
+    assert isinstance(obs, list)
+    assert len(obs) == 4
+    assert all(len(o['x_targ']) == num_samples for o in obs)
+
+
+def test_samplers_batch_constraints():
+    data = XYObjectData()
+    # pairs should differ in exactly k factors, within the radius
+    pair_sampler = GroundTruthPairSampler(p_k_range=(1, 1), p_radius_range=(1, 1)).init(data)
+    a, p = pair_sampler.batch_sample_factors_pair(np.random.randint(0, len(data), size=1000))
+    assert np.all(np.sum(a != p, axis=-1) <= 1)
+    assert np.all(np.abs(a - p) <= 1)
+    # triplets should be sorted by the swap metric
+    triple_sampler = GroundTruthTripleSampler(swap_metric='manhattan').init(data)
+    a, p, n = triple_sampler.batch_sample_factors_triplet(np.random.randint(0, len(data), size=1000))
+    assert np.all(np.abs(a - p).sum(axis=-1) <= np.abs(a - n).sum(axis=-1))
+    # triplets should be sorted by the number of differing factors
+    dist_sampler = GroundTruthDistSampler(num_samples=3, triplet_sample_mode='factors').init(data)
+    a, p, n = np.moveaxis(data.idx_to_pos(dist_sampler.sample_batch(np.random.randint(0, len(data), size=1000))), 1, 0)
+    assert np.all(np.sum(a != p, axis=-1) <= np.sum(a != n, axis=-1))
+    # random walks should move at most the maximum distance
+    walk_sampler = GroundTruthRandomWalkSampler(num_samples=3, p_dist_max=2, n_dist_max=3).init(data)
+    a, p, n = np.moveaxis(data.idx_to_pos(walk_sampler.sample_batch(np.random.randint(0, len(data), size=1000))), 1, 0)
+    assert np.all(np.abs(a - p).sum(axis=-1) <= 2)
+    assert np.all(np.abs(p - n).sum(axis=-1) <= 3)
+
+
+@pytest.mark.parametrize('factor_sizes', [
+    [3, 6, 40, 32, 32],
+    [10, 10, 10, 8, 4, 15],
+    [1, 7, 1, 13, 2],
+    [2**31-1, 2**31-3, 2**31-5, 7],  # large values should fall back to python integers
+])
+def test_factor_dist_scaled(factor_sizes):
+    from disent.dataset.sampling._groundtruth__dist import factor_dist
+    from disent.dataset.sampling._groundtruth__dist import factor_dist_scale
+    from disent.dataset.sampling._groundtruth__dist import factor_dist_scaled
+    from disent.dataset.sampling._groundtruth__dist import factor_dist_weights
+    # sample random triplets
+    a, p, n = np.random.randint(0, factor_sizes, size=(3, 1000, len(factor_sizes)))
+    # compute the exact reference values with fractions
+    scale = factor_dist_scale(factor_sizes)
+    p_frac = np.array([factor_dist(x, y, scale=scale) for x, y in zip(a, p)])
+    n_frac = np.array([factor_dist(x, y, scale=scale) for x, y in zip(a, n)])
+    # compute the integer values
+    weights = factor_dist_weights(scale)
+    p_ints = factor_dist_scaled(a, p, weights=weights)
+    n_ints = factor_dist_scaled(a, n, weights=weights)
+    # check that the decisions are identical
+    assert np.all((p_frac > n_frac) == (p_ints > n_ints))
+    assert np.all((p_frac == n_frac) == (p_ints == n_ints))
@@ -0,0 +1,129 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+
+import numpy as np
+import pytest
+import pytorch_lightning as pl
+from torch.utils.data import DataLoader
+
+from disent.dataset import DisentDataset
+from disent.dataset.data import XYObjectData
+from disent.dataset.transform import ToImgTensorF32
+from disent.frameworks.vae import BetaVae
+from disent.model import AutoEncoder
+from disent.model.ae import DecoderLinear
+from disent.model.ae import EncoderLinear
+from disent.schedule import *
+
+
+# ========================================================================= #
+# TEST SCHEDULES                                                            #
+# ========================================================================= #
+
+
+_TEST_SCHEDULES = [
+    NoopSchedule(),
+    MultiplySchedule(r=0.5),
+    FixedValueSchedule(value=3.0),
+    FixedValueSchedule(value=3.0, schedule=LinearSchedule(start_step=10, end_step=50)),
+    LinearSchedule(start_step=10, end_step=50, r_start=0.9, r_end=0.2),
+    CyclicSchedule(period=30, start_step=None, repeats=None, r_start=0.1, r_end=0.8, mode='linear'),
+    CyclicSchedule(period=30, start_step=20, repeats=2, r_start=0.9, r_end=0.2, end_mode='start', mode='sigmoid', p_low=0.25),
+    CyclicSchedule(period=30, start_step=20, repeats=2, r_start=0.9, r_end=0.2, end_mode='end', mode='cosine', p_high=0.25),
+    SingleSchedule(start_step=10, end_step=90, r_start=0.8, r_end=0.1, mode='cosine'),
+    CosineWaveSchedule(period=40, r_start=0.2, r_end=0.9),
+    ClipSchedule(CosineWaveSchedule(period=40), min_step=10, max_step=70, min_value=0.1, max_value=0.8),
+    ClipSchedule(LinearSchedule(start_step=0, end_step=50), shift_step=5),
+]
+
+
+@pytest.mark.parametrize('schedule', _TEST_SCHEDULES)
+def test_schedule_compute_values(schedule):
+    steps = np.arange(120)
+    # vectorized & precompiled values should match the original values
+    targets = np.array([schedule.compute_value(int(step), 2.0) for step in steps], dtype='float64')
+    assert np.allclose(schedule.compute_values(steps, 2.0), targets)
+    compiled = schedule.compile(max_steps=100, value=2.0)
+    assert compiled.table.shape == (101,)
+    assert np.allclose(compiled.compute_values(steps, 2.0), targets)
+    assert np.allclose([compiled(int(step), 2.0) for step in steps], targets)
+    # values that were not compiled fall back to the original schedule
+    assert np.allclose(compiled.compute_values(steps, 3.0), [schedule.compute_value(int(step), 3.0) for step in steps])
+    assert np.allclose(compiled(55.5, 2.0), schedule(55.5, 2.0))
+    # tables are not nested
+    assert compiled.compile(max_steps=10, value=1.0).schedule is schedule
+
+
+class _ScalarSchedule(Schedule):
+    def __init__(self, start: int):
+        self.start = start
+    def compute_value(self, step: int, value):
+        if step < self.start:
+            return value
+        return value * 2
+
+
+def test_framework_compiled_schedules():
+    data = XYObjectData()
+    dataloader = DataLoader(DisentDataset(data, transform=ToImgTensorF32()), batch_size=4, shuffle=True)
+    framework = BetaVae(
+        model=AutoEncoder(
+            encoder=EncoderLinear(x_shape=data.x_shape, z_size=6, z_multiplier=2),
+            decoder=DecoderLinear(x_shape=data.x_shape, z_size=6),
+        ),
+        cfg=BetaVae.cfg(beta=4),
+    )
+    schedule = CyclicSchedule(period=7)
+    framework.register_schedule('beta', schedule)
+    # train
+    trainer = pl.Trainer(logger=False, checkpoint_callback=False, max_steps=12, enable_progress_bar=False, enable_model_summary=False)
+    trainer.fit(framework, dataloader)
+    # the schedule is compiled for the whole run, and the value of the last step is used
+    (initial_val, compiled), = framework._compiled_schedules.values()
+    assert isinstance(compiled, CompiledSchedule) and (compiled.max_steps == 12) and (compiled.schedule is schedule)
+    assert initial_val == 4
+    assert framework.cfg.beta == pytest.approx(schedule(11, 4))
+    # registering a new schedule resets the tables
+    framework.remove_schedule('beta')
+    assert framework._compiled_schedules is None
+    # schedules that only support scalar steps are not compiled
+    beta = framework.cfg.beta
+    framework.register_schedule('beta', _ScalarSchedule(start=5))
+    trainer = pl.Trainer(logger=False, checkpoint_callback=False, max_steps=12, enable_progress_bar=False, enable_model_summary=False)
+    trainer.fit(framework, dataloader)
+    (_, uncompiled), = framework._compiled_schedules.values()
+    assert isinstance(uncompiled, _ScalarSchedule)
+    assert framework.cfg.beta == pytest.approx(beta * 2)
+    framework.remove_schedule('beta')
+    # the schedules are not compiled if the number of steps is unknown
+    framework.register_schedule('beta', schedule)
+    for max_steps in [None, -1]:
+        (_, uncompiled), = framework._compile_schedules(max_steps=max_steps).values()
+        assert uncompiled is schedule
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
@@ -23,8 +23,13 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import numpy as np
+import pytest
 
 from disent.dataset.util.state_space import StateSpace
+from disent.dataset.util.state_space import _idx_to_pos
+from disent.dataset.util.state_space import _np_idx_to_pos
+from disent.dataset.util.state_space import _np_pos_to_idx
+from disent.dataset.util.state_space import _pos_to_idx
 
 
 # ========================================================================= #
@@ -83,6 +88,112 @@ def test_new_functions():
     # print(np.max([s.resample_radius([[0, 1, 2], [0, 0, 0]], resample_radius=1, distinct=True) for i in range(1000)], axis=0).tolist())
 
 
+def _orig_idx_to_pos(indices, factor_sizes):
+    return np.moveaxis(np.array(np.unravel_index(indices, factor_sizes)), source=0, destination=-1)
+
+
+def _orig_pos_to_idx(positions, factor_sizes):
+    return np.ravel_multi_index(np.moveaxis(positions, source=-1, destination=0), factor_sizes)
+
+
+def _orig_sample_missing_factors(states, known_factors, known_factor_indices):
+    known_factors = np.atleast_1d(known_factors)
+    known_factor_indices = np.atleast_1d(known_factor_indices)
+    known_mask = np.zeros(states.num_factors, dtype='bool')
+    known_mask[known_factor_indices] = True
+    all_factors = np.zeros((*known_factors.shape[:-1], states.num_factors), dtype='int')
+    all_factors[..., known_mask] = known_factors
+    all_factors[..., ~known_mask] = states.sample_factors(size=known_factors.shape[:-1], factor_indices=~known_mask)
+    return all_factors
+
+
+def test_kernels_equivalent():
+    for factor_sizes in FACTOR_SIZES:
+        states = StateSpace(factor_sizes=factor_sizes)
+        idxs = np.random.randint(0, len(states), size=257)
+        pos = _orig_idx_to_pos(idxs, factor_sizes)
+        # numba & numpy kernels should give the same results
+        for idx_to_pos, pos_to_idx in [(_idx_to_pos, _pos_to_idx), (_np_idx_to_pos, _np_pos_to_idx)]:
+            assert np.array_equal(idx_to_pos(idxs, states.factor_sizes, states.factor_multipliers), pos)
+            assert np.array_equal(pos_to_idx(pos, states.factor_sizes, states.factor_multipliers), idxs)
+            with pytest.raises(ValueError):
+                idx_to_pos(np.array([0, len(states)]), states.factor_sizes, states.factor_multipliers)
+            with pytest.raises(ValueError):
+                pos_to_idx(np.array([states.factor_sizes]), states.factor_sizes, states.factor_multipliers)
+
+
+def test_coordinate_transforms_equivalent():
+    for factor_sizes in FACTOR_SIZES:
+        states = StateSpace(factor_sizes=factor_sizes)
+        # scalars, lists & arrays of any dimension with different dtypes
+        for idxs in [0, len(states) - 1, np.int32(len(states) - 1), [0, len(states) - 1], np.random.randint(0, len(states), size=(3, 4, 5)).astype('uint16'), np.zeros((0,), dtype='int')]:
+            pos = states.idx_to_pos(idxs)
+            pos_orig = _orig_idx_to_pos(idxs, factor_sizes)
+            assert pos.shape == pos_orig.shape
+            assert pos.dtype == pos_orig.dtype
+            assert np.array_equal(pos, pos_orig)
+            # and back again
+            idxs_new = states.pos_to_idx(pos)
+            idxs_orig = _orig_pos_to_idx(pos_orig, factor_sizes)
+            assert type(idxs_new) == type(idxs_orig)
+            assert np.shape(idxs_new) == np.shape(idxs_orig)
+            assert np.array_equal(idxs_new, idxs_orig)
+            # positions as lists
+            if pos.size > 0:
+                assert np.array_equal(states.pos_to_idx(pos.tolist()), idxs_orig)
+        # invalid values
+        for invalid in [-1, len(states), [0, len(states)]]:
+            with pytest.raises(ValueError):
+                states.idx_to_pos(invalid)
+        for invalid in [states.factor_sizes, -np.ones(states.num_factors, dtype='int'), np.zeros(states.num_factors + 1, dtype='int')]:
+            with pytest.raises(ValueError):
+                states.pos_to_idx(invalid)
+        with pytest.raises(TypeError):
+            states.idx_to_pos(0.5)
+
+
+def test_resampling_equivalent():
+    states = StateSpace([2, 4, 6, 3])
+    factors = states.sample_factors(size=(5, 7))
+    for fixed in [[0], [1, 3], [3, 1, 0], [0, 1, 2, 3]]:
+        known_factors = factors[..., fixed]
+        # same results for the same seed
+        np.random.seed(7)
+        orig = _orig_sample_missing_factors(states, known_factors, fixed)
+        np.random.seed(7)
+        new = states.sample_missing_factors(known_factors, fixed)
+        assert np.array_equal(orig, new)
+        np.random.seed(7)
+        assert np.array_equal(orig, states.resample_factors(factors, fixed))
+        # masked resampling keeps the fixed factors
+        mask = np.zeros(states.num_factors, dtype='bool')
+        mask[fixed] = True
+        resampled = states.resample_factors_masked(factors, mask)
+        assert np.array_equal(resampled[..., mask], factors[..., mask])
+        assert np.all((0 <= resampled) & (resampled < states.factor_sizes))
+    # a different mask for each row
+    mask = np.random.random(factors.shape) < 0.5
+    resampled = states.resample_factors_masked(factors, mask)
+    assert np.array_equal(resampled[mask], factors[mask])
+
+
+def test_traversals_equivalent():
+    states = StateSpace([2, 4, 6, 4])
+    base_factors = states.sample_factors(size=9)
+    f_idxs = np.array([1, 3, 1, 3, 3, 1, 1, 3, 1])
+    for mode in ['interval', 'cycle', 'cycle_from_start']:
+        for num in [None, 1, 7]:
+            traversals = states.sample_random_factor_traversals(9, f_idxs=f_idxs, base_factors=base_factors, num=num, mode=mode)
+            for traversal, f_idx, factors in zip(traversals, f_idxs, base_factors):
+                assert np.array_equal(traversal, states.sample_random_factor_traversal(f_idx=f_idx, base_factors=factors, num=num, mode=mode))
+    # random traversals
+    traversals = states.sample_random_factor_traversals(5, num=3)
+    assert traversals.shape == (5, 3, 4)
+    assert states.sample_random_factor_traversals(5, f_idxs=2).shape == (5, 6, 4)
+    with pytest.raises(ValueError):
+        states.sample_random_factor_traversals(5, f_idxs=[0, 1, 2, 3, 0])
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
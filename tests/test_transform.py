@@ -23,8 +23,13 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 import pytest
 import torch
+from torch.utils.data import DataLoader
 
+from disent.dataset import DisentDataset
+from disent.dataset.data import XYObjectData
+from disent.dataset.transform import DisentDatasetTransform
 from disent.dataset.transform import FftGaussianBlur
+from disent.dataset.transform import ToImgTensorF32
 from disent.dataset.transform._augment import _expand_to_min_max_tuples
 from disent.nn.functional import torch_gaussian_kernel
 from disent.nn.functional import torch_gaussian_kernel_2d
@@ -64,6 +69,27 @@ def test_fft_guassian_blur():
     fn(torch.randn(256, 3, 64, 64))
 
 
+def test_split_u8_transform_after_collate():
+    data = XYObjectData(grid_size=4, grid_spacing=1, min_square_size=1, max_square_size=2, square_size_spacing=1)
+    for size, mean, std in [(None, None, None), (None, [0.1, 0.2, 0.3], [0.5, 0.25, 0.125]), (9, [0.25]*3, [0.3]*3)]:
+        transform = ToImgTensorF32(size=size, mean=mean, std=std)
+        worker_transform, batch_transform = transform.split_u8()
+        # reference: float32 observations from workers
+        dataset = DisentDataset(data, transform=transform)
+        # uint8 observations from workers, converted after collating
+        dataset_u8 = DisentDataset(data, transform=worker_transform)
+        convert = DisentDatasetTransform(transform_obs=batch_transform)
+        for batch, batch_u8 in zip(DataLoader(dataset, batch_size=16), DataLoader(dataset_u8, batch_size=16)):
+            (x_u8,) = batch_u8['x_targ']
+            assert x_u8.dtype == torch.uint8
+            (x,) = convert(batch_u8)['x_targ']
+            assert x.dtype == torch.float32
+            assert torch.equal(x, batch['x_targ'][0])
+        # single observations
+        obs = data[7]
+        assert torch.equal(batch_transform(worker_transform(obs)), transform(obs))
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #